@@ -0,0 +1,162 @@
+"""Per-route latency benchmark.
+
+    python -m benchmarks.generate --database /tmp/bench.sqlite
+    python -m benchmarks.bench_routes --database /tmp/bench.sqlite --save baseline.json
+    python -m benchmarks.bench_routes --database /tmp/bench.sqlite --compare baseline.json
+
+Every route is called through the Flask test client against a database
+made by benchmarks.generate. The p50 / p95 / p99 latency and throughput of
+each route are printed, can be saved as a baseline, and compared against
+one; a route whose p95 got worse by more than --tolerance fails the run.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from benchmarks.generate import SHIFT_START_HOUR, SLOTS_PER_SHIFT
+from in_database import create_app
+from in_database.db import get_db
+from in_database.scheduling import get_day
+
+
+def percentile(samples, fraction):
+    """Return the value at ``fraction`` of the sorted ``samples``."""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+
+    return ordered[index]
+
+
+def routes(rng, doctors, locations):
+    """Return (name, function making one request) for every benchmarked
+    route. Each call picks a random doctor / location.
+    """
+    now = int(time.time())
+
+    def doctor():
+        return rng.randint(1, doctors)
+
+    def location():
+        return rng.randint(1, locations)
+
+    def book(client):
+        # a random 15 minute slot of today's shift, some of which are taken
+        shift_start = get_day(now) + SHIFT_START_HOUR * 3600
+        return client.post('/doctors/make_appointment/', json={
+            'doctor_id': doctor(), 'location_id': location(),
+            'apmnt_time': shift_start + rng.randrange(SLOTS_PER_SHIFT) * 900})
+
+    return [
+        ('list_doctors', lambda client: client.get('/doctors')),
+        ('list_doctor', lambda client: client.get('/doctors/{}'.format(doctor()))),
+        ('list_doctor_locations',
+         lambda client: client.get('/doctors/{}/locations'.format(doctor()))),
+        ('get_doctor_appointments',
+         lambda client: client.get('/doctors/appointment/{}'.format(doctor()))),
+        ('get_doctor_sched',
+         lambda client: client.get('/doctors/weekly_schedule/{}'.format(doctor()))),
+        ('doctor_free_slots',
+         lambda client: client.get('/doctors/{}/free_slots?start={}&end={}'.format(
+             doctor(), now, now + 7 * 86400))),
+        ('location_first_available',
+         lambda client: client.get('/locations/{}/first_available?n=10'.format(location()))),
+        ('schedule_appointment', book),
+    ]
+
+
+def bench(app, requests, doctors, locations, seed=0, only=None):
+    """Run ``requests`` calls of every route and return their stats."""
+    rng = random.Random(seed)
+    client = app.test_client()
+    results = {}
+
+    for name, call in routes(rng, doctors, locations):
+        if only and name not in only:
+            continue
+
+        samples = []
+        errors = 0
+        started = time.perf_counter()
+
+        for _ in range(requests):
+            t0 = time.perf_counter()
+            rv = call(client)
+            samples.append((time.perf_counter() - t0) * 1000)
+
+            if rv.status_code >= 400:
+                errors += 1
+
+        elapsed = time.perf_counter() - started
+        results[name] = {
+            'requests': requests,
+            'errors': errors,
+            'p50_ms': round(percentile(samples, 0.50), 3),
+            'p95_ms': round(percentile(samples, 0.95), 3),
+            'p99_ms': round(percentile(samples, 0.99), 3),
+            'rps': round(requests / elapsed, 1),
+        }
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return the routes whose p95 is more than ``tolerance`` (a fraction)
+    slower than in ``baseline``.
+    """
+    regressions = []
+
+    for name, stats in sorted(results.items()):
+        before = baseline.get(name)
+
+        if before and stats['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append((name, before['p95_ms'], stats['p95_ms']))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark every route.')
+    parser.add_argument('--database', required=True,
+                        help='Database made by benchmarks.generate')
+    parser.add_argument('--requests', type=int, default=500, help='Requests per route')
+    parser.add_argument('--route', action='append', dest='only', help='Only run this route')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Baseline JSON file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed p95 slowdown against the baseline (0.25 = 25%%)')
+    args = parser.parse_args(argv)
+
+    app = create_app({'DATABASE': args.database})
+
+    with app.app_context():
+        doctors = get_db().execute('SELECT COUNT(*) FROM doctors').fetchone()[0]
+        locations = get_db().execute('SELECT COUNT(*) FROM locations').fetchone()[0]
+
+    results = bench(app, args.requests, doctors, locations, args.seed, args.only)
+
+    print('{:<26} {:>9} {:>9} {:>9} {:>9} {:>7}'.format(
+        'route', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'errors'))
+    for name, stats in results.items():
+        print('{:<26} {p50_ms:>9} {p95_ms:>9} {p99_ms:>9} {rps:>9} {errors:>7}'.format(
+            name, **stats))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+        for name, before, after in regressions:
+            print('REGRESSION {}: p95 {} ms -> {} ms'.format(name, before, after))
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
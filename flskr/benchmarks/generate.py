@@ -0,0 +1,150 @@
+"""Deterministic synthetic data for the benchmarks.
+
+    python -m benchmarks.generate --database /tmp/bench.sqlite \
+        --doctors 500 --locations 50 --days 365 --appointments 2000000
+
+The same arguments (including --seed and --start-date) always produce the
+same rows. Rows are streamed through the bulk import path, so memory stays
+flat however many appointments are generated.
+"""
+import argparse
+import random
+from datetime import date, datetime, timedelta
+
+from in_database import bulk, create_app, db
+
+
+FIRST_NAMES = ['Ada', 'Ben', 'Cleo', 'Dev', 'Eve', 'Finn', 'Gus', 'Hana', 'Ivan', 'June']
+LAST_NAMES = ['Adams', 'Baker', 'Chen', 'Diaz', 'Evans', 'Fox', 'Garcia', 'Hill', 'Ito', 'Jones']
+
+# Shifts run 08:00 - 17:00 local time on weekdays, booked in 15 minute slots.
+SHIFT_START_HOUR = 8
+SHIFT_HOURS = 9
+SLOTS_PER_SHIFT = SHIFT_HOURS * 4
+
+
+def midnight(day):
+    return int(datetime.combine(day, datetime.min.time()).timestamp())
+
+
+def work_days(start_date, days):
+    """Return the weekdays among ``days`` days from ``start_date``."""
+    return [start_date + timedelta(days=i) for i in range(days)
+            if (start_date + timedelta(days=i)).weekday() < 5]
+
+
+def generate_doctors(count):
+    for i in range(count):
+        yield {'id': i + 1,
+               'first_name': FIRST_NAMES[i % len(FIRST_NAMES)],
+               'last_name': LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)]}
+
+
+def generate_locations(count):
+    for i in range(count):
+        yield {'id': i + 1, 'address': '{} Main St'.format(i + 1)}
+
+
+def generate_assignments(rng, doctors, locations):
+    """Assign each doctor to one to three locations."""
+    for doctor_id in range(1, doctors + 1):
+        for location_id in rng.sample(range(1, locations + 1), min(locations, rng.randint(1, 3))):
+            yield {'doctor_id': doctor_id, 'location_id': location_id}
+
+
+def generate_shifts(doctors, days):
+    for doctor_id in range(1, doctors + 1):
+        for day in days:
+            start = midnight(day) + SHIFT_START_HOUR * 3600
+            yield {'day_stamp': midnight(day), 'doctor_id': doctor_id,
+                   'shift_start': start, 'shift_end': start + SHIFT_HOURS * 3600}
+
+
+def generate_appointments(rng, doctors, locations, days, count, cancel_rate=0.1):
+    """Spread ``count`` appointments evenly over every doctor's shifts,
+    never two in the same 15 minute slot, with ``cancel_rate`` of them
+    cancelled.
+    """
+    shifts = doctors * len(days)
+    if not shifts:
+        return
+
+    per_shift, extra = divmod(count, shifts)
+
+    n = 0
+    for doctor_id in range(1, doctors + 1):
+        location_id = rng.randint(1, locations)
+
+        for day in days:
+            start = midnight(day) + SHIFT_START_HOUR * 3600
+            booked = per_shift + (1 if n < extra else 0)
+            n += 1
+
+            for slot in sorted(rng.sample(range(SLOTS_PER_SHIFT), booked)):
+                yield {'day_stamp': midnight(day), 'doctor_id': doctor_id,
+                       'location_id': location_id, 'apmnt_time': start + slot * 900,
+                       'is_canceled': 1 if rng.random() < cancel_rate else 0}
+
+
+def generate(app, doctors, locations, days, appointments, seed=0, start_date=None,
+             chunk_size=50000):
+    """Recreate the app's database and fill it with synthetic data.
+
+    :param days: Number of days of shifts, centred on ``start_date``
+    :return: {kind: rows inserted}
+    """
+    rng = random.Random(seed)
+    start_date = start_date or date.today()
+    days = work_days(start_date - timedelta(days=days // 2), days)
+
+    if appointments > doctors * len(days) * SLOTS_PER_SHIFT:
+        raise ValueError('At most {} appointments fit in these shifts'.format(
+            doctors * len(days) * SLOTS_PER_SHIFT))
+
+    sources = [
+        ('doctors', generate_doctors(doctors)),
+        ('locations', generate_locations(locations)),
+        ('assignments', generate_assignments(rng, doctors, locations)),
+        ('shifts', generate_shifts(doctors, days)),
+        ('appointments', generate_appointments(rng, doctors, locations, days, appointments)),
+    ]
+    counts = {}
+
+    with app.app_context():
+        db.init_db()
+        conn = db.get_db()
+
+        # drop the sample rows schema.sql ships with
+        conn.executescript(
+            'DELETE FROM appointments; DELETE FROM doctor_hours; '
+            'DELETE FROM doctor_locations; DELETE FROM locations; DELETE FROM doctors;'
+        )
+
+        for kind, records in sources:
+            counts[kind] = bulk.import_rows(conn, kind, bulk.to_rows(kind, records), chunk_size)
+
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic benchmark database.')
+    parser.add_argument('--database', required=True)
+    parser.add_argument('--doctors', type=int, default=100)
+    parser.add_argument('--locations', type=int, default=20)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--appointments', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start-date', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        default=None, help='Centre of the generated date range (YYYY-MM-DD)')
+    args = parser.parse_args(argv)
+
+    app = create_app({'DATABASE': args.database})
+    counts = generate(app, args.doctors, args.locations, args.days, args.appointments,
+                      args.seed, args.start_date)
+
+    for kind, count in counts.items():
+        print('{:>12} {}'.format(count, kind))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""Concurrent booking stress test.
+
+    python -m benchmarks.stress_booking --database /tmp/stress.sqlite \
+        --processes 4 --threads 8 --requests 200 --doctors 2
+
+Starts --processes worker processes, each with its own app (and so its own
+connection pool and scheduling index) and --threads threads, all booking
+appointments for the same few doctors at deliberately clashing times and
+cancelling some appointments booked before the run. Reports accepted
+bookings per second, "database is locked" errors and the total time write
+transactions spent waiting for SQLite's write lock, whether they then got
+it or not.
+
+Two invariants are then checked. No two live appointments for a doctor
+may be within 15 minutes of each other. And the app that booked the
+pre-run appointments, whose scheduling index still holds them, must
+accept every slot the database shows as free: cancellations made by other
+processes must not leave it turning bookings down. Exits with status 1 if
+either is broken.
+"""
+import argparse
+import multiprocessing
+import random
+import sys
+import threading
+import time
+
+from benchmarks.bench_routes import percentile
+from in_database import create_app
+from in_database.db import close_pool, get_db, get_pool, get_writer, init_db
+from in_database.scheduling import APPOINTMENT_WINDOW, get_day, is_available
+
+
+def setup(database, doctors, days=30):
+    """Create a database with ``doctors`` doctors at one location, each on
+    one long shift starting today. Returns the shift start.
+    """
+    app = create_app({'DATABASE': database})
+    shift_start = get_day(time.time())
+
+    with app.app_context():
+        init_db()
+        db = get_db()
+        db.executescript(
+            'DELETE FROM appointments; DELETE FROM doctor_hours; '
+            'DELETE FROM doctor_locations; DELETE FROM locations; DELETE FROM doctors;'
+        )
+        db.execute("INSERT INTO locations (id, address) VALUES (1, '1 Stress Test Way')")
+        for doctor_id in range(1, doctors + 1):
+            db.execute("INSERT INTO doctors (id, first_name, last_name) VALUES (?, 'Load', 'Test')",
+                       (doctor_id, ))
+            db.execute('INSERT INTO doctor_locations (doctor_id, location_id) VALUES (?, 1)',
+                       (doctor_id, ))
+            db.execute('INSERT INTO doctor_hours (day_stamp, doctor_id, shift_start, shift_end) '
+                       'VALUES (?, ?, ?, ?)',
+                       (shift_start, doctor_id, shift_start, shift_start + days * 86400))
+        db.commit()
+
+    close_pool(app)
+
+    return shift_start
+
+
+def find_double_bookings(conn):
+    """Return (id, id) pairs of live appointments for the same doctor that
+    are within APPOINTMENT_WINDOW seconds of each other.
+    """
+    return [tuple(row) for row in conn.execute(
+        'SELECT a.id, b.id FROM appointments a '
+        'INNER JOIN appointments b ON b.doctor_id = a.doctor_id AND b.id > a.id '
+        'AND b.apmnt_time BETWEEN a.apmnt_time - ? AND a.apmnt_time + ? '
+        'WHERE a.is_canceled = 0 AND b.is_canceled = 0',
+        (APPOINTMENT_WINDOW, APPOINTMENT_WINDOW)
+    ).fetchall()]
+
+
+def find_wrong_rejections(app, doctors, shift_start, slots):
+    """Try to book, through ``app``, every slot the database shows as free
+    and return the (doctor_id, apmnt_time) pairs it turned down.
+    """
+    client = app.test_client()
+    wrong = []
+
+    for doctor_id in range(1, doctors + 1):
+        for slot in range(slots):
+            apmnt_time = shift_start + slot * 300
+
+            with app.app_context():
+                if not is_available(get_db(), doctor_id, apmnt_time):
+                    continue
+
+            rv = client.post('/doctors/make_appointment/', json={
+                'doctor_id': doctor_id, 'location_id': 1, 'apmnt_time': apmnt_time})
+
+            if not isinstance((rv.get_json(silent=True) or {}).get('Appointment ID: '), int):
+                wrong.append((doctor_id, apmnt_time))
+
+    return wrong
+
+
+def worker(database, seed, threads, requests, doctors, shift_start, slots, start_at,
+           group_commit=False, cancellable=(), cancel_rate=0.0):
+    """Run one process's share of the load; returns its raw samples and the
+    milliseconds its write transactions waited for the write lock.
+    """
+    app = create_app({'DATABASE': database, 'DB_GROUP_COMMIT': group_commit})
+    results = []
+    lock = threading.Lock()
+
+    def run(thread_seed):
+        rng = random.Random(thread_seed)
+        client = app.test_client()
+        samples = []
+
+        while time.time() < start_at:
+            time.sleep(0.001)
+
+        for _ in range(requests):
+            # slots are 5 minutes apart, so neighbouring bookings clash
+            apmnt_time = shift_start + rng.randrange(slots) * 300
+            t0 = time.perf_counter()
+            rv = client.post('/doctors/make_appointment/', json={
+                'doctor_id': rng.randint(1, doctors), 'location_id': 1,
+                'apmnt_time': apmnt_time})
+            elapsed = (time.perf_counter() - t0) * 1000
+
+            body = rv.get_json(silent=True) or {}
+            detail = str(body.get('error_detail', ''))
+            if 'locked' in detail:
+                outcome = 'locked'
+            elif isinstance(body.get('Appointment ID: '), int):
+                outcome = 'accepted'
+            elif rv.status_code == 200:
+                outcome = 'rejected'
+            else:
+                outcome = 'error'
+
+            samples.append((outcome, elapsed))
+
+            if cancellable and rng.random() < cancel_rate:
+                t0 = time.perf_counter()
+                client.post('/doctors/appointment/cancel', json={
+                    'appointment_id': rng.choice(cancellable)})
+                samples.append(('cancelled', (time.perf_counter() - t0) * 1000))
+
+        with lock:
+            results.extend(samples)
+
+    pool = [threading.Thread(target=run, args=(seed * 1000 + i, )) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+    with app.app_context():
+        if group_commit:
+            lock_wait_ms = get_writer().stats()['lock_wait_ms']
+        else:
+            lock_wait_ms = get_pool().stats()['write_lock_wait_ms']
+
+    close_pool(app)
+
+    return results, lock_wait_ms
+
+
+def _worker(args):
+    return worker(*args)
+
+
+def stress(database, processes=4, threads=4, requests=100, doctors=1, slots=200, seed=0,
+           group_commit=False, cancel_rate=0.2):
+    """Run the stress test against a freshly set up database and return a
+    summary of what happened.
+    """
+    shift_start = setup(database, doctors)
+
+    # Book every sixth slot up front; the workers cancel some of these, so
+    # the observer's index ends up holding appointments that are gone.
+    observer = create_app({'DATABASE': database})
+    client = observer.test_client()
+    cancellable = []
+    for doctor_id in range(1, doctors + 1):
+        for slot in range(0, slots, 6):
+            rv = client.post('/doctors/make_appointment/', json={
+                'doctor_id': doctor_id, 'location_id': 1, 'apmnt_time': shift_start + slot * 300})
+            cancellable.append(rv.get_json()['Appointment ID: '])
+
+    start_at = time.time() + 0.5
+    jobs = [(database, seed + i, threads, requests, doctors, shift_start, slots, start_at,
+             group_commit, cancellable, cancel_rate) for i in range(processes)]
+
+    started = time.perf_counter()
+    if processes == 1:
+        results = [_worker(jobs[0])]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(_worker, jobs)
+    samples = [sample for result, lock_wait_ms in results for sample in result]
+    elapsed = time.perf_counter() - started - max(0, start_at - time.time())
+
+    wrong_rejections = find_wrong_rejections(observer, doctors, shift_start, slots)
+    with observer.app_context():
+        double_bookings = find_double_bookings(get_db())
+    close_pool(observer)
+
+    def count(outcome):
+        return sum(1 for sample in samples if sample[0] == outcome)
+
+    latencies = [ms for outcome, ms in samples if outcome != 'cancelled']
+
+    return {
+        'requests': len(latencies),
+        'accepted': count('accepted'),
+        'rejected': count('rejected'),
+        'locked': count('locked'),
+        'errors': count('error'),
+        'cancelled': count('cancelled'),
+        'accepted_per_s': round(count('accepted') / elapsed, 1),
+        'requests_per_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 3) if latencies else 0,
+        'p99_ms': round(percentile(latencies, 0.99), 3) if latencies else 0,
+        'lock_wait_ms': round(sum(lock_wait_ms for result, lock_wait_ms in results), 3),
+        'double_bookings': double_bookings,
+        'wrong_rejections': wrong_rejections,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stress concurrent appointment booking.')
+    parser.add_argument('--database', required=True, help='Scratch database; it is recreated')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4, help='Threads per process')
+    parser.add_argument('--requests', type=int, default=100, help='Bookings per thread')
+    parser.add_argument('--doctors', type=int, default=1)
+    parser.add_argument('--slots', type=int, default=200,
+                        help='Distinct booking times, 5 minutes apart, per doctor')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--group-commit', action='store_true',
+                        help='Run the workers with DB_GROUP_COMMIT on')
+    parser.add_argument('--cancel-rate', type=float, default=0.2,
+                        help='Chance per booking that a worker also cancels a pre-run one')
+    args = parser.parse_args(argv)
+
+    summary = stress(args.database, args.processes, args.threads, args.requests,
+                     args.doctors, args.slots, args.seed, args.group_commit, args.cancel_rate)
+
+    for key, value in summary.items():
+        if key not in ('double_bookings', 'wrong_rejections'):
+            print('{:>16}: {}'.format(key, value))
+
+    print('{:>16}: {}'.format('double_bookings', len(summary['double_bookings'])))
+    print('{:>16}: {}'.format('wrong_rejections', len(summary['wrong_rejections'])))
+
+    if summary['double_bookings']:
+        for first, second in summary['double_bookings'][:10]:
+            print('  appointments {} and {} overlap'.format(first, second))
+
+    if summary['wrong_rejections']:
+        for doctor_id, apmnt_time in summary['wrong_rejections'][:10]:
+            print('  doctor {} turned down at free slot {}'.format(doctor_id, apmnt_time))
+
+    if summary['double_bookings'] or summary['wrong_rejections']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
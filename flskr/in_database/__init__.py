@@ -1,9 +1,11 @@
 import os
 import time
-from datetime import date, datetime 
 
 from flask import Flask, jsonify, request
-from in_database import db
+from in_database import (
+    availability, bulk, cache, db, includes, metrics, pagination, schedules, scheduling,
+    serialize, shift_rules, versions
+)
 
 
 # Program & structure influenced heavily by the Flask tutorial
@@ -16,6 +18,65 @@ def create_app(test_config=None):
         SECRET_KEY='dev',
         # store the database in the instance folder
         DATABASE=os.path.join(app.instance_path, 'doctors.sqlite'),
+        # connections kept open per worker process and how long a request
+        # waits for one before an overflow connection is opened
+        DB_POOL_SIZE=8,
+        DB_POOL_TIMEOUT=5.0,
+        # pragmas applied to every pooled connection; None leaves the
+        # SQLite default in place
+        DB_JOURNAL_MODE='wal',
+        DB_SYNCHRONOUS='normal',
+        DB_CACHE_SIZE=-16000,
+        DB_MMAP_SIZE=268435456,
+        DB_BUSY_TIMEOUT=5000,
+        DB_TEMP_STORE='memory',
+        # coalesce writes arriving within DB_GROUP_COMMIT_WINDOW seconds into
+        # one transaction on a writer thread (see db.GroupCommitWriter)
+        DB_GROUP_COMMIT=False,
+        DB_GROUP_COMMIT_WINDOW=0.002,
+        DB_GROUP_COMMIT_MAX_JOBS=256,
+        # GET / HEAD requests read through a separate pool of mode=ro
+        # connections, optionally also set to query_only
+        DB_READONLY_GETS=True,
+        DB_READ_QUERY_ONLY=True,
+        # count requests and SQL statements per route for /metrics
+        METRICS_ENABLED=True,
+        # statements slower than this (ms) are logged with their query plan
+        # and listed at /stats/slow_queries; None turns the log off
+        DB_SLOW_QUERY_MS=100,
+        # largest number of appointments accepted by one batch booking
+        BATCH_MAX_APPOINTMENTS=1000,
+        # largest number of shifts accepted by one bulk hours upload
+        BULK_MAX_SHIFTS=1000,
+        # largest number of IDs one batch read (e.g. /doctors?ids=) accepts
+        BATCH_MAX_IDS=100,
+        # default and largest page size for the paginated list endpoints
+        PAGE_SIZE_DEFAULT=100,
+        PAGE_SIZE_MAX=1000,
+        # read cache for doctor and location lookups; the TTL (seconds)
+        # bounds how long writes made by other workers can go unseen
+        CACHE_MAX_ENTRIES=4096,
+        CACHE_TTL=60,
+        # widest date range a free slot search may cover
+        SLOT_SEARCH_MAX_DAYS=31,
+        # results returned by a first available search by default / at most
+        FIRST_AVAILABLE_DEFAULT=5,
+        FIRST_AVAILABLE_MAX=100,
+        # request threads used by the ASGI entry point (asgi.py); None
+        # matches DB_POOL_SIZE
+        ASGI_MAX_WORKERS=None,
+        # locks shared out among doctors to serialize their bookings
+        BOOKING_LOCK_STRIPES=64,
+        # seconds a doctor's schedule stays in the booking index before it
+        # is reloaded; bookings it would turn down are checked against the
+        # doctor's version first either way
+        SCHEDULE_INDEX_TTL=300,
+        # doctors whose schedules the booking index keeps, least recently
+        # used first out
+        SCHEDULE_INDEX_SIZE=1024,
+        # seconds either side of a booking the index loads a doctor's
+        # schedule for; None loads all of it
+        SCHEDULE_INDEX_HORIZON=30 * 86400,
     )
 
     if test_config is None:
@@ -33,31 +94,195 @@ def create_app(test_config=None):
 
     # Register the database commands
     db.init_app(app)
+    bulk.init_app(app)
+    metrics.init_app(app)
+
+
+    # Reports connection pool checkout stats for this worker
+    @app.route('/stats/pool', methods=['GET'])
+    def pool_stats():
+        """
+        Get the connection pool counters for this worker process
+
+        :return: Pool size, open / idle connections and checkout counters,
+            plus the group commit counters when DB_GROUP_COMMIT is on and
+            the read-only pool's counters when DB_READONLY_GETS is on
+        """
+        stats = db.get_pool().stats()
+
+        if app.config['DB_GROUP_COMMIT']:
+            stats['group_commit'] = db.get_writer().stats()
+
+        if app.config['DB_READONLY_GETS']:
+            stats['readonly'] = db.get_pool(readonly=True).stats()
+
+        return jsonify(stats), 200
+
+
+    # Reports read cache hit / miss counters for this worker
+    @app.route('/stats/cache', methods=['GET'])
+    def cache_stats():
+        """
+        Get the read cache counters for this worker process
+
+        :return: Cache size, hits, misses, evictions and invalidations
+        """
+        return jsonify(cache.get_cache().stats()), 200
+
+
+    # Statements over DB_SLOW_QUERY_MS seen by this worker
+    @app.route('/stats/slow_queries', methods=['GET'])
+    def slow_query_stats():
+        """
+        Get the slow statements seen by this worker process, slowest in
+        total first
+
+        :return: SQL text, timings, parameter shape, routes and query plan
+            of each, with needs_index set when the plan scans a whole table
+        """
+        slow_log = db.get_slow_log()
+
+        return jsonify(slow_log.report() if slow_log is not None else []), 200
+
+
+    # Request and SQL metrics for this worker, for Prometheus to scrape
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        """
+        Get request counts, errors, latency histograms and SQL query, row
+        and time counters per route for this worker process
+
+        :return: Metrics in the Prometheus text format
+        """
+        return app.response_class(metrics.get_metrics().render(),
+                                  mimetype='text/plain; version=0.0.4'), 200
 
 
     # Gets all doctors
     @app.route('/doctors', methods=['GET'])
     def list_doctors():
         """
-        Get all doctors
-
+        Get all doctors, a page at a time ordered by id, or only the ones
+        listed in ``ids``
+
+        :param limit: Page size (query string, optional)
+        :param after: Cursor from the previous page's X-Next-Cursor header
+        :param ids: Comma separated doctor IDs to fetch in one query instead
+            of a page (query string, optional)
+        :param include: Comma separated relations to embed in each doctor,
+            from locations and hours (query string, optional)
         :return: List of full doctor rows
         """
         try:
+            ids = pagination.get_ids_arg()
+            limit, after = pagination.get_page_args(1)
+            include = includes.get_include_arg()
+        except (pagination.PageError, includes.IncludeError) as e:
+            return jsonify({'error_detail': str(e)}), 400
+
+        if ids is not None:
+            return get_doctors_by_id(ids, include)
+
+        def load_doctors():
             cursor = db.get_db().cursor()
 
-            result = cursor.execute(
-                'SELECT id, first_name, last_name '
-                'FROM doctors'
-            ).fetchall()
+            if after is None:
+                result = cursor.execute(
+                    'SELECT id, first_name, last_name '
+                    'FROM doctors '
+                    'ORDER BY id LIMIT ?',
+                    (limit + 1, )
+                ).fetchall()
+            else:
+                result = cursor.execute(
+                    'SELECT id, first_name, last_name '
+                    'FROM doctors '
+                    'WHERE id > ? '
+                    'ORDER BY id LIMIT ?',
+                    (after[0], limit + 1)
+                ).fetchall()
 
-            # See https://medium.com/@PyGuyCharles/python-sql-to-json-and-beyond-3e3a36d32853
-            doctors = [dict(zip([key[0] for key in cursor.description], row)) for row in result]
+            doctors = serialize.to_dicts(result)
 
             cursor.close()
+
+            return doctors
+
+        try:
+            etag = versions.get_etag(db.get_db(), [versions.DOCTORS])
+            unchanged = versions.not_modified(etag)
+
+            if unchanged is not None and not include:
+                return unchanged
+
+            # keyed by the ETag too, so a body cached before another
+            # worker's write is never served with the ETag from after it
+            doctors = cache.get_cache().get_or_load(
+                ('doctors', limit, after and tuple(after), etag), ('doctors', ), load_doctors)
         except Exception as e:
             return e
-        return jsonify(doctors), 200
+
+        doctors, headers = pagination.paginate(doctors, limit, lambda row: (row['id'], ))
+
+        if include:
+            # the embedded rows depend on the doctors on this page, which
+            # are only known once it is loaded
+            current_day = scheduling.get_day(time.time())
+
+            try:
+                etag = includes.get_etag(db.get_db(), [versions.DOCTORS],
+                                         [doctor['id'] for doctor in doctors], include, current_day)
+                unchanged = versions.not_modified(etag)
+
+                if unchanged is not None:
+                    return unchanged
+
+                doctors = includes.embed(db.get_db(), doctors, include, current_day)
+            except Exception as e:
+                return jsonify({'error_detail': str(e)}), 404
+
+        headers.update(versions.etag_header(etag))
+
+        return serialize.json_response(doctors), 200, headers
+
+
+    def get_doctors_by_id(ids, include=()):
+        """
+        Get the doctors with the given IDs in one query, in the order
+        asked for; IDs with no doctor are left out
+        """
+        current_day = scheduling.get_day(time.time())
+
+        def load_doctors():
+            result = db.get_db().execute(
+                'SELECT id, first_name, last_name '
+                'FROM doctors '
+                'WHERE id IN ({})'.format(', '.join('?' * len(ids))),
+                ids
+            ).fetchall()
+
+            by_id = {row['id']: row for row in serialize.to_dicts(result)}
+
+            return [by_id[doctor_id] for doctor_id in ids if doctor_id in by_id]
+
+        try:
+            # a doctor created later can fill a missing ID, hence DOCTORS
+            etag = includes.get_etag(db.get_db(), [versions.DOCTORS], ids, include, current_day)
+            unchanged = versions.not_modified(etag)
+
+            if unchanged is not None:
+                return unchanged
+
+            doctors = cache.get_cache().get_or_load(
+                ('doctors', 'ids', tuple(ids), etag),
+                ['doctors'] + [cache.doctor_tag(i) for i in ids], load_doctors)
+
+            if include:
+                doctors = includes.embed(db.get_db(), doctors, include, current_day)
+        except Exception as e:
+            return jsonify({'error_detail': str(e)}), 404
+
+        return serialize.json_response(doctors), 200, versions.etag_header(etag)
 
     
     # Updates doctor names by ID
@@ -69,8 +294,6 @@ def create_app(test_config=None):
         returns "Updated from (old) to (new)"
         '''
         try:
-            cursor = db.get_db().cursor()
-
             req_data = request.get_json()
             
             try:
@@ -80,15 +303,23 @@ def create_app(test_config=None):
             except KeyError as e:
                 return jsonify({'error_detail': 'Missing required field(s)'}), 400
 
-            cursor.execute(
-                "UPDATE doctors SET "
-                "first_name = ?, "
-                "last_name = ? "
-                "WHERE id == ?",
-                (first_name, last_name, doctor_id)
-            )
-            
-            db.get_db().commit()
+            def update(conn):
+                conn.execute(
+                    "UPDATE doctors SET "
+                    "first_name = ?, "
+                    "last_name = ? "
+                    "WHERE id == ?",
+                    (first_name, last_name, doctor_id)
+                )
+
+                versions.bump(conn, versions.doctor_scope(doctor_id), versions.DOCTORS)
+                schedules.forget_doctor(conn, doctor_id)
+
+            db.run_write(update)
+
+            cache.get_cache().invalidate(cache.doctor_tag(doctor_id), 'doctors')
+
+            cursor = db.get_db().cursor()
 
             update_result = cursor.execute(
                 "SELECT * FROM doctors "
@@ -96,11 +327,15 @@ def create_app(test_config=None):
                 (doctor_id, )
             ).fetchone() 
 
-            doctor_update = dict(zip([key[0] for key in cursor.description], update_result))
+            if update_result is None:
+                cursor.close()
+                return jsonify({'error_detail': 'Doctor not found'}), 404
+
+            doctor_update = serialize.to_dict(update_result)
 
             cursor.close() 
 
-            return jsonify(doctor_update)      
+            return serialize.json_response(doctor_update)
         except Exception as e:
             return jsonify({'error_detail': str(e)}), 404
     
@@ -112,9 +347,18 @@ def create_app(test_config=None):
         Get one doctor by doc_id
 
         :param doctor_id: The id of the doctor
+        :param include: Comma separated relations to embed, from locations
+            and hours (query string, optional)
         :return: Full doctor row
         """
         try:
+            include = includes.get_include_arg()
+        except includes.IncludeError as e:
+            return jsonify({'error_detail': str(e)}), 400
+
+        current_day = scheduling.get_day(time.time())
+
+        def load_doctor():
             cursor = db.get_db().cursor()
 
             result = cursor.execute(
@@ -125,15 +369,32 @@ def create_app(test_config=None):
             ).fetchone()
 
             if result is None:
-                return jsonify({'error_detail': 'Doctor not found'}), 404
+                return None
 
-            # See https://medium.com/@PyGuyCharles/python-sql-to-json-and-beyond-3e3a36d32853
-            doctor = dict(zip([key[0] for key in cursor.description], result))
+            doctor = serialize.to_dict(result)
 
             cursor.close()
+
+            return doctor
+
+        try:
+            etag = includes.get_etag(db.get_db(), [], [doctor_id], include, current_day)
+            unchanged = versions.not_modified(etag)
+
+            if unchanged is not None:
+                return unchanged
+
+            doctor = cache.get_cache().get_or_load(
+                ('doctor', doctor_id, etag), (cache.doctor_tag(doctor_id), ), load_doctor)
+
+            if doctor is None:
+                return jsonify({'error_detail': 'Doctor not found'}), 404
+
+            if include:
+                doctor = includes.embed(db.get_db(), [doctor], include, current_day)[0]
         except Exception as e:
             return e
-        return jsonify(doctor), 200
+        return serialize.json_response(doctor), 200, versions.etag_header(etag)
 
 
     # Deletes Doctors
@@ -155,15 +416,19 @@ def create_app(test_config=None):
             except KeyError as e:
                 return jsonify({'error_detail': 'Missing required field'}), 400
 
-            cursor = db.get_db().cursor()
+            def delete(conn):
+                conn.execute(
+                    "DELETE FROM doctors WHERE id == ?",
+                    (doctor_id, )
+                )
 
-            cursor.execute(
-                "DELETE FROM doctors WHERE id == ?",
-                (doctor_id, )
-            )
-            
-            db.get_db().commit()
-            cursor.close()
+                versions.bump(conn, versions.doctor_scope(doctor_id), versions.DOCTORS)
+                schedules.forget_doctor(conn, doctor_id)
+
+            db.run_write(delete)
+
+            scheduling.get_index().forget(doctor_id)
+            cache.get_cache().invalidate(cache.doctor_tag(doctor_id), 'doctors')
         
         except Exception as e:
             return jsonify({'error_detail': str(e)}), 404
@@ -192,18 +457,20 @@ def create_app(test_config=None):
             except KeyError:
                 return jsonify({'error_detail': 'Missing required field'}), 400
 
-            cursor = db.get_db().cursor()
+            def insert(conn):
+                doctor_id = conn.execute(
+                    'INSERT INTO doctors (first_name, last_name) '
+                    'VALUES (?, ?)',
+                    (first_name, last_name)
+                ).lastrowid
 
-            cursor.execute(
-                'INSERT INTO doctors (first_name, last_name) '
-                'VALUES (?, ?)',
-                (first_name, last_name)
-            )
+                versions.bump(conn, versions.doctor_scope(doctor_id), versions.DOCTORS)
 
-            doctor_id = cursor.lastrowid
+                return doctor_id
 
-            db.get_db().commit()
-            cursor.close()
+            doctor_id = db.run_write(insert)
+
+            cache.get_cache().invalidate(cache.doctor_tag(doctor_id), 'doctors')
         except Exception as e:
             return jsonify({'error_detail': e}), 404
         return jsonify({'id': doctor_id}), 200
@@ -218,7 +485,7 @@ def create_app(test_config=None):
         :param doctor_id: The id of the doctor
         :return: List of full location rows
         """
-        try:
+        def load_locations():
             cursor = db.get_db().cursor()
 
             result = cursor.execute(
@@ -229,15 +496,21 @@ def create_app(test_config=None):
                 (doctor_id,)
             ).fetchall()
 
-            # See https://medium.com/@PyGuyCharles/python-sql-to-json-and-beyond-3e3a36d32853
-            locations = [dict(zip([key[0] for key in cursor.description], row)) for row in result]
+            locations = serialize.to_dicts(result)
 
             cursor.close()
 
+            return locations
+
+        try:
+            locations = cache.get_cache().get_or_load(
+                ('doctor_locations', doctor_id),
+                (cache.doctor_tag(doctor_id), 'locations'), load_locations)
+
         except Exception as e:
             return jsonify({'error_detail': str(e)}), 404
 
-        return jsonify(locations), 200
+        return serialize.json_response(locations), 200
 
 
     # Adds location to total list; (new building) NOT COMPLETE
@@ -245,24 +518,25 @@ def create_app(test_config=None):
     def add_locations():
         
         try:
-            cursor = db.get_db().cursor()
-
             req_data = request.get_json()
 
             try:
                 address = req_data['address']
             except KeyError:
                 return jsonify({'error_detail': 'Missing required field'}), 400
-        
-            cursor.execute(
-                "INSERT INTO locations(address) VALUES (?)",
-                (address, ) 
-            )
-            db.get_db().commit()
 
-            loc_id = cursor.lastrowid
-            
-            cursor.close()
+            def insert(conn):
+                loc_id = conn.execute(
+                    "INSERT INTO locations(address) VALUES (?)",
+                    (address, ) 
+                ).lastrowid
+                versions.bump(conn, versions.LOCATIONS)
+
+                return loc_id
+
+            loc_id = db.run_write(insert)
+
+            cache.get_cache().invalidate('locations')
         except Exception   as e:
             return jsonify(str(e)), 404
         return jsonify ({"Added Location_ID:": loc_id}), 200
@@ -272,8 +546,6 @@ def create_app(test_config=None):
     @app.route('/doctors/locations/assign', methods=['POST'])
     def assign_locations():
         try:
-            cursor = db.get_db().cursor()
-
             req_data = request.get_json()
 
             try:
@@ -281,17 +553,20 @@ def create_app(test_config=None):
                 doc_id = req_data['doctor_id']
             except KeyError:
                 return jsonify({'error_detail': 'Missing required field'}), 400
-        
-            cursor.execute(
-                "INSERT INTO doctor_locations(doctor_id, location_id) VALUES (?, ?)",
-                (doc_id, loc_id) 
-            )
 
-            db.get_db().commit()
-            
-            doctor_location_id = cursor.lastrowid
+            def insert(conn):
+                doctor_location_id = conn.execute(
+                    "INSERT INTO doctor_locations(doctor_id, location_id) VALUES (?, ?)",
+                    (doc_id, loc_id) 
+                ).lastrowid
 
-            cursor.close()
+                versions.bump(conn, versions.doctor_scope(doc_id))
+
+                return doctor_location_id
+
+            doctor_location_id = db.run_write(insert)
+
+            cache.get_cache().invalidate(cache.doctor_tag(doc_id))
 
         except Exception as e:
             return jsonify(str(e)), 404
@@ -302,8 +577,6 @@ def create_app(test_config=None):
     @app.route('/doctor/hours/set', methods=["POST"])
     def set_hours():
         try:
-            cursor = db.get_db().cursor()
-            
             req_data = request.get_json()
 
             try:
@@ -312,21 +585,250 @@ def create_app(test_config=None):
                 shift_end = req_data['shift_end']
             except KeyError:
                 return jsonify({'error_detail': 'Missing required field'}), 400
-        
-            cursor.execute(
-                "INSERT INTO doctor_hours(doctor_id, shift_start, shift_end) VALUES (?, ?, ?)",
-                (doc_id, shift_start, shift_end) 
-            )
 
-            db.get_db().commit()
+            def insert(conn):
+                doctor_hours_id = conn.execute(
+                    "INSERT INTO doctor_hours(day_stamp, doctor_id, shift_start, shift_end) "
+                    "VALUES (?, ?, ?, ?)",
+                    (scheduling.get_day(int(shift_start)), doc_id, shift_start, shift_end)
+                ).lastrowid
 
-            doctor_hours_id = cursor.lastrowid
+                versions.bump(conn, versions.doctor_scope(doc_id))
+                schedules.refresh_day(conn, doc_id, int(shift_start))
 
-            cursor.close()
+                return doctor_hours_id
+
+            doctor_hours_id = db.run_write(insert)
+
+            scheduling.get_index().add_shift(doc_id, shift_start, shift_end)
 
         except Exception as e:
             return jsonify({"error detail:": e}), 404
         return jsonify ({"shift start / end ID: ":doctor_hours_id}), 200
+
+
+    # Enters many working hours in one transaction
+    @app.route('/doctor/hours/bulk', methods=['POST'])
+    def set_hours_bulk():
+        '''
+        Enters a batch of shifts, e.g. a doctor's week or month
+
+        Takes {"shifts": [{"doctor_id", "shift_start", "shift_end"}, ...]},
+        for one or more doctors. Shifts may not overlap each other or the
+        doctor's existing hours (including their shift rules); if any do,
+        nothing is entered and their positions are returned as conflicts.
+        Otherwise every shift is inserted in a single transaction.
+
+        Returns:
+        The doctor_hours IDs of the shifts, in order
+        '''
+        try:
+            req_data = request.get_json()
+
+            try:
+                items = req_data['shifts']
+            except (KeyError, TypeError):
+                return jsonify({'error_detail': 'Missing required field'}), 400
+
+            if not isinstance(items, list) or not items:
+                return jsonify({'error_detail': 'shifts must be a non-empty list'}), 400
+
+            if len(items) > app.config['BULK_MAX_SHIFTS']:
+                return jsonify({'error_detail': 'Too many shifts; the limit is {}'.format(
+                    app.config['BULK_MAX_SHIFTS'])}), 400
+
+            try:
+                shifts = [(int(item['doctor_id']), int(item['shift_start']), int(item['shift_end']))
+                          for item in items]
+            except (KeyError, TypeError, ValueError):
+                return jsonify({'error_detail': 'Missing required field'}), 400
+
+            if any(shift_start >= shift_end for doc_id, shift_start, shift_end in shifts):
+                return jsonify({'error_detail': 'Every shift must start before it ends'}), 400
+
+            # shifts of this request, per doctor
+            pending = {}
+            conflicts = []
+
+            for i, (doc_id, shift_start, shift_end) in enumerate(shifts):
+                batch_schedule = pending.setdefault(doc_id, scheduling.DoctorSchedule())
+
+                if batch_schedule.overlaps_shift(shift_start, shift_end):
+                    conflicts.append(i)
+                else:
+                    batch_schedule.add_shift(shift_start, shift_end)
+
+            if conflicts:
+                return jsonify({'error_detail': 'Shifts overlap each other',
+                                'conflicts': conflicts}), 400
+
+            doctor_ids = sorted(pending)
+            start = min(shift_start for doc_id, shift_start, shift_end in shifts)
+            end = max(shift_end for doc_id, shift_start, shift_end in shifts)
+
+            def insert(conn):
+                # the hours and rules that could overlap, read under the
+                # write lock so no other request can add one in between
+                existing = {doc_id: [] for doc_id in doctor_ids}
+                for doc_id, shift_start, shift_end in conn.execute(
+                        'SELECT doctor_id, shift_start, shift_end FROM doctor_hours '
+                        'WHERE doctor_id IN ({}) AND shift_start < ? AND shift_end > ?'.format(
+                            ', '.join('?' * len(doctor_ids))),
+                        doctor_ids + [end, start]):
+                    existing[doc_id].append((shift_start, shift_end))
+
+                rules = shift_rules.load_rules(conn, doctor_ids, start, end)
+                schedules_by_doctor = {doc_id: scheduling.DoctorSchedule(
+                    shifts=existing[doc_id], rules=rules[doc_id]) for doc_id in doctor_ids}
+
+                conflicts = [i for i, (doc_id, shift_start, shift_end) in enumerate(shifts)
+                             if schedules_by_doctor[doc_id].overlaps_shift(shift_start, shift_end)]
+                if conflicts:
+                    return None, conflicts
+
+                conn.executemany(
+                    'INSERT INTO doctor_hours(day_stamp, doctor_id, shift_start, shift_end) '
+                    'VALUES (?, ?, ?, ?)',
+                    [(scheduling.get_day(shift_start), doc_id, shift_start, shift_end)
+                     for doc_id, shift_start, shift_end in shifts]
+                )
+                # the write lock is held, so the new IDs are consecutive
+                last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+
+                versions.bump(conn, *[versions.doctor_scope(doc_id) for doc_id in doctor_ids])
+                for doc_id, day_stamp in sorted({(doc_id, scheduling.get_day(shift_start))
+                                                 for doc_id, shift_start, shift_end in shifts}):
+                    schedules.refresh_day(conn, doc_id, day_stamp)
+
+                return list(range(last_id - len(shifts) + 1, last_id + 1)), []
+
+            doctor_hours_ids, conflicts = db.run_write(insert)
+
+            if conflicts:
+                return jsonify({'error_detail': 'Shifts overlap existing hours',
+                                'conflicts': conflicts}), 400
+
+            index = scheduling.get_index()
+            for doc_id, shift_start, shift_end in shifts:
+                index.add_shift(doc_id, shift_start, shift_end)
+
+        except Exception as e:
+            return jsonify({'error_detail': str(e)}), 404
+        return jsonify({'doctor_hours_ids': doctor_hours_ids}), 200
+
+
+    # Enters a recurring weekly shift of the doctor
+    @app.route('/doctor/hours/rules', methods=['POST'])
+    def add_shift_rule():
+        '''
+        Adds a shift the doctor works every week.
+
+        Takes the doctor_id, the weekdays it is on (0 is Monday, 6 Sunday),
+        start_time and end_time in seconds after midnight, a start_day and
+        optionally an end_day (any time on the first / last day it applies)
+        and a list of exceptions (any time on days it is skipped).
+
+        The rule is stored once and expanded into shifts when schedules
+        and availability are read, instead of a row per week.
+
+        returns the ID of the rule
+        '''
+        try:
+            req_data = request.get_json()
+
+            try:
+                doc_id = req_data['doctor_id']
+                weekdays = req_data['weekdays']
+                start_time = int(req_data['start_time'])
+                end_time = int(req_data['end_time'])
+                start_day = scheduling.get_day(int(req_data['start_day']))
+            except KeyError:
+                return jsonify({'error_detail': 'Missing required field'}), 400
+
+            end_day = req_data.get('end_day')
+            if end_day is not None:
+                end_day = scheduling.get_day(int(end_day))
+            exceptions = {scheduling.get_day(int(day)) for day in req_data.get('exceptions', [])}
+
+            if not weekdays:
+                return jsonify({'error_detail': 'At least one weekday is required'}), 400
+            try:
+                mask = shift_rules.weekday_mask(weekdays)
+            except ValueError as e:
+                return jsonify({'error_detail': str(e)}), 400
+            if not 0 <= start_time < end_time <= 86400:
+                return jsonify({'error_detail': 'Shift must start before it ends, within one day'}), 400
+            if end_day is not None and end_day < start_day:
+                return jsonify({'error_detail': 'end_day is before start_day'}), 400
+
+            def insert(conn):
+                rule_id = conn.execute(
+                    'INSERT INTO shift_rules(doctor_id, weekdays, start_time, end_time, start_day, end_day) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (doc_id, mask, start_time, end_time, start_day, end_day)
+                ).lastrowid
+                conn.executemany(
+                    'INSERT INTO shift_rule_exceptions(rule_id, day_stamp) VALUES (?, ?)',
+                    [(rule_id, day) for day in sorted(exceptions)]
+                )
+
+                versions.bump(conn, versions.doctor_scope(doc_id))
+                schedules.forget_doctor(conn, doc_id)
+
+                return rule_id
+
+            rule_id = db.run_write(insert)
+
+            scheduling.get_index().forget(doc_id)
+            cache.get_cache().invalidate(cache.doctor_tag(doc_id))
+
+        except Exception as e:
+            return jsonify({'error_detail': str(e)}), 404
+        return jsonify({'rule_id': rule_id}), 200
+
+
+    # Skips a recurring shift on one day
+    @app.route('/doctor/hours/rules/exceptions', methods=['POST'])
+    def add_shift_rule_exception():
+        '''
+        Stops a shift rule from applying on the day of the given time.
+
+        returns the rule ID and the day skipped
+        '''
+        try:
+            req_data = request.get_json()
+
+            try:
+                rule_id = req_data['rule_id']
+                day = scheduling.get_day(int(req_data['day']))
+            except KeyError:
+                return jsonify({'error_detail': 'Missing required field'}), 400
+
+            def insert(conn):
+                rule = conn.execute(
+                    'SELECT doctor_id FROM shift_rules WHERE id = ?', (rule_id, )
+                ).fetchone()
+                if rule is None:
+                    raise LookupError('No shift rule {}'.format(rule_id))
+
+                conn.execute(
+                    'INSERT OR IGNORE INTO shift_rule_exceptions(rule_id, day_stamp) VALUES (?, ?)',
+                    (rule_id, day)
+                )
+
+                versions.bump(conn, versions.doctor_scope(rule['doctor_id']))
+                schedules.forget_doctor(conn, rule['doctor_id'])
+
+                return rule['doctor_id']
+
+            doc_id = db.run_write(insert)
+
+            scheduling.get_index().forget(doc_id)
+            cache.get_cache().invalidate(cache.doctor_tag(doc_id))
+
+        except Exception as e:
+            return jsonify({'error_detail': str(e)}), 404
+        return jsonify({'rule_id': rule_id, 'day': day}), 200
        
     
     # Updates the is_canceled flag for appointments
@@ -345,19 +847,32 @@ def create_app(test_config=None):
         ALternatively could be handled by a delete request.
         '''
         try:
-            cursor = db.get_db().cursor()
-
             req_data = request.get_json()
 
             appointment_id = req_data['appointment_id']
 
-            cursor.execute(
-                "UPDATE appointments SET is_canceled = 1 WHERE id == ?",
-                (appointment_id, )
-            )
-            
-            db.get_db().commit()
-            cursor.close()
+            def cancel(conn):
+                appointment = conn.execute(
+                    "SELECT id, doctor_id, day_stamp FROM appointments WHERE id == ?",
+                    (appointment_id, )
+                ).fetchone()
+
+                conn.execute(
+                    "UPDATE appointments SET is_canceled = 1 WHERE id == ?",
+                    (appointment_id, )
+                )
+
+                if appointment is not None:
+                    versions.bump(conn, versions.doctor_scope(appointment['doctor_id']))
+                    schedules.refresh_day(conn, appointment['doctor_id'], appointment['day_stamp'])
+
+                return appointment
+
+            appointment = db.run_write(cancel)
+
+            if appointment is not None:
+                scheduling.get_index().cancel_appointment(
+                    appointment['doctor_id'], appointment['id'])
         
         except Exception as e:
             return jsonify({'error_detail': str(e)}), 404
@@ -375,134 +890,201 @@ def create_app(test_config=None):
         Prevents overlapping appointments +/- 15 minutes(14:59, to be exact...)
             Should update / add field for appointment type; provide a lock on +/- time where the 
 
+        Conflicts and working hours are checked against the per-doctor
+        scheduling index (see scheduling.py) while holding that doctor's
+        lock, so bookings for different doctors do not wait on each other.
+        The check is then repeated in the database inside the write
+        transaction, which makes the booking atomic across worker
+        processes as well.
+
         Returns: 
         Appointment ID
         or
         Appointment Taken
         '''
-        cursor = db.get_db().cursor()
+        try:
+            
+            req_data = request.get_json()
 
-        #Gets schedule Day / Date
-        def get_day(apmnt_time):
-            try:
-                string_date =  datetime.fromtimestamp(apmnt_time).strftime('%m  %d %Y')
-                my_date = datetime.strptime(string_date, '%m %d %Y')
-                tstamp = datetime.timestamp(my_date)
+            doc_id = int(req_data['doctor_id'])
+            loc_id = req_data['location_id']
+            apmnt_time = int(req_data['apmnt_time'])
 
-            except Exception as e:
-                return str(e)
-            return int(tstamp)
+            index = scheduling.get_index()
+            conn = db.get_db()
+            appointment_id = None
 
-        #Check doctor availability (is the doctor in the office / have working hours)
-        def doc_avail(arg1):
-            try:    
-                result = cursor.execute(
-                    "SELECT doctor_id, shift_start, shift_end FROM doctor_hours "
-                    "WHERE doctor_id == ?",
-                    (arg1[0], )
-                ).fetchall()
+            def bookable(doc_schedule):
+                return (not doc_schedule.has_conflict(apmnt_time) and
+                        doc_schedule.in_shift(apmnt_time))
 
-                doctor_availability = [dict(zip([key[0] for key in cursor.description], row)) for row in result]
-                
-                avail_dict_list = list(filter(lambda start_time: start_time['shift_start'] <= arg1[2], doctor_availability))
+            with index.doctor_lock(doc_id):
+                doc_schedule = index.get(conn, doc_id, apmnt_time)
 
-                shift_end_time = avail_dict_list[0].get("shift_end", False)
+                if not bookable(doc_schedule):
+                    # another process may have cancelled an appointment or
+                    # added hours since the schedule was loaded
+                    doc_schedule = index.refresh(conn, doc_id, apmnt_time)
 
-                if (shift_end_time <= arg1[2]):
-                    return 1
-                elif (shift_end_time >= arg1[2]):
-                    return 0
-            except Exception as e:
-                return str(e)
-    
-        #Checks if there is an appointment scheduled in the next +- 15 minutes (14:59, technically)
-        def check_apmnt(arg1):
-            try:
+                if bookable(doc_schedule):
+                    # run_write holds the write lock for the whole function,
+                    # so no other process can book this doctor between the
+                    # check and the insert.
+                    def book(conn):
+                        if not scheduling.is_available(conn, doc_id, apmnt_time):
+                            return None
 
-                '''
-                checks for an appointment in the specified range
-                +/- 899 seconds, or 14:59 minutes:seconds.
+                        appointment_id = conn.execute(
+                            'INSERT INTO appointments (day_stamp, doctor_id, location_id, ' 
+                            'apmnt_time, is_canceled)'
+                            'VALUES (?, ?, ?, ?, 0)',
+                            (scheduling.get_day(apmnt_time), doc_id, loc_id, apmnt_time)
+                        ).lastrowid
 
-                :return 0: if there are no scheduled appointemnts
+                        versions.bump(conn, versions.doctor_scope(doc_id))
+                        schedules.refresh_day(conn, doc_id, apmnt_time)
 
-                :return 1: if there is a scheudled appointment
+                        return appointment_id
 
-                :return 2: on error.
-                '''
-                sched_time = arg1[2]
-                offset = 899 
-                
-                '''
-                Determines block of time to block off
-                '''
-                time_block_add = sched_time + offset
+                    appointment_id = db.run_write(book)
 
-                time_block_sub = sched_time - offset
+                    if appointment_id is None:
+                        # booked by another process; reload on next use
+                        index.forget(doc_id)
+                    else:
+                        index.add_appointment(doc_id, appointment_id, apmnt_time)
 
-                time_block_check = cursor.execute(
-                    'SELECT id FROM appointments '
-                    'WHERE doctor_id == ? '
-                    'AND apmnt_time BETWEEN ? AND ?',
-                    (arg1[0], time_block_sub, time_block_add)
-                ).fetchone()
-
-                if time_block_check is None:
-                    return 0
-                else:
-                    return 1
-            except Exception as e:
-                return str(e)
+            if appointment_id is None:
+                appointment_id = "Doctor Unavailable; please select a different time."
         
-        #Writes the Data
-        def write_data(apmnt_check, arg2, doc_check, day_stamp):
-            '''
-            wites the data, or returns "Doctor Unavailable; please select different time."
+        except Exception as e:
+            return jsonify({'error_detail': str(e)}), 404
 
-            '''
-            try:
-                if (apmnt_check != 0 | doc_check != 0):
-                    return "Doctor Unavailable; please select a different time."
-                elif (apmnt_check == 0 & doc_check == 0):
-                    cursor.execute(
-                        'INSERT INTO appointments (day_stamp, doctor_id, location_id, ' 
-                        'apmnt_time, is_canceled)'
-                        'VALUES (?, ?, ?, ?, 0)',
-                        (day_stamp, arg2[0], arg2[1], arg2[2])
-                    )
-            
-                    appointment_id = cursor.lastrowid
+        return jsonify({"Appointment ID: ":appointment_id}), 200
 
-                    db.get_db().commit()
-                    cursor.close()
-                    
-                    return appointment_id      
-                else:
-                    return "Please select a different Time."
-            except Exception as e:
-                return str(e)
-        
+
+    # Schedules many appointments in one transaction
+    @app.route('/doctors/make_appointment/batch', methods=['POST'])
+    def schedule_appointments():
+        '''
+        Schedules a batch of appointments
+
+        Takes {"appointments": [{"doctor_id", "location_id", "apmnt_time"}, ...]}
+        and checks each one against the scheduling index and against the
+        appointments accepted earlier in the same batch. Every accepted
+        appointment is written in a single transaction.
+
+        Returns:
+        One result per requested appointment, in order, holding either the
+        new appointment_id or an error_detail.
+        '''
         try:
-            
             req_data = request.get_json()
 
-            doc_id = req_data['doctor_id']
-            loc_id = req_data['location_id']
-            apmnt_time = int(req_data['apmnt_time'])
+            try:
+                items = req_data['appointments']
+            except (KeyError, TypeError):
+                return jsonify({'error_detail': 'Missing required field'}), 400
 
-            apmnt_tup = (doc_id, loc_id, apmnt_time)
-            
-            apmnt_check = check_apmnt(apmnt_tup)
-            
-            doc_check = doc_avail(apmnt_tup)
+            if not isinstance(items, list):
+                return jsonify({'error_detail': 'appointments must be a list'}), 400
 
-            apmnt_date = get_day(apmnt_time)
+            if len(items) > app.config['BATCH_MAX_APPOINTMENTS']:
+                return jsonify({'error_detail': 'Too many appointments; the limit is {}'.format(
+                    app.config['BATCH_MAX_APPOINTMENTS'])}), 400
+
+            results = []
+            requested = []
+
+            for i, item in enumerate(items):
+                try:
+                    requested.append((i, int(item['doctor_id']), item['location_id'],
+                                      int(item['apmnt_time'])))
+                    results.append({'index': i})
+                except (KeyError, TypeError, ValueError):
+                    results.append({'index': i, 'error_detail': 'Missing required field'})
+
+            index = scheduling.get_index()
+            conn = db.get_db()
+            unavailable = 'Doctor Unavailable; please select a different time.'
+            accepted = []
+
+            with index.doctor_locks(doc_id for i, doc_id, loc_id, apmnt_time in requested):
+                # appointments accepted so far in this batch, per doctor
+                pending = {}
+
+                def bookable(doc_schedule, batch_schedule, apmnt_time):
+                    return (not doc_schedule.has_conflict(apmnt_time) and
+                            not batch_schedule.has_conflict(apmnt_time) and
+                            doc_schedule.in_shift(apmnt_time))
+
+                for i, doc_id, loc_id, apmnt_time in requested:
+                    doc_schedule = index.get(conn, doc_id, apmnt_time)
+                    batch_schedule = pending.setdefault(doc_id, scheduling.DoctorSchedule())
+
+                    if not bookable(doc_schedule, batch_schedule, apmnt_time):
+                        # check against what other processes wrote first
+                        doc_schedule = index.refresh(conn, doc_id, apmnt_time)
+
+                    if not bookable(doc_schedule, batch_schedule, apmnt_time):
+                        results[i]['error_detail'] = unavailable
+                        continue
+
+                    batch_schedule.add_appointment(i, apmnt_time)
+                    accepted.append((i, doc_id, loc_id, apmnt_time))
+
+                if accepted:
+                    # Re-check each one in the database under the write lock,
+                    # as schedule_appointment does; earlier inserts of this
+                    # batch are visible to the later checks.
+                    def book(conn):
+                        booked = {}
+                        stale = set()
+
+                        for i, doc_id, loc_id, apmnt_time in accepted:
+                            if not scheduling.is_available(conn, doc_id, apmnt_time):
+                                stale.add(doc_id)
+                                continue
+
+                            booked[i] = conn.execute(
+                                'INSERT INTO appointments (day_stamp, doctor_id, location_id, '
+                                'apmnt_time, is_canceled) '
+                                'VALUES (?, ?, ?, ?, 0)',
+                                (scheduling.get_day(apmnt_time), doc_id, loc_id, apmnt_time)
+                            ).lastrowid
+
+                        booked_rows = [booking for booking in accepted if booking[0] in booked]
+
+                        versions.bump(conn, *[versions.doctor_scope(doc_id)
+                                              for i, doc_id, loc_id, apmnt_time in booked_rows])
+
+                        for doc_id, day_stamp in set((doc_id, scheduling.get_day(apmnt_time))
+                                                     for i, doc_id, loc_id, apmnt_time in booked_rows):
+                            schedules.refresh_day(conn, doc_id, day_stamp)
+
+                        return booked, stale
+
+                    booked, stale = db.run_write(book)
+
+                    for i, doc_id, loc_id, apmnt_time in accepted:
+                        if i in booked:
+                            results[i]['appointment_id'] = booked[i]
+                        else:
+                            results[i]['error_detail'] = unavailable
+
+                    accepted = [booking for booking in accepted if booking[0] in booked]
+
+                    for doc_id in stale:
+                        index.forget(doc_id)
+
+                    for i, doc_id, loc_id, apmnt_time in accepted:
+                        if doc_id not in stale:
+                            index.add_appointment(doc_id, results[i]['appointment_id'], apmnt_time)
 
-            appointment_id = write_data(apmnt_check, apmnt_tup, doc_check, apmnt_date)
-        
         except Exception as e:
             return jsonify({'error_detail': str(e)}), 404
 
-        return jsonify({"Appointment ID: ":appointment_id}), 200
+        return jsonify({'accepted': len(accepted), 'results': results}), 200
 
 
     # Gets the weekly schedule by Doctor ID.
@@ -510,115 +1092,205 @@ def create_app(test_config=None):
     def get_doctor_sched(doctor_id):
         """
         Get all appointments for each doctor by Doctor ID for next week.
+
+        Served from the materialized per-day schedule rows (see
+        schedules.py), which the write handlers keep up to date.
         
         :return: Full appointments row for the next week.
         """ 
-        cursor = db.get_db().cursor()
-        def get_day():
-            try:
-                string_date =  datetime.today().strftime('%m  %d %Y')
-                my_date = datetime.strptime(string_date, '%m %d %Y')
-                tstamp = datetime.timestamp(my_date)
+        current_day = scheduling.get_day(time.time())
 
-            except Exception as e:
-                return str(e)
-            return int(tstamp)
+        # The schedule only changes when this doctor's data does, or when
+        # the day (and so the week it covers) rolls over.
+        etag = versions.get_etag(
+            db.get_db(), [versions.doctor_scope(doctor_id), versions.LOCATIONS], current_day)
+        unchanged = versions.not_modified(etag)
+
+        if unchanged is not None:
+            return unchanged
+
+        try:
+            result = schedules.get_week(db.get_db(), doctor_id, current_day,
+                                        lambda: db.get_db(readonly=False))
 
-        current_day = get_day()
-        one_week = current_day + 604800
+        except Exception as e:
+            return jsonify({"error detail:": str(e)}), 404
         
-                                            
-        def get_doc_work_hrs(doctor_id):
-            try:
-                doc_work_hours = cursor.execute(                    
-                    'SELECT dhrs.day_stamp, d.first_name, d.last_name, dhrs.shift_start, dhrs.shift_end '
-                    'FROM doctor_hours dhrs '
-                    'INNER JOIN doctors d ON dhrs.doctor_id = d.id '
-                    'WHERE dhrs.doctor_id = ? '
-                    'AND dhrs.day_stamp BETWEEN ? AND ?',
-                    (doctor_id, current_day, one_week)
-                    ).fetchall()
-                
-                dhrs = [dict(zip([key[0] for key in cursor.description], row)) for row in doc_work_hours]
-
-                if doc_work_hours is None:
-                    return jsonify({'error_detail': 'not found'}), 404
-            
-            except Exception as e:
-                return str(e)
-            
-            return dhrs
-    
-        def get_doctors_appointments(doctor_id):
-            try:
-                week_appointments = cursor.execute(
-                    'SELECT apmnt.day_stamp, d.first_name, d.last_name, l.address, apmnt.apmnt_time '
-                    'FROM appointments apmnt '
-                    'INNER JOIN locations l ON apmnt.location_id = l.id '
-                    'INNER JOIN doctors d ON apmnt.doctor_id = d.id '
-                    'WHERE apmnt.doctor_id = ? '
-                    'AND apmnt.day_stamp BETWEEN ? AND ?',
-                    (doctor_id, current_day, one_week)
-                ).fetchall()
+        return app.response_class(result, mimetype='application/json'), 200, \
+            versions.etag_header(etag)
 
-                doctors_appointments = [dict(zip([key[0] for key in cursor.description], row)) for row in week_appointments]
 
-                if week_appointments is None:
-                    return jsonify({'error_detail': 'not found'}), 404
+    def get_slot_range(default_days=None):
+        """
+        Read the start / end of a free slot search from the query string.
 
-            except Exception as e:
-                return e
+        Defaults to now until the end of today, or the next default_days
+        days; raises ValueError on a bad range.
+        """
+        start = int(request.args.get('start', int(time.time())))
 
-            return doctors_appointments
+        if default_days is None:
+            default_end = scheduling.get_day(start) + 86399
+        else:
+            default_end = start + default_days * 86400
 
-        def combine_data(arg1, arg2):
-            try:
-                combined_list = [*arg1, *arg2]
+        end = int(request.args.get('end', default_end))
 
-            except Exception as e:
-                return str(e)
-            
-            return combined_list
-        
+        if end < start:
+            raise ValueError('end must not be before start')
+        if end - start > app.config['SLOT_SEARCH_MAX_DAYS'] * 86400:
+            raise ValueError('Search range is limited to {} days'.format(
+                app.config['SLOT_SEARCH_MAX_DAYS']))
+
+        return start, end
+
+
+    # Gets the open appointment slots for a doctor
+    @app.route('/doctors/<int:doctor_id>/free_slots', methods=['GET'])
+    def doctor_free_slots(doctor_id):
+        """
+        Get the 15 minute slots a doctor can still be booked for
+
+        :param start: Start of the search range (query string, optional)
+        :param end: End of the search range (query string, optional)
+        :return: The doctor_id and its list of free slot start times
+        """
         try:
-            doc_hours = get_doc_work_hrs(doctor_id)
-            doc_apmnts = get_doctors_appointments(doctor_id)
-            result = combine_data(doc_hours, doc_apmnts)
-            cursor.close()
+            start, end = get_slot_range()
+        except ValueError as e:
+            return jsonify({'error_detail': str(e)}), 400
 
+        try:
+            slots = availability.find_free_slots(db.get_db(), [doctor_id], start, end)
         except Exception as e:
-            return jsonify({"error detail:": str(e)}), 404
-        
-        return jsonify(result), 200
+            return jsonify({'error_detail': str(e)}), 404
+
+        return serialize.json_response({'doctor_id': doctor_id, 'slots': slots[doctor_id]}), 200
+
+
+    # Gets the open appointment slots for every doctor at a location
+    @app.route('/locations/<int:location_id>/free_slots', methods=['GET'])
+    def location_free_slots(location_id):
+        """
+        Get the 15 minute slots each doctor working at a location can still
+        be booked for
+
+        :param start: Start of the search range (query string, optional)
+        :param end: End of the search range (query string, optional)
+        :return: List of doctor_id / free slot start times, one per doctor
+        """
+        try:
+            start, end = get_slot_range()
+        except ValueError as e:
+            return jsonify({'error_detail': str(e)}), 400
+
+        try:
+            doctor_ids = [row[0] for row in db.get_db().execute(
+                'SELECT DISTINCT doctor_id FROM doctor_locations WHERE location_id = ?',
+                (location_id, )
+            ).fetchall()]
+
+            slots = availability.find_free_slots(db.get_db(), doctor_ids, start, end)
+        except Exception as e:
+            return jsonify({'error_detail': str(e)}), 404
+
+        return serialize.json_response([{'doctor_id': doctor_id, 'slots': doctor_slots}
+                                          for doctor_id, doctor_slots in sorted(slots.items())]), 200
+
+
+    # Finds the earliest open slots with any doctor at a location
+    @app.route('/locations/<int:location_id>/first_available', methods=['GET'])
+    def location_first_available(location_id):
+        """
+        Get the earliest bookable slots across every doctor at a location
+
+        :param start: Start of the search window (query string, optional)
+        :param end: End of the search window (query string, optional,
+            defaults to a week after start)
+        :param n: Number of slots to return (query string, optional)
+        :return: List of doctor_id / apmnt_time pairs, earliest first
+        """
+        try:
+            start, end = get_slot_range(default_days=7)
+            count = int(request.args.get('n', app.config['FIRST_AVAILABLE_DEFAULT']))
+
+            if count < 1:
+                raise ValueError('n must be positive')
+        except ValueError as e:
+            return jsonify({'error_detail': str(e)}), 400
+
+        count = min(count, app.config['FIRST_AVAILABLE_MAX'])
+
+        try:
+            doctor_ids = [row[0] for row in db.get_db().execute(
+                'SELECT DISTINCT doctor_id FROM doctor_locations WHERE location_id = ?',
+                (location_id, )
+            ).fetchall()]
+
+            slots = availability.first_available(db.get_db(), doctor_ids, start, end, count)
+        except Exception as e:
+            return jsonify({'error_detail': str(e)}), 404
+
+        return serialize.json_response([{'doctor_id': doctor_id, 'apmnt_time': slot}
+                                          for slot, doctor_id in slots]), 200
 
 
     # Gets ALL doctor appointments for ea. doctor by Doctor ID # need to make one dict where the 
     @app.route('/doctors/appointment/<int:doctor_id>', methods=['GET']) 
     def get_doctor_appointments(doctor_id):
         """
-        Get all appointments for each doctor by Doctor ID.
-        
+        Get all appointments for each doctor by Doctor ID, a page at a time
+        ordered by appointment time.
+
+        :param limit: Page size (query string, optional)
+        :param after: Cursor from the previous page's X-Next-Cursor header
         :return: Full appointments row for the doctor.
         """ 
+        try:
+            limit, after = pagination.get_page_args(2)
+        except pagination.PageError as e:
+            return jsonify({'error_detail': str(e)}), 400
+
+        etag = versions.get_etag(
+            db.get_db(), [versions.doctor_scope(doctor_id), versions.LOCATIONS])
+        unchanged = versions.not_modified(etag)
+
+        if unchanged is not None:
+            return unchanged
+
         cursor = db.get_db().cursor()
-        
-        result = cursor.execute(
-            'SELECT d.first_name, d.last_name, l.address, apmnt.apmnt_time '
-            'FROM appointments apmnt '
-            'INNER JOIN locations l ON apmnt.location_id = l.id '
-            'INNER JOIN doctors d ON apmnt.doctor_id = d.id '
-            'WHERE apmnt.doctor_id = ?',
-            (doctor_id, )
-        ).fetchall()
 
-        if result is None:
-            return jsonify({'error_detail': 'not found'}), 404
+        if after is None:
+            result = cursor.execute(
+                'SELECT apmnt.id, d.first_name, d.last_name, l.address, apmnt.apmnt_time '
+                'FROM appointments apmnt '
+                'INNER JOIN locations l ON apmnt.location_id = l.id '
+                'INNER JOIN doctors d ON apmnt.doctor_id = d.id '
+                'WHERE apmnt.doctor_id = ? '
+                'ORDER BY apmnt.apmnt_time, apmnt.id LIMIT ?',
+                (doctor_id, limit + 1)
+            ).fetchall()
+        else:
+            result = cursor.execute(
+                'SELECT apmnt.id, d.first_name, d.last_name, l.address, apmnt.apmnt_time '
+                'FROM appointments apmnt '
+                'INNER JOIN locations l ON apmnt.location_id = l.id '
+                'INNER JOIN doctors d ON apmnt.doctor_id = d.id '
+                'WHERE apmnt.doctor_id = ? '
+                'AND (apmnt.apmnt_time, apmnt.id) > (?, ?) '
+                'ORDER BY apmnt.apmnt_time, apmnt.id LIMIT ?',
+                (doctor_id, after[0], after[1], limit + 1)
+            ).fetchall()
 
-        appointments = [dict(zip([key[0] for key in cursor.description], row)) for row in result]
+        appointments = serialize.to_dicts(result)
 
         cursor.close()
 
-        return jsonify(appointments), 200
+        appointments, headers = pagination.paginate(
+            appointments, limit, lambda row: (row['apmnt_time'], row['id']))
+        headers.update(versions.etag_header(etag))
+
+        return serialize.json_response(appointments), 200, headers
 
 
     return app
@@ -0,0 +1,148 @@
+# ASGI entry point: serves the same Flask routes from an event loop, e.g.
+#   uvicorn --factory in_database.asgi:create_asgi_app
+# Open connections are held by the server's loop, which costs next to nothing
+# while they are idle (e.g. weekly schedule pollers), and each request runs on
+# a bounded thread pool so SQLite calls never block the loop.
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from in_database import create_app
+
+
+class WSGIBridge(object):
+    """Adapt a WSGI app to ASGI, running every request on a thread pool of
+    at most ``max_workers`` threads.
+
+    Request bodies are read in full before the app is called and response
+    bodies are buffered, which suits this app's small JSON payloads.
+    """
+
+    def __init__(self, wsgi_app, max_workers=8):
+        self.wsgi_app = wsgi_app
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='in_database')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError('Unsupported ASGI scope type: {}'.format(scope['type']))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        body = BytesIO()
+
+        while True:
+            message = await receive()
+
+            if message['type'] == 'http.disconnect':
+                return
+
+            body.write(message.get('body', b''))
+
+            if not message.get('more_body', False):
+                break
+
+        body.seek(0)
+        environ = self.build_environ(scope, body)
+
+        loop = asyncio.get_running_loop()
+        status, headers, chunks = await loop.run_in_executor(
+            self.executor, self.run_wsgi, environ)
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': headers,
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b''.join(chunks),
+        })
+
+    def build_environ(self, scope, body):
+        """Build a WSGI environ (PEP 3333) from an ASGI HTTP scope."""
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+            'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin1').upper().replace('-', '_')
+            value = value.decode('latin1')
+
+            if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+                key = name
+            else:
+                key = 'HTTP_' + name
+
+            if key in environ:
+                value = environ[key] + ',' + value
+
+            environ[key] = value
+
+        # chunked uploads carry no length, but the body has been read in full
+        environ.setdefault('CONTENT_LENGTH', str(len(body.getvalue())))
+
+        return environ
+
+    def run_wsgi(self, environ):
+        """Call the WSGI app; runs on a pool thread."""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin1'), value.encode('latin1'))
+                                   for name, value in headers]
+
+        result = self.wsgi_app(environ, start_response)
+
+        try:
+            chunks = list(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        return response['status'], response['headers'], chunks
+
+
+def create_asgi_app(test_config=None):
+    """Create the Flask app and wrap it for an ASGI server. The thread
+    pool defaults to the size of the connection pool so requests never
+    queue for a connection.
+    """
+    app = create_app(test_config)
+    max_workers = app.config.get('ASGI_MAX_WORKERS') or app.config['DB_POOL_SIZE']
+
+    return WSGIBridge(app, max_workers)
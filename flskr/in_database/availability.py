@@ -0,0 +1,162 @@
+import bisect
+import heapq
+import itertools
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - numpy is optional
+    numpy = None
+
+from in_database import shift_rules
+from in_database.scheduling import APPOINTMENT_WINDOW
+
+
+# Bookable slots start every 15 minutes from the beginning of each shift.
+SLOT_LENGTH = 900
+
+# first_available loads schedules a window at a time, starting with this
+# many seconds and doubling the window until it has found enough slots.
+FIRST_WINDOW = 86400
+
+
+def load_schedules(conn, doctor_ids, start, end):
+    """Fetch the shifts overlapping [start, end], including the ones
+    recurring shift rules produce in it, and the live appointments that
+    could conflict with a slot in it, for all ``doctor_ids`` at once.
+
+    :return: {doctor_id: (sorted shifts, sorted appointment times)}
+    """
+    doctor_ids = sorted(set(int(doctor_id) for doctor_id in doctor_ids))
+    schedules = {doctor_id: ([], []) for doctor_id in doctor_ids}
+
+    if not doctor_ids:
+        return schedules
+
+    placeholders = ', '.join('?' * len(doctor_ids))
+
+    for doctor_id, shift_start, shift_end in conn.execute(
+            'SELECT doctor_id, shift_start, shift_end FROM doctor_hours '
+            'WHERE doctor_id IN ({}) AND shift_start <= ? AND shift_end > ? '
+            'ORDER BY doctor_id, shift_start'.format(placeholders),
+            doctor_ids + [end, start]):
+        schedules[doctor_id][0].append((shift_start, shift_end))
+
+    for doctor_id, rules in shift_rules.load_rules(conn, doctor_ids, start, end).items():
+        if rules:
+            schedules[doctor_id][0].extend(shift_rules.expand(rules, start, end))
+            schedules[doctor_id][0].sort()
+
+    for doctor_id, apmnt_time in conn.execute(
+            'SELECT doctor_id, apmnt_time FROM appointments '
+            'WHERE doctor_id IN ({}) AND apmnt_time BETWEEN ? AND ? AND is_canceled = 0 '
+            'ORDER BY doctor_id, apmnt_time'.format(placeholders),
+            doctor_ids + [start - APPOINTMENT_WINDOW, end + APPOINTMENT_WINDOW]):
+        schedules[doctor_id][1].append(apmnt_time)
+
+    return schedules
+
+
+def _free_slots_numpy(shifts, times, start, end):
+    shift_starts = numpy.array([shift[0] for shift in shifts], dtype=numpy.int64)
+    shift_ends = numpy.array([shift[1] for shift in shifts], dtype=numpy.int64)
+
+    # Every slot boundary of every shift, laid out in one array: shift i
+    # contributes counts[i] slots starting at shift_starts[i].
+    counts = (shift_ends - shift_starts + SLOT_LENGTH - 1) // SLOT_LENGTH
+    counts = numpy.maximum(counts, 0)
+    offsets = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    slots = numpy.repeat(shift_starts, counts) + offsets * SLOT_LENGTH
+    slots = numpy.unique(slots[(slots >= start) & (slots <= end)])
+
+    appointments = numpy.array(times, dtype=numpy.int64)
+    first = numpy.searchsorted(appointments, slots - APPOINTMENT_WINDOW, side='left')
+    last = numpy.searchsorted(appointments, slots + APPOINTMENT_WINDOW, side='right')
+
+    return slots[first == last].tolist()
+
+
+def _shift_slots(shifts, start, end):
+    """Return one range of slot start times in [start, end] per shift."""
+    ranges = []
+
+    for shift_start, shift_end in shifts:
+        first = shift_start
+        if first < start:
+            first += (start - first + SLOT_LENGTH - 1) // SLOT_LENGTH * SLOT_LENGTH
+
+        ranges.append(range(first, min(shift_end, end + 1), SLOT_LENGTH))
+
+    return ranges
+
+
+def _free_slots_python(shifts, times, start, end):
+    return list(iter_free_slots(shifts, times, start, end))
+
+
+def free_slots(shifts, times, start, end):
+    """Return the sorted slot start times in [start, end] that fall inside a
+    shift and are more than APPOINTMENT_WINDOW seconds from every
+    appointment in ``times`` (which must be sorted).
+    """
+    if not shifts:
+        return []
+
+    if numpy is not None:
+        return _free_slots_numpy(shifts, times, start, end)
+
+    return _free_slots_python(shifts, times, start, end)
+
+
+def find_free_slots(conn, doctor_ids, start, end):
+    """Return {doctor_id: [free slot start times]} for each doctor."""
+    return {doctor_id: free_slots(shifts, times, start, end)
+            for doctor_id, (shifts, times) in load_schedules(conn, doctor_ids, start, end).items()}
+
+
+def iter_free_slots(shifts, times, start, end):
+    """Yield the free slots of free_slots one at a time, in order, without
+    computing the ones after the last slot the caller asks for.
+    """
+    last = None
+
+    for slot in heapq.merge(*_shift_slots(shifts, start, end)):
+        if slot == last:
+            continue
+        last = slot
+
+        if (bisect.bisect_left(times, slot - APPOINTMENT_WINDOW) ==
+                bisect.bisect_right(times, slot + APPOINTMENT_WINDOW)):
+            yield slot
+
+
+def _tagged(doctor_id, slots):
+    for slot in slots:
+        yield slot, doctor_id
+
+
+def first_available(conn, doctor_ids, start, end, count):
+    """Return the ``count`` earliest (slot, doctor_id) pairs across all
+    ``doctor_ids``.
+
+    Schedules are loaded for FIRST_WINDOW seconds from ``start``, then for
+    windows twice as long as the one before, until ``count`` slots are found
+    or ``end`` is reached. Within a window each doctor's free slots are
+    generated lazily and combined with a heap based k-way merge, so only
+    about ``count`` slots are ever computed rather than every doctor's full
+    availability.
+    """
+    found = []
+    window = FIRST_WINDOW
+
+    while start <= end and len(found) < count:
+        last = min(start + window - 1, end)
+        schedules = load_schedules(conn, doctor_ids, start, last)
+
+        merged = heapq.merge(*(_tagged(doctor_id, iter_free_slots(shifts, times, start, last))
+                               for doctor_id, (shifts, times) in schedules.items()))
+        found.extend(itertools.islice(merged, count - len(found)))
+
+        start = last + 1
+        window *= 2
+
+    return found
@@ -0,0 +1,180 @@
+import csv
+import itertools
+import json
+import os
+
+import click
+from flask.cli import with_appcontext
+
+from in_database import db, schedules, versions
+from in_database.scheduling import get_day
+
+
+# What `flask import` can load: the table each kind of file goes to, its
+# columns, and which of those every row must provide. Missing optional
+# columns are filled in by fill_defaults.
+IMPORT_KINDS = {
+    'doctors': ('doctors', ('id', 'first_name', 'last_name'),
+                ('first_name', 'last_name')),
+    'locations': ('locations', ('id', 'address'),
+                  ('address', )),
+    'assignments': ('doctor_locations', ('id', 'doctor_id', 'location_id'),
+                    ('doctor_id', 'location_id')),
+    'shifts': ('doctor_hours', ('id', 'day_stamp', 'doctor_id', 'shift_start', 'shift_end'),
+               ('doctor_id', 'shift_start', 'shift_end')),
+    'appointments': ('appointments', ('id', 'day_stamp', 'doctor_id', 'location_id',
+                                      'apmnt_time', 'is_canceled'),
+                     ('doctor_id', 'location_id', 'apmnt_time')),
+}
+
+FORMATS = {
+    '.csv': 'csv',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+}
+
+
+def read_records(f, fmt):
+    """Yield one dict per record of a CSV (with a header row) or NDJSON
+    file without reading the whole file into memory.
+    """
+    if fmt == 'csv':
+        for record in csv.DictReader(f):
+            yield record
+    else:
+        for line in f:
+            line = line.strip()
+
+            if line:
+                yield json.loads(line)
+
+
+def fill_defaults(kind, record):
+    """Fill in the columns an import file may leave out."""
+    if kind == 'shifts' and record.get('day_stamp') in (None, ''):
+        record['day_stamp'] = get_day(int(record['shift_start']))
+    elif kind == 'appointments':
+        if record.get('day_stamp') in (None, ''):
+            record['day_stamp'] = get_day(int(record['apmnt_time']))
+        if record.get('is_canceled') in (None, ''):
+            record['is_canceled'] = 0
+
+    return record
+
+
+def to_rows(kind, records):
+    """Turn records into parameter tuples in IMPORT_KINDS column order."""
+    table, columns, required = IMPORT_KINDS[kind]
+
+    for line, record in enumerate(records, 1):
+        missing = [column for column in required if record.get(column) in (None, '')]
+
+        if missing:
+            raise click.ClickException('Record {} is missing {}'.format(
+                line, ', '.join(missing)))
+
+        record = fill_defaults(kind, record)
+
+        # an empty id lets SQLite assign one
+        yield tuple(record.get(column) if record.get(column) != '' else None
+                    for column in columns)
+
+
+def drop_indexes(conn, table):
+    """Drop the secondary indexes on ``table`` and return their SQL so they
+    can be rebuilt once the load is done.
+    """
+    indexes = conn.execute(
+        "SELECT name, sql FROM sqlite_master "
+        "WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table, )
+    ).fetchall()
+
+    for name, sql in indexes:
+        conn.execute('DROP INDEX "{}"'.format(name))
+
+    conn.commit()
+
+    return [sql for name, sql in indexes]
+
+
+def import_rows(conn, kind, rows, chunk_size=10000):
+    """Insert rows in chunks of ``chunk_size``, one transaction per chunk,
+    with the table's indexes dropped for the duration of the load and
+    rebuilt at the end. The version of every doctor touched is bumped so
+    cached ETags stop matching, and their materialized schedules dropped.
+
+    :return: Number of rows inserted
+    """
+    table, columns, required = IMPORT_KINDS[kind]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        table, ', '.join(columns), ', '.join('?' * len(columns)))
+
+    index_sql = drop_indexes(conn, table)
+    count = 0
+
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+
+            if not chunk:
+                break
+
+            if kind == 'doctors':
+                scopes = {versions.DOCTORS}
+                scopes.update(versions.doctor_scope(row[0]) for row in chunk if row[0] is not None)
+            elif kind == 'locations':
+                scopes = {versions.LOCATIONS}
+            else:
+                doctor_column = columns.index('doctor_id')
+                scopes = {versions.doctor_scope(row[doctor_column]) for row in chunk}
+
+            with conn:
+                conn.executemany(sql, chunk)
+                versions.bump(conn, *scopes)
+
+                if kind in ('shifts', 'appointments'):
+                    for doctor_id in set(row[doctor_column] for row in chunk):
+                        schedules.forget_doctor(conn, doctor_id)
+
+            count += len(chunk)
+    finally:
+        with conn:
+            for statement in index_sql:
+                conn.execute(statement)
+
+            conn.execute('ANALYZE {}'.format(table))
+
+    return count
+
+
+@click.command('import')
+@click.argument('kind', type=click.Choice(sorted(IMPORT_KINDS)))
+@click.argument('source', type=click.File('r', encoding='utf8'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None,
+              help='File format; guessed from the file extension by default.')
+@click.option('--chunk-size', type=int, default=10000,
+              help='Rows inserted per transaction.')
+@with_appcontext
+def import_command(kind, source, fmt, chunk_size):
+    """Stream a CSV or NDJSON file of KIND records into the database.
+
+    The doctors' versions are bumped, so running servers reload their
+    scheduling index for them before turning a booking down.
+    """
+    if fmt is None:
+        fmt = FORMATS.get(os.path.splitext(source.name)[1].lower())
+
+        if fmt is None:
+            raise click.UsageError('Cannot guess the format of {}; pass --format.'.format(
+                source.name))
+
+    count = import_rows(db.get_db(), kind, to_rows(kind, read_records(source, fmt)),
+                        chunk_size)
+
+    click.echo('Imported {} {}.'.format(count, kind))
+
+
+def init_app(app):
+    """Register the bulk import command with the Flask app."""
+    app.cli.add_command(import_command)
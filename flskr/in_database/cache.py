@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+# Returned by LRUCache.get for a key that is not cached, since None is a
+# value worth caching (e.g. a doctor that does not exist).
+MISSING = object()
+
+
+class LRUCache(object):
+    """A bounded, thread-safe LRU cache with an optional TTL.
+
+    Every entry carries a set of tags, and ``invalidate`` drops all entries
+    with any of the given tags, so writers can invalidate exactly the reads
+    they affect. An entry loaded while one of its tags was being invalidated
+    is not stored, so a slow read cannot put stale data back in the cache.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._tags = {}
+        # sequence number of the last invalidation, and of the last
+        # invalidation of each tag
+        self._seq = 0
+        self._invalidated = {}
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+        }
+
+    def get(self, key):
+        """Return the cached value for ``key``, or MISSING."""
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self._stats['misses'] += 1
+                return MISSING
+
+            expires, tags, value = entry
+
+            if expires is not None and expires < time.monotonic():
+                self._remove(key)
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return MISSING
+
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+
+            return value
+
+    def set(self, key, value, tags=(), since=None):
+        """Cache ``value`` under ``key``.
+
+        :param since: Sequence number (see get_or_load) taken before the
+            value was read; the value is dropped if any of its tags were
+            invalidated after it
+        """
+        with self._lock:
+            if since is not None and any(self._invalidated.get(tag, 0) > since for tag in tags):
+                return
+
+            if key in self._entries:
+                self._remove(key)
+
+            expires = None if self.ttl is None else time.monotonic() + self.ttl
+            self._entries[key] = (expires, tags, value)
+
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def get_or_load(self, key, tags, load):
+        """Return the cached value for ``key``, calling ``load()`` and
+        caching its result on a miss.
+        """
+        value = self.get(key)
+
+        if value is MISSING:
+            with self._lock:
+                since = self._seq
+
+            value = load()
+            self.set(key, value, tags, since)
+
+        return value
+
+    def invalidate(self, *tags):
+        """Drop every entry carrying any of ``tags``."""
+        with self._lock:
+            self._seq += 1
+
+            for tag in tags:
+                self._invalidated[tag] = self._seq
+
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self._stats['invalidations'] += 1
+
+    def _remove(self, key):
+        expires, tags, value = self._entries.pop(key)
+
+        for tag in tags:
+            keys = self._tags.get(tag)
+
+            if keys is not None:
+                keys.discard(key)
+
+                if not keys:
+                    del self._tags[tag]
+
+    def clear(self):
+        with self._lock:
+            self._seq += 1
+            self._entries.clear()
+            self._tags.clear()
+            self._invalidated.clear()
+
+    def stats(self):
+        """Return the cache size and hit / miss counters."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['maxsize'] = self.maxsize
+
+        return stats
+
+
+def doctor_tag(doctor_id):
+    """Tag for cached reads that depend on one doctor's rows."""
+    return 'doctor:{}'.format(int(doctor_id))
+
+
+def get_cache():
+    """Return the app's read cache, creating it on first use."""
+    app = current_app._get_current_object()
+    cache = app.extensions.get('read_cache')
+
+    if cache is None:
+        cache = app.extensions.setdefault('read_cache', LRUCache(
+            app.config.get('CACHE_MAX_ENTRIES', 1024), app.config.get('CACHE_TTL')))
+
+    return cache
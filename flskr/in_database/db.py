@@ -1,33 +1,652 @@
+import logging
+import os
+import queue
+from concurrent.futures import Future
+from urllib.request import pathname2url
+import re
 import sqlite3
+import threading
+import time
 
 import click
-from flask import current_app, g
+from flask import current_app, g, has_request_context, request
 from flask.cli import with_appcontext
 
+from in_database import metrics
 
-def get_db():
-    """Connect to the application's configured database. The connection
-    is unique for each request and will be reused if this is called
-    again.
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool(object):
+    """A per-process pool of tuned SQLite connections.
+
+    Connections are opened lazily up to ``size`` and handed back to the pool
+    on teardown instead of being closed, so the page cache and prepared
+    statements stay warm across requests. Idle connections are reused most
+    recently used first. When every connection is checked out, callers wait
+    up to ``timeout`` seconds and then get a one-off overflow connection that
+    is closed again on check in.
+
+    When ``metrics`` or ``slow_log`` is given, connections are
+    InstrumentedConnections reporting every statement to them. With
+    ``readonly`` set, connections are opened with a mode=ro URI so they can
+    never take SQLite's write lock.
     """
-    if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
+
+    def __init__(self, database, size=8, timeout=5.0, pragmas=None, metrics=None,
+                 slow_log=None, readonly=False):
+        self.database = database
+        self.readonly = readonly
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas or []
+        self.metrics = metrics
+        self.slow_log = slow_log
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._overflow = set()
+        self._stats = {
+            'checkouts': 0,
+            'reused': 0,
+            'created': 0,
+            'waits': 0,
+            'wait_time_ms': 0.0,
+            'overflow': 0,
+            'write_locks': 0,
+            'write_lock_wait_ms': 0.0,
+        }
+
+    def connect(self):
+        """Open a new connection with the configured pragmas applied."""
+        instrumented = self.metrics is not None or self.slow_log is not None
+
+        if self.readonly:
+            database = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(self.database)))
+        else:
+            database = self.database
+
+        conn = sqlite3.connect(
+            database,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            factory=metrics.InstrumentedConnection if instrumented else sqlite3.Connection,
+            uri=self.readonly
         )
-        g.db.row_factory = sqlite3.Row
+        conn.row_factory = sqlite3.Row
 
-    return g.db
+        if instrumented:
+            conn.metrics = self.metrics
+            conn.slow_log = self.slow_log
 
+        for name, value in self.pragmas:
+            conn.execute('PRAGMA {} = {}'.format(name, value))
 
-def close_db(e=None):
-    """If this request connected to the database, close the
-    connection.
+        return conn
+
+    def checkout(self):
+        """Take a connection from the pool, opening one if none are idle."""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+
+        if conn is not None:
+            with self._lock:
+                self._stats['checkouts'] += 1
+                self._stats['reused'] += 1
+            return conn
+
+        with self._lock:
+            can_open = self._open < self.size
+            if can_open:
+                self._open += 1
+
+        if can_open:
+            try:
+                conn = self.connect()
+            except Exception:
+                with self._lock:
+                    self._open -= 1
+                raise
+
+            with self._lock:
+                self._stats['checkouts'] += 1
+                self._stats['created'] += 1
+            return conn
+
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+            overflow = False
+        except queue.Empty:
+            conn = self.connect()
+            overflow = True
+
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['waits'] += 1
+            self._stats['wait_time_ms'] += (time.perf_counter() - started) * 1000
+            if overflow:
+                self._stats['overflow'] += 1
+                self._overflow.add(id(conn))
+            else:
+                self._stats['reused'] += 1
+
+        return conn
+
+    def checkin(self, conn):
+        """Return a connection to the pool, rolling back anything the
+        request left uncommitted.
+        """
+        if conn.in_transaction:
+            conn.rollback()
+
+        with self._lock:
+            overflow = id(conn) in self._overflow
+            self._overflow.discard(id(conn))
+
+        if overflow:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    def close(self):
+        """Close every idle connection in the pool.
+
+        A writable pool first runs PRAGMA optimize once, which re-analyzes
+        the tables whose size has changed a lot since their statistics were
+        gathered. It does not wait for the write lock: when another process
+        holds it, optimizing is left to the next pool that closes.
+        """
+        optimize = not self.readonly
+
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+
+            if optimize:
+                optimize = False
+                try:
+                    conn.execute('PRAGMA busy_timeout = 0')
+                    conn.execute('PRAGMA optimize')
+                except sqlite3.OperationalError as e:
+                    logger.debug('PRAGMA optimize skipped: %s', e)
+
+            conn.close()
+
+            with self._lock:
+                self._open -= 1
+
+    def record_write_lock(self, seconds):
+        """Count one write transaction that waited ``seconds`` for
+        SQLite's write lock (see run_write).
+        """
+        with self._lock:
+            self._stats['write_locks'] += 1
+            self._stats['write_lock_wait_ms'] += seconds * 1000
+
+    def stats(self):
+        """Return the pool size, checkout and write lock counters."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = self._open
+            stats['idle'] = self._idle.qsize()
+            stats['in_use'] = self._open - stats['idle']
+            stats['wait_time_ms'] = round(stats['wait_time_ms'], 3)
+            stats['write_lock_wait_ms'] = round(stats['write_lock_wait_ms'], 3)
+
+        return stats
+
+
+class GroupCommitWriter(object):
+    """Runs write jobs on one background thread, committing together every
+    job that arrives within ``window`` seconds of the first (up to
+    ``max_jobs``).
+
+    Each job is a function taking the writer's connection. It runs inside
+    its own savepoint, so a job that raises is rolled back on its own and
+    the rest of the group still commits. Callers block until the shared
+    commit has finished, so an acknowledged write is as durable as with a
+    commit of its own, while the group pays for a single fsync.
     """
-    db = g.pop('db', None)
 
-    if db is not None:
-        db.close()
+    def __init__(self, connect, window=0.002, max_jobs=256):
+        self.connect = connect
+        self.window = window
+        self.max_jobs = max_jobs
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {
+            'jobs': 0,
+            'failed': 0,
+            'commits': 0,
+            'lock_wait_ms': 0.0,
+        }
+
+    def submit(self, fn):
+        """Run ``fn(conn)`` in the next group commit and return its result,
+        or raise its exception.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='in_database-writer', daemon=True)
+                self._thread.start()
+
+        future = Future()
+        self._jobs.put((fn, future))
+
+        return future.result()
+
+    def close(self):
+        """Commit the jobs already queued and stop the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+
+        if thread is not None:
+            self._jobs.put(None)
+            thread.join()
+
+    def _run(self):
+        conn = self.connect()
+        running = True
+
+        try:
+            while running:
+                job = self._jobs.get()
+                if job is None:
+                    break
+
+                jobs = [job]
+                deadline = time.monotonic() + self.window
+
+                while len(jobs) < self.max_jobs:
+                    try:
+                        job = self._jobs.get(timeout=max(0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+
+                    if job is None:
+                        running = False
+                        break
+
+                    jobs.append(job)
+
+                self._commit(conn, jobs)
+        finally:
+            conn.close()
+
+    def _commit(self, conn, jobs):
+        outcomes = []
+        started = time.perf_counter()
+
+        try:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+            finally:
+                lock_wait = time.perf_counter() - started
+
+            for fn, future in jobs:
+                conn.execute('SAVEPOINT job')
+
+                try:
+                    outcomes.append((future, fn(conn), None))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO job')
+                    outcomes.append((future, None, e))
+
+                conn.execute('RELEASE job')
+
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+
+            outcomes = [(future, None, e) for fn, future in jobs]
+
+        with self._lock:
+            self._stats['jobs'] += len(jobs)
+            self._stats['failed'] += sum(1 for outcome in outcomes if outcome[2] is not None)
+            self._stats['commits'] += 1
+            self._stats['lock_wait_ms'] += lock_wait * 1000
+
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def stats(self):
+        """Return job and commit counters, and the time spent waiting for
+        SQLite's write lock.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['lock_wait_ms'] = round(stats['lock_wait_ms'], 3)
+
+        return stats
+
+
+class SlowQueryLog(object):
+    """Collects statements that took longer than ``threshold`` seconds,
+    counting execution and fetching time together.
+
+    Entries are keyed by SQL text and keep the shape of the parameters
+    (their types, never their values), the routes that ran them and the
+    statement's EXPLAIN QUERY PLAN, which is captured once per SQL text.
+    Plans that scan a whole table are flagged as wanting an index. Every
+    slow statement is also logged to the ``in_database.db`` logger.
+    """
+
+    def __init__(self, threshold, max_entries=500):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def observe(self, conn, sql, parameters, seconds, route, many=False):
+        """Record a statement ``conn`` ran that took ``seconds``; called
+        once the statement passes the threshold.
+        """
+        with self._lock:
+            entry = self._entries.get(sql)
+            capture = entry is None and len(self._entries) < self.max_entries
+
+        plan = self.explain(conn, sql, parameters, many) if capture else None
+        shape = parameter_shape(parameters, many)
+
+        with self._lock:
+            entry = self._entries.get(sql)
+
+            if entry is None:
+                if len(self._entries) >= self.max_entries:
+                    return
+
+                entry = self._entries[sql] = {
+                    'sql': sql,
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'parameters': shape,
+                    'routes': {},
+                    'plan': plan,
+                    'scans': full_scans(plan),
+                }
+
+            entry['count'] += 1
+            entry['total_ms'] += seconds * 1000
+            entry['max_ms'] = max(entry['max_ms'], seconds * 1000)
+            entry['routes'][route] = entry['routes'].get(route, 0) + 1
+            scans = entry['scans']
+
+        logger.warning('Slow query (%.1f ms) on route %s: %s parameters=%s%s',
+                       seconds * 1000, route, sql, shape,
+                       ' SCAN on {}'.format(', '.join(scans)) if scans else '')
+
+    def extend(self, sql, extra, seconds):
+        """Add ``extra`` seconds spent fetching rows of a statement after it
+        was recorded, ``seconds`` being its whole duration so far.
+        """
+        with self._lock:
+            entry = self._entries.get(sql)
+
+            if entry is not None:
+                entry['total_ms'] += extra * 1000
+                entry['max_ms'] = max(entry['max_ms'], seconds * 1000)
+
+    def explain(self, conn, sql, parameters, many=False):
+        """Return the EXPLAIN QUERY PLAN detail lines of ``sql``, or None
+        if it cannot be explained (e.g. a PRAGMA or a script).
+        """
+        if many:
+            parameters = parameters[0] if isinstance(parameters, (list, tuple)) and parameters \
+                else None
+            if parameters is None:
+                return None
+
+        try:
+            # a plain cursor, so the plan query is not itself instrumented
+            cursor = conn.cursor(sqlite3.Cursor)
+            plan = [row[-1] for row in cursor.execute('EXPLAIN QUERY PLAN ' + sql, parameters)]
+            cursor.close()
+        except (sqlite3.Error, ValueError):
+            return None
+
+        return plan
+
+    def report(self):
+        """Return the slow statements, slowest in total first."""
+        with self._lock:
+            entries = [dict(entry, routes=dict(entry['routes']),
+                            total_ms=round(entry['total_ms'], 3),
+                            max_ms=round(entry['max_ms'], 3),
+                            needs_index=bool(entry['scans']))
+                       for entry in self._entries.values()]
+
+        return sorted(entries, key=lambda entry: entry['total_ms'], reverse=True)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# "SCAN doctors" (or "SCAN TABLE doctors" before SQLite 3.36) reads every
+# row; "SCAN doctors USING [COVERING] INDEX ..." only walks an index.
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(?!CONSTANT ROW)(\w+)\b')
+
+
+def full_scans(plan):
+    """Return the tables a query plan reads in full."""
+    return [match.group(1) for match in map(FULL_SCAN.match, plan or [])
+            if match and ' USING ' not in match.string]
+
+
+def parameter_shape(parameters, many=False):
+    """Describe query parameters by type only, e.g. '(int, str)'."""
+    if many:
+        try:
+            return 'many x {}'.format(parameter_shape(parameters[0]))
+        except (IndexError, KeyError, TypeError):
+            return 'many'
+
+    if isinstance(parameters, dict):
+        return '{' + ', '.join('{}: {}'.format(key, type(value).__name__)
+                               for key, value in sorted(parameters.items())) + '}'
+
+    return '(' + ', '.join(type(value).__name__ for value in parameters) + ')'
+
+
+# Pragmas applied to every pooled connection, in order, and the config keys
+# they are read from. journal_mode comes first so the others apply to WAL.
+POOL_PRAGMAS = [
+    ('journal_mode', 'DB_JOURNAL_MODE'),
+    ('synchronous', 'DB_SYNCHRONOUS'),
+    ('cache_size', 'DB_CACHE_SIZE'),
+    ('mmap_size', 'DB_MMAP_SIZE'),
+    ('busy_timeout', 'DB_BUSY_TIMEOUT'),
+    ('temp_store', 'DB_TEMP_STORE'),
+]
+
+# Read-only connections cannot change the journal mode, and synchronous
+# only matters to writers.
+READONLY_SKIPPED_PRAGMAS = ('journal_mode', 'synchronous')
+
+PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+_pool_lock = threading.Lock()
+
+
+def get_pool(app=None, readonly=False):
+    """Return the app's read-write connection pool, or its read-only one,
+    creating it on first use.
+    """
+    app = app or current_app._get_current_object()
+    extension = 'db_read_pool' if readonly else 'db_pool'
+    pool = app.extensions.get(extension)
+
+    if pool is None:
+        with _pool_lock:
+            pool = app.extensions.get(extension)
+
+            if pool is None:
+                pragmas = []
+
+                for name, key in POOL_PRAGMAS:
+                    value = app.config.get(key)
+
+                    if readonly and name in READONLY_SKIPPED_PRAGMAS:
+                        continue
+
+                    if value is None:
+                        continue
+                    if not PRAGMA_VALUE.match(str(value)):
+                        raise ValueError('Invalid value for {}: {!r}'.format(key, value))
+
+                    pragmas.append((name, value))
+
+                if readonly and app.config.get('DB_READ_QUERY_ONLY'):
+                    pragmas.append(('query_only', 1))
+
+                pool = ConnectionPool(
+                    app.config['DATABASE'],
+                    size=app.config.get('DB_POOL_SIZE', 8),
+                    timeout=app.config.get('DB_POOL_TIMEOUT', 5.0),
+                    pragmas=pragmas,
+                    metrics=metrics.get_metrics(app) if app.config.get('METRICS_ENABLED') else None,
+                    slow_log=get_slow_log(app),
+                    readonly=readonly
+                )
+                app.extensions[extension] = pool
+
+    return pool
+
+
+def close_pool(app):
+    """Close the app's pooled connections and stop its group commit writer,
+    e.g. before removing the file.
+    """
+    writer = app.extensions.pop('db_writer', None)
+
+    if writer is not None:
+        writer.close()
+
+    for extension in ('db_pool', 'db_read_pool'):
+        pool = app.extensions.pop(extension, None)
+
+        if pool is not None:
+            pool.close()
+
+
+def get_slow_log(app=None):
+    """Return the app's slow query log, or None if DB_SLOW_QUERY_MS is
+    not set.
+    """
+    app = app or current_app._get_current_object()
+
+    if app.config.get('DB_SLOW_QUERY_MS') is None:
+        return None
+
+    slow_log = app.extensions.get('db_slow_log')
+
+    if slow_log is None:
+        slow_log = app.extensions.setdefault(
+            'db_slow_log', SlowQueryLog(app.config['DB_SLOW_QUERY_MS'] / 1000))
+
+    return slow_log
+
+
+def get_writer(app=None):
+    """Return the app's group commit writer, creating it on first use."""
+    app = app or current_app._get_current_object()
+    writer = app.extensions.get('db_writer')
+
+    if writer is None:
+        pool = get_pool(app)
+
+        with _pool_lock:
+            writer = app.extensions.get('db_writer')
+
+            if writer is None:
+                writer = app.extensions['db_writer'] = GroupCommitWriter(
+                    pool.connect,
+                    window=app.config.get('DB_GROUP_COMMIT_WINDOW', 0.002),
+                    max_jobs=app.config.get('DB_GROUP_COMMIT_MAX_JOBS', 256)
+                )
+
+    return writer
+
+
+def run_write(fn):
+    """Run ``fn(conn)`` in a write transaction, commit it and return what
+    ``fn`` returned. ``fn`` must not commit or roll back itself.
+
+    With DB_GROUP_COMMIT on, ``fn`` runs on the group commit writer's
+    connection and shares its commit with other writes arriving at about
+    the same time. Otherwise it runs on this request's connection.
+    """
+    if current_app.config.get('DB_GROUP_COMMIT'):
+        return get_writer().submit(fn)
+
+    conn = get_db()
+    started = time.perf_counter()
+
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+    finally:
+        # the wait for the write lock, whether it was granted or timed out
+        get_pool().record_write_lock(time.perf_counter() - started)
+
+    try:
+        result = fn(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return result
+
+
+def use_readonly():
+    """Return True if this is a GET or HEAD request and DB_READONLY_GETS is
+    set, i.e. get_db should hand out a read-only connection by default.
+    """
+    return bool(current_app.config.get('DB_READONLY_GETS') and has_request_context() and
+                request.method in ('GET', 'HEAD'))
+
+
+def get_db(readonly=None):
+    """Connect to the application's configured database. The connection
+    is checked out of the pool once per request and will be reused if this
+    is called again.
+
+    :param readonly: Whether to use a read-only connection. By default GET
+        and HEAD requests read through one (see use_readonly); pass False
+        where such a request has to write, or to read its own writes.
+    """
+    if readonly is None:
+        readonly = use_readonly()
+
+    name = 'db_ro' if readonly else 'db'
+
+    if name not in g:
+        setattr(g, name, get_pool(readonly=readonly).checkout())
+
+    return getattr(g, name)
+
+
+def close_db(e=None):
+    """Return any connections this request checked out to their pools."""
+    for name, readonly in (('db', False), ('db_ro', True)):
+        db = g.pop(name, None)
+
+        if db is not None:
+            get_pool(readonly=readonly).checkin(db)
 
 
 def init_db():
@@ -37,6 +656,80 @@ def init_db():
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
 
+    migrate_db()
+
+
+# Migration scripts live in the migrations folder and are named
+# NNNN_description.sql; they are applied in version order.
+MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.sql$')
+
+
+def list_migrations():
+    """Return the (version, name, filename) of every migration script,
+    ordered by version.
+    """
+    migrations = []
+
+    for filename in os.listdir(os.path.join(current_app.root_path, 'migrations')):
+        match = MIGRATION_FILE.match(filename)
+
+        if match is not None:
+            migrations.append((int(match.group(1)), match.group(2), filename))
+
+    return sorted(migrations)
+
+
+def get_schema_version(db):
+    """Return the highest migration version applied to the database, or 0
+    if none have been applied yet.
+    """
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS schema_version ('
+        'version INTEGER PRIMARY KEY, '
+        'name TEXT NOT NULL, '
+        'applied_at INTEGER NOT NULL)'
+    )
+
+    row = db.execute('SELECT MAX(version) FROM schema_version').fetchone()
+
+    return row[0] or 0
+
+
+def migrate_db(target=None):
+    """Apply every pending migration up to ``target`` (or the latest one)
+    without touching existing data. Each migration runs in its own
+    transaction together with its schema_version row, so a failing script
+    leaves the database at the previous version.
+
+    :return: List of (version, name) pairs that were applied
+    """
+    db = get_db()
+    current = get_schema_version(db)
+    applied = []
+
+    for version, name, filename in list_migrations():
+        if version <= current or (target is not None and version > target):
+            continue
+
+        with current_app.open_resource(os.path.join('migrations', filename)) as f:
+            script = f.read().decode('utf8')
+
+        try:
+            db.executescript(
+                'BEGIN;\n{}\n'
+                "INSERT INTO schema_version (version, name, applied_at) "
+                "VALUES ({}, '{}', strftime('%s', 'now'));\n"
+                'COMMIT;'.format(script, version, name)
+            )
+        except sqlite3.Error:
+            if db.in_transaction:
+                db.rollback()
+            raise
+
+        applied.append((version, name))
+
+    return applied
+
 
 @click.command('init-db')
 @with_appcontext
@@ -46,9 +739,25 @@ def init_db_command():
     click.echo('Initialized the database.')
 
 
+@click.command('migrate')
+@click.option('--to', 'target', type=int, default=None,
+              help='Stop after this migration version.')
+@with_appcontext
+def migrate_command(target):
+    """Bring the schema up to date without dropping any data."""
+    applied = migrate_db(target)
+
+    for version, name in applied:
+        click.echo('Applied migration {:04d} {}.'.format(version, name))
+
+    click.echo('Database is at schema version {}.'.format(
+        get_schema_version(get_db())))
+
+
 def init_app(app):
     """Register database functions with the Flask app. This is called by
     the application factory.
     """
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_command)
@@ -0,0 +1,120 @@
+from flask import request
+
+from in_database import shift_rules, versions
+from in_database.schedules import ONE_WEEK
+from in_database.scheduling import get_day
+
+
+# Related rows that can be embedded in doctor responses with ?include=
+RELATIONS = ('locations', 'hours')
+
+
+class IncludeError(ValueError):
+    """Raised for an unknown relation in the ``include`` query parameter."""
+
+
+def get_include_arg():
+    """Read the comma separated ``include`` query parameter.
+
+    :return: Tuple of the relations asked for, in RELATIONS order
+    """
+    names = {name.strip() for name in request.args.get('include', '').split(',') if name.strip()}
+    unknown = names.difference(RELATIONS)
+
+    if unknown:
+        raise IncludeError('Unknown include {}; expected some of {}'.format(
+            ', '.join(sorted(unknown)), ', '.join(RELATIONS)))
+
+    return tuple(name for name in RELATIONS if name in names)
+
+
+def get_etag(conn, scopes, doctor_ids, include, current_day):
+    """Build the ETag of a doctor response with ``include`` embedded: the
+    embedded rows change with each doctor's scope, with location addresses
+    and, for hours, with the day the week starts on.
+    """
+    scopes = list(scopes) + [versions.doctor_scope(doctor_id) for doctor_id in doctor_ids]
+    extra = ()
+
+    if 'locations' in include:
+        scopes.append(versions.LOCATIONS)
+    if 'hours' in include:
+        extra = (current_day, )
+
+    return versions.get_etag(conn, scopes, *extra)
+
+
+def load_locations(conn, doctor_ids):
+    """Fetch the locations of all ``doctor_ids`` in one query.
+
+    :return: {doctor_id: [{"id", "address"}]}
+    """
+    locations = {doctor_id: [] for doctor_id in doctor_ids}
+
+    if not doctor_ids:
+        return locations
+
+    for doctor_id, location_id, address in conn.execute(
+            'SELECT dl.doctor_id, l.id, l.address '
+            'FROM doctor_locations dl '
+            'INNER JOIN locations l ON dl.location_id = l.id '
+            'WHERE dl.doctor_id IN ({}) '
+            'ORDER BY dl.doctor_id, l.id'.format(', '.join('?' * len(doctor_ids))),
+            list(doctor_ids)):
+        locations[doctor_id].append({'id': location_id, 'address': address})
+
+    return locations
+
+
+def load_hours(conn, doctor_ids, start, end):
+    """Fetch the shifts of all ``doctor_ids`` overlapping [start, end),
+    with one query for doctor_hours and the shift rule queries, and
+    expand the rules into the same list.
+
+    :return: {doctor_id: [{"day_stamp", "shift_start", "shift_end"}]}
+        sorted by shift_start
+    """
+    hours = {doctor_id: [] for doctor_id in doctor_ids}
+
+    if not doctor_ids:
+        return hours
+
+    for doctor_id, day_stamp, shift_start, shift_end in conn.execute(
+            'SELECT doctor_id, day_stamp, shift_start, shift_end '
+            'FROM doctor_hours '
+            'WHERE doctor_id IN ({}) AND shift_start < ? AND shift_end > ?'.format(
+                ', '.join('?' * len(doctor_ids))),
+            list(doctor_ids) + [end, start]):
+        hours[doctor_id].append(
+            {'day_stamp': day_stamp, 'shift_start': shift_start, 'shift_end': shift_end})
+
+    for doctor_id, rules in shift_rules.load_rules(conn, doctor_ids, start, end - 1).items():
+        for shift_start, shift_end in shift_rules.expand(rules, start, end - 1):
+            hours[doctor_id].append({'day_stamp': get_day(shift_start),
+                                     'shift_start': shift_start, 'shift_end': shift_end})
+
+    for doctor_hours in hours.values():
+        doctor_hours.sort(key=lambda hour: hour['shift_start'])
+
+    return hours
+
+
+def embed(conn, doctors, include, current_day):
+    """Return copies of the ``doctors`` dicts with each relation in
+    ``include`` added under its name. Every relation is loaded for all the
+    doctors at once, so the number of queries does not grow with the
+    number of doctors.
+
+    Hours cover the week starting at ``current_day``, as the weekly
+    schedule does.
+    """
+    doctor_ids = [doctor['id'] for doctor in doctors]
+    related = {}
+
+    if 'locations' in include:
+        related['locations'] = load_locations(conn, doctor_ids)
+    if 'hours' in include:
+        related['hours'] = load_hours(conn, doctor_ids, current_day, current_day + ONE_WEEK)
+
+    return [dict(doctor, **{name: rows[doctor['id']] for name, rows in related.items()})
+            for doctor in doctors]
@@ -0,0 +1,308 @@
+import bisect
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from flask import current_app, g, has_request_context, request
+
+
+# Upper bounds (seconds) of the request latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Route label for queries run outside of a request, e.g. by the group
+# commit writer or a CLI command.
+NO_ROUTE = 'none'
+
+
+class Histogram(object):
+    """Cumulative-style latency histogram over fixed bucket bounds."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Yield (upper bound, observations <= bound), ending with +Inf."""
+        total = 0
+
+        for bound, count in zip(self.buckets + (float('inf'), ), self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics(object):
+    """Per-process request and SQL counters, labelled by route (the Flask
+    endpoint name).
+
+    Requests record their count, errors (status >= 400) and latency. Every
+    statement run through an InstrumentedConnection records a query, the
+    rows fetched for it and the time spent in SQLite, against the
+    route that ran it. Queries per request is then queries / requests, which
+    is what gives an N+1 pattern away.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.latency = defaultdict(Histogram)
+        self.queries = defaultdict(int)
+        self.rows = defaultdict(int)
+        self.sql_seconds = defaultdict(float)
+
+    def observe_request(self, route, seconds, error):
+        with self._lock:
+            self.requests[route] += 1
+            self.latency[route].observe(seconds)
+            if error:
+                self.errors[route] += 1
+
+    def observe_sql(self, seconds, queries=0, rows=0):
+        route = current_route()
+
+        with self._lock:
+            self.queries[route] += queries
+            self.rows[route] += rows
+            self.sql_seconds[route] += seconds
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            lines = []
+
+            def counter(name, help_text, values):
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} counter'.format(name))
+                for route in sorted(values):
+                    lines.append('{}{{route="{}"}} {}'.format(name, escape(route), values[route]))
+
+            counter('in_database_requests_total', 'Requests handled.', self.requests)
+            counter('in_database_request_errors_total',
+                    'Requests answered with a 4xx or 5xx status.', self.errors)
+
+            name = 'in_database_request_duration_seconds'
+            lines.append('# HELP {} Request latency.'.format(name))
+            lines.append('# TYPE {} histogram'.format(name))
+            for route in sorted(self.latency):
+                histogram = self.latency[route]
+                label = escape(route)
+
+                for bound, count in histogram.cumulative():
+                    lines.append('{}_bucket{{route="{}",le="{}"}} {}'.format(
+                        name, label, '+Inf' if bound == float('inf') else bound, count))
+
+                lines.append('{}_sum{{route="{}"}} {}'.format(name, label, histogram.sum))
+                lines.append('{}_count{{route="{}"}} {}'.format(
+                    name, label, sum(histogram.counts)))
+
+            counter('in_database_sql_queries_total', 'SQL statements executed.', self.queries)
+            counter('in_database_sql_rows_total', 'Rows fetched from SQLite.', self.rows)
+            counter('in_database_sql_seconds_total',
+                    'Time spent executing statements and fetching rows.', self.sql_seconds)
+
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    """Escape a Prometheus label value."""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def current_route():
+    if has_request_context():
+        return request.endpoint or NO_ROUTE
+
+    return NO_ROUTE
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that reports its statements and fetched rows to the metrics
+    and slow query log (see db.SlowQueryLog) of its connection.
+    """
+
+    # the statement last executed, the time spent on it so far, including
+    # fetching its rows, and whether it is in the slow query log yet
+    _statement = None
+    _seconds = 0.0
+    _logged = False
+    # rows fetched by iterating and the time spent on them, reported
+    # together when the iteration ends rather than row by row
+    _iterated = 0
+    _iterated_seconds = 0.0
+
+    def _start(self, sql, parameters, many=False):
+        self._report()
+        self._statement = (sql, parameters, many)
+        self._seconds = 0.0
+        self._logged = False
+
+    def _observe(self, elapsed, queries=0, rows=0):
+        elapsed += self._iterated_seconds
+        rows += self._iterated
+        self._iterated = 0
+        self._iterated_seconds = 0.0
+        conn = self.connection
+
+        if conn.metrics is not None:
+            conn.metrics.observe_sql(elapsed, queries, rows)
+
+        if conn.slow_log is not None and self._statement is not None:
+            before = self._seconds
+            self._seconds += elapsed
+            sql, parameters, many = self._statement
+
+            if self._logged:
+                # already logged; the rows fetched since still count
+                conn.slow_log.extend(sql, elapsed, self._seconds)
+            elif before <= conn.slow_log.threshold < self._seconds:
+                # log a statement once, when it goes over the threshold
+                conn.slow_log.observe(conn, sql, parameters, self._seconds,
+                                      current_route(), many)
+                self._logged = True
+
+    def _report(self):
+        """Report the rows iterated over that have not been reported yet."""
+        if self._iterated or self._iterated_seconds:
+            self._observe(0.0)
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._observe(time.perf_counter() - started, queries=1)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._start(sql, seq_of_parameters, many=True)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._observe(time.perf_counter() - started, queries=1)
+
+    def executescript(self, sql_script):
+        self._start(sql_script, ())
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self._observe(time.perf_counter() - started, queries=1)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._observe(time.perf_counter() - started, rows=0 if row is None else 1)
+
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._observe(time.perf_counter() - started, rows=len(rows))
+
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._observe(time.perf_counter() - started, rows=len(rows))
+
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._iterated_seconds += time.perf_counter() - started
+            self._report()
+            raise
+
+        # counted on the cursor only; reported at the end of the iteration,
+        # on close or by the next statement, so rows take no lock
+        self._iterated += 1
+        self._iterated_seconds += time.perf_counter() - started
+
+        return row
+
+    def close(self):
+        self._report()
+        super().close()
+
+    def __del__(self):
+        # an iteration stopped early without closing the cursor
+        try:
+            self._report()
+        except Exception:
+            pass
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors, including the ones made by the execute
+    shortcuts, are InstrumentedCursors. ``metrics`` and ``slow_log`` are
+    set by the pool.
+    """
+
+    metrics = None
+    slow_log = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def get_metrics(app=None):
+    """Return the app's metrics, creating them on first use."""
+    app = app or current_app._get_current_object()
+    metrics = app.extensions.get('metrics')
+
+    if metrics is None:
+        metrics = app.extensions.setdefault('metrics', Metrics())
+
+    return metrics
+
+
+def start_timer():
+    g.metrics_started = time.perf_counter()
+
+
+def record_request(response):
+    started = g.pop('metrics_started', None)
+
+    if started is not None:
+        get_metrics().observe_request(current_route(), time.perf_counter() - started,
+                                      response.status_code >= 400)
+
+    return response
+
+
+def record_exception(e=None):
+    # after_request is skipped when a view raises, so count it here
+    started = g.pop('metrics_started', None)
+
+    if started is not None and e is not None:
+        get_metrics().observe_request(current_route(), time.perf_counter() - started, True)
+
+
+def init_app(app):
+    """Time every request when METRICS_ENABLED is set."""
+    if app.config.get('METRICS_ENABLED'):
+        app.before_request(start_timer)
+        app.after_request(record_request)
+        app.teardown_request(record_exception)
@@ -0,0 +1,19 @@
+-- Indexes for the hot booking and schedule queries.
+-- check_apmnt looks up appointments by doctor and time window, the weekly
+-- schedule scans appointments and hours by doctor and day, doc_avail reads
+-- hours by doctor and shift start and the location listing joins on doctor.
+
+CREATE INDEX IF NOT EXISTS idx_appointments_doctor_time
+  ON appointments (doctor_id, apmnt_time);
+
+CREATE INDEX IF NOT EXISTS idx_appointments_doctor_day
+  ON appointments (doctor_id, day_stamp);
+
+CREATE INDEX IF NOT EXISTS idx_doctor_hours_doctor_day
+  ON doctor_hours (doctor_id, day_stamp);
+
+CREATE INDEX IF NOT EXISTS idx_doctor_hours_doctor_start
+  ON doctor_hours (doctor_id, shift_start);
+
+CREATE INDEX IF NOT EXISTS idx_doctor_locations_doctor_location
+  ON doctor_locations (doctor_id, location_id);
@@ -0,0 +1,9 @@
+-- Version counters behind the ETags on the read endpoints.
+-- Every write handler bumps the scopes it changes in the same transaction:
+-- 'doctors' for the doctor list, 'locations' for addresses and
+-- 'doctor:<id>' for everything belonging to one doctor.
+
+CREATE TABLE IF NOT EXISTS data_versions (
+  scope TEXT PRIMARY KEY,
+  version INTEGER NOT NULL
+) WITHOUT ROWID;
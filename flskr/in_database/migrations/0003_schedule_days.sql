@@ -0,0 +1,12 @@
+-- Materialized weekly schedule.
+-- One row per doctor and day holding that day's shifts and appointments
+-- as the JSON the weekly schedule endpoint returns. Rows are rebuilt by
+-- the write handlers that change them and built lazily on first read.
+
+CREATE TABLE IF NOT EXISTS schedule_days (
+  doctor_id INTEGER NOT NULL,
+  day_stamp INTEGER NOT NULL,
+  hours TEXT NOT NULL,
+  appointments TEXT NOT NULL,
+  PRIMARY KEY (doctor_id, day_stamp)
+) WITHOUT ROWID;
@@ -0,0 +1,5 @@
+-- Index for finding the doctors working at a location, used by the free
+-- slot searches.
+
+CREATE INDEX IF NOT EXISTS idx_doctor_locations_location_doctor
+  ON doctor_locations (location_id, doctor_id);
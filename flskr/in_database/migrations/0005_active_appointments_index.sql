@@ -0,0 +1,13 @@
+-- Cancelled appointments no longer block their slot, so the booking check,
+-- slot searches and schedules only read live appointments. Partial indexes
+-- over is_canceled = 0 keep cancelled rows out of those lookups entirely.
+-- The by-day index is only used by the schedule, so it is replaced; the
+-- full by-time index still serves the appointment listing.
+
+CREATE INDEX IF NOT EXISTS idx_appointments_active_doctor_time
+  ON appointments (doctor_id, apmnt_time) WHERE is_canceled = 0;
+
+CREATE INDEX IF NOT EXISTS idx_appointments_active_doctor_day
+  ON appointments (doctor_id, day_stamp) WHERE is_canceled = 0;
+
+DROP INDEX IF EXISTS idx_appointments_doctor_day;
@@ -0,0 +1,26 @@
+-- Recurring weekly shifts, stored as one rule instead of one doctor_hours
+-- row per shift and expanded only for the days a query asks about (see
+-- shift_rules.py). weekdays is a bitmask with bit 0 = Monday; start_time
+-- and end_time are seconds after local midnight; start_day, end_day and
+-- the exception days are local midnights, and a NULL end_day never ends.
+
+CREATE TABLE IF NOT EXISTS shift_rules (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  doctor_id INTEGER NOT NULL,
+  weekdays INTEGER NOT NULL,
+  start_time INTEGER NOT NULL,
+  end_time INTEGER NOT NULL,
+  start_day INTEGER NOT NULL,
+  end_day INTEGER,
+  FOREIGN KEY (doctor_id) REFERENCES doctors (id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_shift_rules_doctor_start
+  ON shift_rules (doctor_id, start_day);
+
+CREATE TABLE IF NOT EXISTS shift_rule_exceptions (
+  rule_id INTEGER NOT NULL,
+  day_stamp INTEGER NOT NULL,
+  PRIMARY KEY (rule_id, day_stamp),
+  FOREIGN KEY (rule_id) REFERENCES shift_rules (id)
+);
@@ -0,0 +1,110 @@
+import base64
+import json
+from urllib.parse import urlencode
+
+from flask import current_app, request
+
+
+class PageError(ValueError):
+    """Raised for a malformed ``limit``, ``after`` or ``ids`` query
+    parameter.
+    """
+
+
+def encode_cursor(values):
+    """Encode the sort key of the last row on a page as an opaque cursor."""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf8')
+
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """Decode a cursor made by encode_cursor back into its ``size`` values."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw.decode('utf8'))
+    except ValueError:
+        raise PageError('Invalid cursor')
+
+    if (not isinstance(values, list) or len(values) != size or
+            not all(isinstance(value, int) for value in values)):
+        raise PageError('Invalid cursor')
+
+    return values
+
+
+def get_page_args(key_size):
+    """Read ``limit`` and ``after`` from the query string.
+
+    :param key_size: Number of values in the sort key the cursor encodes
+    :return: (limit, after) where after is None for the first page
+    """
+    try:
+        limit = int(request.args.get('limit', current_app.config['PAGE_SIZE_DEFAULT']))
+    except ValueError:
+        raise PageError('limit must be an integer')
+
+    if limit < 1:
+        raise PageError('limit must be positive')
+
+    limit = min(limit, current_app.config['PAGE_SIZE_MAX'])
+    after = request.args.get('after')
+
+    if after is not None:
+        after = decode_cursor(after, key_size)
+
+    return limit, after
+
+
+def get_ids_arg(name='ids'):
+    """Read a comma separated list of integer IDs from the query string.
+
+    :return: The distinct IDs in the order given, or None if ``name`` is
+        not in the query string
+    """
+    value = request.args.get(name)
+
+    if value is None:
+        return None
+
+    try:
+        ids = [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        raise PageError('{} must be comma separated integers'.format(name))
+
+    if not ids:
+        raise PageError('{} must not be empty'.format(name))
+
+    ids = list(dict.fromkeys(ids))
+
+    if len(ids) > current_app.config['BATCH_MAX_IDS']:
+        raise PageError('Too many {}; the limit is {}'.format(
+            name, current_app.config['BATCH_MAX_IDS']))
+
+    return ids
+
+
+def paginate(rows, limit, key):
+    """Trim the extra row a page query fetched and, if there was one, build
+    the X-Next-Cursor and Link headers pointing at the next page.
+
+    Page queries ask for ``limit + 1`` rows so the last page can be told
+    apart without a COUNT.
+
+    :param key: Function returning the sort key values of a row
+    :return: (rows on this page, response headers)
+    """
+    if len(rows) <= limit:
+        return rows, {}
+
+    rows = rows[:limit]
+    cursor = encode_cursor(list(key(rows[-1])))
+    args = request.args.to_dict()
+    args.update(limit=limit, after=cursor)
+
+    headers = {
+        'X-Next-Cursor': cursor,
+        'Link': '<{}?{}>; rel="next"'.format(request.base_url, urlencode(sorted(args.items()))),
+    }
+
+    return rows, headers
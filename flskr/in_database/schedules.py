@@ -0,0 +1,147 @@
+from datetime import date, datetime, timedelta
+
+from in_database import serialize, shift_rules
+from in_database.scheduling import get_day
+
+
+# The weekly schedule covers today through the same time next week.
+ONE_WEEK = 604800
+
+
+def day_bounds(day_stamp):
+    """Return the local midnight starting the day of ``day_stamp`` and the
+    one starting the next day.
+    """
+    day = date.fromtimestamp(day_stamp)
+    next_day = datetime.combine(day + timedelta(days=1), datetime.min.time())
+
+    return get_day(day_stamp), int(next_day.timestamp())
+
+
+def to_json(rows):
+    return serialize.dumps(serialize.to_dicts(rows)).decode('utf8')
+
+
+def build_day(conn, doctor_id, day_stamp):
+    """Compute one doctor's shifts, including the ones their shift rules
+    produce, and live appointments for the day starting at ``day_stamp``
+    as two JSON arrays.
+    """
+    start, end = day_bounds(day_stamp)
+
+    hours = conn.execute(
+        'SELECT dhrs.day_stamp, d.first_name, d.last_name, dhrs.shift_start, dhrs.shift_end '
+        'FROM doctor_hours dhrs '
+        'INNER JOIN doctors d ON dhrs.doctor_id = d.id '
+        'WHERE dhrs.doctor_id = ? '
+        'AND dhrs.day_stamp >= ? AND dhrs.day_stamp < ? '
+        'ORDER BY dhrs.shift_start, dhrs.id',
+        (doctor_id, start, end)
+    ).fetchall()
+    hours = serialize.to_dicts(hours)
+
+    rule_shifts = shift_rules.expand(
+        shift_rules.load_rules(conn, [doctor_id], start, end - 1)[int(doctor_id)], start, end - 1)
+
+    if rule_shifts:
+        doctor = conn.execute('SELECT first_name, last_name FROM doctors WHERE id = ?',
+                              (doctor_id, )).fetchone()
+        hours.extend({'day_stamp': start, 'first_name': doctor['first_name'],
+                      'last_name': doctor['last_name'], 'shift_start': shift_start,
+                      'shift_end': shift_end}
+                     for shift_start, shift_end in rule_shifts)
+        hours.sort(key=lambda hour: hour['shift_start'])
+
+    appointments = conn.execute(
+        'SELECT apmnt.day_stamp, d.first_name, d.last_name, l.address, apmnt.apmnt_time '
+        'FROM appointments apmnt '
+        'INNER JOIN locations l ON apmnt.location_id = l.id '
+        'INNER JOIN doctors d ON apmnt.doctor_id = d.id '
+        'WHERE apmnt.doctor_id = ? AND apmnt.is_canceled = 0 '
+        'AND apmnt.day_stamp >= ? AND apmnt.day_stamp < ? '
+        'ORDER BY apmnt.apmnt_time, apmnt.id',
+        (doctor_id, start, end)
+    ).fetchall()
+
+    return serialize.dumps(hours).decode('utf8'), to_json(appointments)
+
+
+def refresh_day(conn, doctor_id, day_stamp):
+    """Rebuild the materialized row for the doctor and the day containing
+    ``day_stamp``. Call this inside the write's transaction.
+    """
+    hours, appointments = build_day(conn, doctor_id, get_day(day_stamp))
+
+    conn.execute(
+        'INSERT OR REPLACE INTO schedule_days (doctor_id, day_stamp, hours, appointments) '
+        'VALUES (?, ?, ?, ?)',
+        (doctor_id, get_day(day_stamp), hours, appointments)
+    )
+
+
+def forget_doctor(conn, doctor_id):
+    """Drop every materialized day for a doctor, e.g. after a rename; they
+    are rebuilt on the next read.
+    """
+    conn.execute('DELETE FROM schedule_days WHERE doctor_id = ?', (doctor_id, ))
+
+
+def week_days(current_day):
+    """Return the local midnights of the eight days from ``current_day`` to
+    ``current_day + ONE_WEEK``.
+    """
+    first = date.fromtimestamp(current_day)
+
+    return [int(datetime.combine(first + timedelta(days=i), datetime.min.time()).timestamp())
+            for i in range(8)]
+
+
+def get_week(conn, doctor_id, current_day, get_writer=None):
+    """Return the doctor's schedule for the week starting at ``current_day``
+    as a JSON array: every shift, then every appointment.
+
+    Days that have not been materialized yet are built and stored first,
+    on the connection returned by ``get_writer`` if given (for when
+    ``conn`` is read-only), otherwise on ``conn``. Since that happens at
+    least once a day, as the week moves on, the doctor's rows for days
+    before ``current_day`` are deleted then too.
+    """
+    days = week_days(current_day)
+
+    rows = {row['day_stamp']: (row['hours'], row['appointments']) for row in conn.execute(
+        'SELECT day_stamp, hours, appointments FROM schedule_days '
+        'WHERE doctor_id = ? AND day_stamp BETWEEN ? AND ?',
+        (doctor_id, days[0], days[-1])
+    )}
+
+    missing = [day for day in days if day not in rows]
+
+    if missing:
+        conn = get_writer() if get_writer is not None else conn
+
+        # Build under the write lock so a booking committed meanwhile
+        # cannot be overwritten by a row computed before it.
+        conn.execute('BEGIN IMMEDIATE')
+
+        try:
+            for day in missing:
+                rows[day] = build_day(conn, doctor_id, day)
+
+            conn.executemany(
+                'INSERT OR REPLACE INTO schedule_days (doctor_id, day_stamp, hours, appointments) '
+                'VALUES (?, ?, ?, ?)',
+                [(doctor_id, day) + rows[day] for day in missing]
+            )
+            conn.execute(
+                'DELETE FROM schedule_days WHERE doctor_id = ? AND day_stamp < ?',
+                (doctor_id, days[0])
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    # Splice the stored arrays together rather than decoding them.
+    parts = [rows[day][0][1:-1] for day in days] + [rows[day][1][1:-1] for day in days]
+
+    return '[' + ','.join(part for part in parts if part) + ']'
@@ -0,0 +1,351 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+
+from flask import current_app
+
+from in_database import shift_rules, versions
+
+
+# Appointments for the same doctor closer than this many seconds conflict
+# (+/- 14:59, see schedule_appointment).
+APPOINTMENT_WINDOW = 899
+
+
+def get_day(timestamp):
+    """Return the timestamp of local midnight on the day of ``timestamp``."""
+    day = datetime.fromtimestamp(timestamp).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+
+    return int(day.timestamp())
+
+
+def is_available(db, doctor_id, apmnt_time, window=APPOINTMENT_WINDOW):
+    """Check ``apmnt_time`` against the database itself: it must fall inside
+    one of the doctor's shifts (or recurring shift rules) and clear of
+    their other live (not cancelled) appointments.
+
+    Run inside the booking's write transaction (BEGIN IMMEDIATE) so no
+    other process can book the same doctor between the check and the
+    insert.
+    """
+    in_shift, conflict = db.execute(
+        'SELECT EXISTS (SELECT 1 FROM doctor_hours '
+        'WHERE doctor_id = ? AND shift_start <= ? AND shift_end > ?), '
+        'EXISTS (SELECT 1 FROM appointments '
+        'WHERE doctor_id = ? AND apmnt_time BETWEEN ? AND ? AND is_canceled = 0)',
+        (doctor_id, apmnt_time, apmnt_time,
+         doctor_id, apmnt_time - window, apmnt_time + window)
+    ).fetchone()
+
+    if conflict:
+        return False
+
+    return bool(in_shift) or shift_rules.covers(
+        shift_rules.load_rules(db, [doctor_id], apmnt_time, apmnt_time)[int(doctor_id)],
+        apmnt_time)
+
+
+class DoctorSchedule(object):
+    """Sorted appointment times and shift intervals for one doctor.
+
+    Live appointment times are kept in a sorted list so a conflict check is
+    a single bisect; cancelled appointments free their slot. Shifts are
+    kept sorted by start together with the running maximum of their ends,
+    so "is the doctor working at t" is also a single bisect even when
+    shifts overlap. Recurring shift rules are kept as they are and only
+    expanded for the day being checked.
+
+    A schedule loaded by ScheduleIndex only holds what falls between
+    ``start`` and ``end`` (None for no bound); see covers.
+    """
+
+    # the doctor's data_versions version the schedule was loaded at, see
+    # ScheduleIndex.refresh
+    version = None
+    start = None
+    end = None
+
+    def __init__(self, appointments=(), shifts=(), rules=()):
+        self.times = []
+        self.appointments = {}
+        self.rules = list(rules)
+        self.shift_starts = []
+        self.shift_ends = []
+        self.max_ends = []
+        self.loaded_at = time.monotonic()
+
+        for appointment_id, apmnt_time, is_canceled in appointments:
+            self.add_appointment(appointment_id, apmnt_time, is_canceled)
+
+        for shift_start, shift_end in sorted((int(start), int(end)) for start, end in shifts):
+            self.shift_starts.append(shift_start)
+            self.shift_ends.append(shift_end)
+
+        self._update_max_ends(0)
+
+    def _update_max_ends(self, start):
+        del self.max_ends[start:]
+        running = self.max_ends[-1] if self.max_ends else None
+
+        for shift_end in self.shift_ends[start:]:
+            running = shift_end if running is None else max(running, shift_end)
+            self.max_ends.append(running)
+
+    def covers(self, apmnt_time):
+        """Return True if the schedule was loaded for ``apmnt_time``."""
+        return ((self.start is None or self.start <= apmnt_time) and
+                (self.end is None or apmnt_time <= self.end))
+
+    def has_conflict(self, apmnt_time, window=APPOINTMENT_WINDOW):
+        """Return True if an appointment falls within +/- ``window``
+        seconds of ``apmnt_time``.
+        """
+        i = bisect.bisect_left(self.times, apmnt_time - window)
+
+        return i < len(self.times) and self.times[i] <= apmnt_time + window
+
+    def in_shift(self, apmnt_time):
+        """Return True if some shift started at or before ``apmnt_time``
+        and has not ended yet.
+        """
+        i = bisect.bisect_right(self.shift_starts, apmnt_time)
+
+        if i > 0 and self.max_ends[i - 1] > apmnt_time:
+            return True
+
+        return shift_rules.covers(self.rules, apmnt_time)
+
+    def overlaps_shift(self, shift_start, shift_end):
+        """Return True if some shift starts before ``shift_end`` and ends
+        after ``shift_start``.
+        """
+        i = bisect.bisect_left(self.shift_starts, shift_end)
+
+        if i > 0 and self.max_ends[i - 1] > shift_start:
+            return True
+
+        return bool(shift_rules.expand(self.rules, shift_start, shift_end - 1))
+
+    def add_appointment(self, appointment_id, apmnt_time, is_canceled=0):
+        if is_canceled:
+            return
+
+        apmnt_time = int(apmnt_time)
+        self.appointments[appointment_id] = apmnt_time
+        bisect.insort(self.times, apmnt_time)
+
+    def cancel_appointment(self, appointment_id):
+        apmnt_time = self.appointments.pop(appointment_id, None)
+
+        if apmnt_time is not None:
+            del self.times[bisect.bisect_left(self.times, apmnt_time)]
+
+    def add_shift(self, shift_start, shift_end):
+        shift_start, shift_end = int(shift_start), int(shift_end)
+        i = bisect.bisect_right(self.shift_starts, shift_start)
+        self.shift_starts.insert(i, shift_start)
+        self.shift_ends.insert(i, shift_end)
+        self._update_max_ends(i)
+
+
+class ScheduleIndex(object):
+    """Per-process index of each doctor's appointments and shifts.
+
+    A doctor's schedule is loaded from the database the first time it is
+    needed and then kept in sync by the write handlers, so booking checks
+    do not query the database. Writes made by other processes are not
+    seen that way: a booking the index accepts is re-checked in the
+    database anyway, and before turning one down callers use refresh,
+    which reloads the schedule if the doctor's version has moved on since
+    it was loaded. Entries older than ``ttl`` seconds are also reloaded.
+
+    Only the appointments and shifts within ``horizon`` seconds of the
+    time being booked are loaded, so the cost of a load does not grow with
+    the doctor's history; a booking outside that range reloads the
+    schedule around its own time. At most ``maxsize`` doctors are kept,
+    the least recently used ones being dropped first.
+
+    Each doctor is guarded by one of ``stripes`` locks (see doctor_lock),
+    so bookings for different doctors are checked in parallel and only
+    queue up for SQLite's write lock. ``lock`` only guards the dict of
+    loaded schedules.
+    """
+
+    def __init__(self, ttl=None, stripes=64, maxsize=1024, horizon=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.horizon = horizon
+        self.lock = threading.RLock()
+        self.stripes = [threading.RLock() for _ in range(stripes)]
+        self._doctors = OrderedDict()
+
+    def doctor_lock(self, doctor_id):
+        """Return the lock serializing changes to ``doctor_id``'s schedule.
+        Doctors share a fixed number of locks, so two doctors only wait on
+        each other when they hash to the same stripe.
+        """
+        return self.stripes[int(doctor_id) % len(self.stripes)]
+
+    @contextmanager
+    def doctor_locks(self, doctor_ids):
+        """Hold the locks of all ``doctor_ids`` at once. Stripes are always
+        taken in the same order, so two batches cannot deadlock.
+        """
+        with ExitStack() as stack:
+            for stripe in sorted(set(int(doctor_id) % len(self.stripes)
+                                     for doctor_id in doctor_ids)):
+                stack.enter_context(self.stripes[stripe])
+
+            yield
+
+    def load(self, db, doctor_id, at=None):
+        """Load ``doctor_id``'s schedule for the ``horizon`` seconds either
+        side of ``at`` (default now), or all of it without a horizon.
+        """
+        if self.horizon is None:
+            start = end = None
+        else:
+            at = int(time.time() if at is None else at)
+            start, end = at - self.horizon, at + self.horizon
+
+        # read the version first, so a write landing while the rows are
+        # read leaves the schedule looking stale rather than current
+        version = versions.get_version(db, versions.doctor_scope(doctor_id))
+
+        if start is None:
+            appointments = db.execute(
+                'SELECT id, apmnt_time, is_canceled FROM appointments '
+                'WHERE doctor_id = ? AND is_canceled = 0',
+                (doctor_id, )
+            ).fetchall()
+
+            shifts = db.execute(
+                'SELECT shift_start, shift_end FROM doctor_hours '
+                'WHERE doctor_id = ?',
+                (doctor_id, )
+            ).fetchall()
+        else:
+            # appointments just outside the range still conflict with
+            # slots at its edges
+            appointments = db.execute(
+                'SELECT id, apmnt_time, is_canceled FROM appointments '
+                'WHERE doctor_id = ? AND apmnt_time BETWEEN ? AND ? AND is_canceled = 0',
+                (doctor_id, start - APPOINTMENT_WINDOW, end + APPOINTMENT_WINDOW)
+            ).fetchall()
+
+            shifts = db.execute(
+                'SELECT shift_start, shift_end FROM doctor_hours '
+                'WHERE doctor_id = ? AND shift_start <= ? AND shift_end > ?',
+                (doctor_id, end, start)
+            ).fetchall()
+
+        rules = shift_rules.load_rules(db, [doctor_id], start, end)[int(doctor_id)]
+
+        schedule = DoctorSchedule(appointments, shifts, rules)
+        schedule.version = version
+        schedule.start, schedule.end = start, end
+
+        return schedule
+
+    def get(self, db, doctor_id, at=None):
+        """Return the schedule for ``doctor_id``, loading it if needed or
+        if it was not loaded for the time ``at`` (default now).
+        """
+        doctor_id = int(doctor_id)
+        at = time.time() if at is None else at
+
+        # Loading holds only this doctor's stripe, not the whole index.
+        with self.doctor_lock(doctor_id):
+            schedule = self._loaded(doctor_id)
+
+            if schedule is None or not schedule.covers(at) or (self.ttl is not None and
+                    time.monotonic() - schedule.loaded_at > self.ttl):
+                schedule = self.load(db, doctor_id, at)
+                self._store(doctor_id, schedule)
+
+            return schedule
+
+    def refresh(self, db, doctor_id, at=None):
+        """Return the schedule for ``doctor_id`` as get does, first
+        reloading it if another write (from this process or another) has
+        bumped the doctor's version since it was loaded. Costs one primary
+        key lookup when it is current.
+        """
+        doctor_id = int(doctor_id)
+
+        with self.doctor_lock(doctor_id):
+            schedule = self.get(db, doctor_id, at)
+
+            if schedule.version != versions.get_version(db, versions.doctor_scope(doctor_id)):
+                schedule = self.load(db, doctor_id, at)
+                self._store(doctor_id, schedule)
+
+            return schedule
+
+    def _loaded(self, doctor_id):
+        with self.lock:
+            schedule = self._doctors.get(int(doctor_id))
+
+            if schedule is not None:
+                self._doctors.move_to_end(int(doctor_id))
+
+            return schedule
+
+    def _store(self, doctor_id, schedule):
+        with self.lock:
+            self._doctors[doctor_id] = schedule
+            self._doctors.move_to_end(doctor_id)
+
+            while len(self._doctors) > self.maxsize:
+                self._doctors.popitem(last=False)
+
+    def __len__(self):
+        with self.lock:
+            return len(self._doctors)
+
+    def add_appointment(self, doctor_id, appointment_id, apmnt_time):
+        with self.doctor_lock(doctor_id):
+            schedule = self._loaded(doctor_id)
+            if schedule is not None:
+                schedule.add_appointment(appointment_id, apmnt_time)
+
+    def cancel_appointment(self, doctor_id, appointment_id):
+        with self.doctor_lock(doctor_id):
+            schedule = self._loaded(doctor_id)
+            if schedule is not None:
+                schedule.cancel_appointment(appointment_id)
+
+    def add_shift(self, doctor_id, shift_start, shift_end):
+        with self.doctor_lock(doctor_id):
+            schedule = self._loaded(doctor_id)
+            if schedule is not None:
+                schedule.add_shift(shift_start, shift_end)
+
+    def forget(self, doctor_id):
+        """Drop a doctor's schedule; it is reloaded on next use."""
+        with self.doctor_lock(doctor_id):
+            with self.lock:
+                self._doctors.pop(int(doctor_id), None)
+
+    def clear(self):
+        with self.lock:
+            self._doctors.clear()
+
+
+def get_index():
+    """Return the app's scheduling index, creating it on first use."""
+    app = current_app._get_current_object()
+    index = app.extensions.get('schedule_index')
+
+    if index is None:
+        index = app.extensions.setdefault(
+            'schedule_index', ScheduleIndex(app.config.get('SCHEDULE_INDEX_TTL'),
+                                            app.config['BOOKING_LOCK_STRIPES'],
+                                            app.config['SCHEDULE_INDEX_SIZE'],
+                                            app.config.get('SCHEDULE_INDEX_HORIZON')))
+
+    return index
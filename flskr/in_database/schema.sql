@@ -1,11 +1,18 @@
 -- Initialize the database.
 -- Drop any existing data and create empty tables.
+-- Indexes and later schema changes are applied by the migrations in
+-- migrations/ (see `flask migrate`).
 
 DROP TABLE IF EXISTS doctors;
 DROP TABLE IF EXISTS locations;
 DROP TABLE IF EXISTS doctor_locations;
 DROP TABLE IF EXISTS appointments;
 DROP TABLE IF EXISTS doctor_hours;
+DROP TABLE IF EXISTS schema_version;
+DROP TABLE IF EXISTS data_versions;
+DROP TABLE IF EXISTS schedule_days;
+DROP TABLE IF EXISTS shift_rule_exceptions;
+DROP TABLE IF EXISTS shift_rules;
 
 CREATE TABLE doctors (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -0,0 +1,45 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+from flask import current_app
+
+
+def to_dicts(rows):
+    """Turn sqlite3.Row results into dicts, reading the column names once
+    from the first row instead of from cursor.description for every row.
+    """
+    if not rows:
+        return []
+
+    names = rows[0].keys()
+
+    return [dict(zip(names, row)) for row in rows]
+
+
+def to_dict(row):
+    """Turn one sqlite3.Row into a dict, or return None for no row."""
+    if row is None:
+        return None
+
+    return dict(zip(row.keys(), row))
+
+
+def dumps(obj):
+    """Serialize ``obj`` to compact JSON bytes with sorted keys, using
+    orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+
+    return json.dumps(obj, sort_keys=True, separators=(',', ':')).encode('utf8')
+
+
+def json_response(obj):
+    """Return ``obj`` as an application/json response, encoded in one pass
+    by dumps rather than by jsonify.
+    """
+    return current_app.response_class(dumps(obj), mimetype='application/json')
@@ -9,4 +9,11 @@ setup(
     install_requires=[
         'flask',
     ],
+    extras_require={
+        # vectorized free slot search and faster JSON encoding (pure Python
+        # fallbacks are used without them)
+        'speedups': ['numpy', 'orjson'],
+        # ASGI server for the async entry point in asgi.py
+        'asgi': ['uvicorn'],
+    },
 )
\ No newline at end of file
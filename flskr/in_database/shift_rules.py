@@ -0,0 +1,137 @@
+import functools
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+
+# Expanded (rule, day) pairs kept by rule_shift.
+EXPANSION_CACHE_SIZE = 65536
+
+# Weekday numbers follow date.weekday(): Monday is 0, Sunday 6.
+WEEKDAYS = range(7)
+
+
+class ShiftRule(namedtuple('ShiftRule', 'id doctor_id weekdays start_time end_time '
+                                        'start_day end_day exceptions')):
+    """A recurring weekly shift.
+
+    :param weekdays: Bitmask of the weekdays it applies on, bit 0 = Monday
+    :param start_time: Seconds after local midnight the shift starts
+    :param end_time: Seconds after local midnight the shift ends, at most
+        one day
+    :param start_day: Local midnight of the first day it applies
+    :param end_day: Local midnight of the last day it applies, or None if
+        it never ends
+    :param exceptions: frozenset of the local midnights it is skipped on
+
+    Rules are immutable and hashable, so their expansions can be cached by
+    value: changing a rule makes a new one, which never hits stale entries.
+    """
+
+    def applies(self, day_stamp):
+        return (self.start_day <= day_stamp and
+                (self.end_day is None or day_stamp <= self.end_day) and
+                day_stamp not in self.exceptions)
+
+
+def weekday_mask(weekdays):
+    """Turn a list of weekday numbers into a ShiftRule weekday bitmask."""
+    mask = 0
+
+    for weekday in weekdays:
+        if int(weekday) not in WEEKDAYS:
+            raise ValueError('Weekdays must be between 0 (Monday) and 6 (Sunday)')
+        mask |= 1 << int(weekday)
+
+    return mask
+
+
+def midnight(day):
+    return int(datetime.combine(day, datetime.min.time()).timestamp())
+
+
+def load_rules(conn, doctor_ids, start=None, end=None):
+    """Fetch the shift rules of all ``doctor_ids`` that apply on some day
+    between ``start`` and ``end`` (either may be None for no bound).
+
+    :return: {doctor_id: [ShiftRule]}
+    """
+    doctor_ids = sorted(set(int(doctor_id) for doctor_id in doctor_ids))
+    rules = {doctor_id: [] for doctor_id in doctor_ids}
+
+    if not doctor_ids:
+        return rules
+
+    placeholders = ', '.join('?' * len(doctor_ids))
+    where = 'r.doctor_id IN ({})'.format(placeholders)
+    params = list(doctor_ids)
+
+    if end is not None:
+        where += ' AND r.start_day <= ?'
+        params.append(end)
+    if start is not None:
+        where += ' AND (r.end_day IS NULL OR r.end_day >= ?)'
+        params.append(midnight(date.fromtimestamp(start)))
+
+    exceptions = {}
+    for rule_id, day_stamp in conn.execute(
+            'SELECT e.rule_id, e.day_stamp FROM shift_rule_exceptions e '
+            'INNER JOIN shift_rules r ON e.rule_id = r.id '
+            'WHERE {}'.format(where), params):
+        exceptions.setdefault(rule_id, set()).add(day_stamp)
+
+    for row in conn.execute(
+            'SELECT r.id, r.doctor_id, r.weekdays, r.start_time, r.end_time, '
+            'r.start_day, r.end_day FROM shift_rules r '
+            'WHERE {} ORDER BY r.id'.format(where), params):
+        rules[row[1]].append(ShiftRule(*row, exceptions=frozenset(exceptions.get(row[0], ()))))
+
+    return rules
+
+
+@functools.lru_cache(maxsize=EXPANSION_CACHE_SIZE)
+def rule_shift(rule, day_stamp):
+    """Return the (shift_start, shift_end) ``rule`` produces on the day
+    starting at ``day_stamp``, or None if it does not apply that day.
+    """
+    weekday = date.fromtimestamp(day_stamp).weekday()
+
+    if not rule.applies(day_stamp) or not rule.weekdays & (1 << weekday):
+        return None
+
+    return day_stamp + rule.start_time, day_stamp + rule.end_time
+
+
+def expand(rules, start, end):
+    """Return the sorted (shift_start, shift_end) of every shift ``rules``
+    produce that overlaps [start, end], i.e. starts at or before ``end``
+    and ends after ``start``.
+
+    Only the days of the window are expanded, one cached rule_shift per
+    rule and day.
+    """
+    if not rules:
+        return []
+
+    shifts = []
+    # shifts end by midnight, so none from before start's day can overlap
+    day = date.fromtimestamp(start)
+    day_stamp = midnight(day)
+
+    while day_stamp <= end:
+        for rule in rules:
+            shift = rule_shift(rule, day_stamp)
+
+            if shift is not None and shift[0] <= end and shift[1] > start:
+                shifts.append(shift)
+
+        day += timedelta(days=1)
+        day_stamp = midnight(day)
+
+    return sorted(shifts)
+
+
+def covers(rules, timestamp):
+    """Return True if one of ``rules`` has a shift under way at
+    ``timestamp``.
+    """
+    return bool(expand(rules, timestamp, timestamp))
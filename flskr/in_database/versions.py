@@ -0,0 +1,66 @@
+from flask import request
+from werkzeug.http import quote_etag
+
+
+# Version scope of the doctor list and of location addresses; each doctor
+# also has its own scope, see doctor_scope.
+DOCTORS = 'doctors'
+LOCATIONS = 'locations'
+
+
+def doctor_scope(doctor_id):
+    """Version scope covering one doctor's row, locations, hours and
+    appointments.
+    """
+    return 'doctor:{}'.format(int(doctor_id))
+
+
+def bump(conn, *scopes):
+    """Increment the version of each scope. Call this inside the write's
+    transaction, before it commits.
+    """
+    conn.executemany(
+        'INSERT INTO data_versions (scope, version) VALUES (?, 1) '
+        'ON CONFLICT (scope) DO UPDATE SET version = version + 1',
+        [(scope, ) for scope in set(scopes)]
+    )
+
+
+def get_version(conn, scope):
+    """Return the current version of ``scope``, 0 if it was never bumped."""
+    row = conn.execute(
+        'SELECT version FROM data_versions WHERE scope = ?', (scope, )
+    ).fetchone()
+
+    return 0 if row is None else row[0]
+
+
+def get_etag(conn, scopes, *extra):
+    """Build an ETag from the current versions of ``scopes`` plus any
+    ``extra`` values the response depends on (e.g. the current day).
+    """
+    scopes = sorted(set(scopes))
+    versions = dict(conn.execute(
+        'SELECT scope, version FROM data_versions '
+        'WHERE scope IN ({})'.format(', '.join('?' * len(scopes))),
+        scopes
+    ).fetchall())
+
+    parts = ['{}.{}'.format(scope, versions.get(scope, 0)) for scope in scopes]
+    parts.extend(str(value) for value in extra)
+
+    return '-'.join(parts)
+
+
+def not_modified(etag):
+    """Return a 304 response if the request's If-None-Match matches
+    ``etag``, otherwise None.
+    """
+    if request.if_none_match.contains(etag):
+        return '', 304, {'ETag': quote_etag(etag)}
+
+    return None
+
+
+def etag_header(etag):
+    return {'ETag': quote_etag(etag)}
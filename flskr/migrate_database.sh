@@ -0,0 +1,5 @@
+#!/bin/bash
+
+export FLASK_APP=in_database
+export FLASK_ENV=development
+flask migrate
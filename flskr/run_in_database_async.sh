@@ -0,0 +1,4 @@
+#!/bin/bash
+
+export FLASK_ENV=development
+uvicorn --factory in_database.asgi:create_asgi_app
@@ -3,7 +3,7 @@ import tempfile
 
 import pytest 
 
-from in_database.db import get_db, init_db
+from in_database.db import close_pool, get_db, init_db
 from in_database import create_app
 
 # read in SQL for populating test data
@@ -30,6 +30,7 @@ def app():
     yield app
 
     # close and remove the temporary database
+    close_pool(app)
     os.close(db_fd)
     os.unlink(db_path)
 
@@ -38,3 +39,9 @@ def app():
 def client(app):
     """A test client for the app."""
     return app.test_client()
+
+
+@pytest.fixture
+def runner(app):
+    """A test runner for the app's Click commands."""
+    return app.test_cli_runner()
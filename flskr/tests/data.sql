@@ -15,9 +15,9 @@ INSERT INTO doctor_locations(id, doctor_id, location_id) VALUES (1, 0, 1);
 INSERT INTO doctor_locations(id, doctor_id, location_id) VALUES (2, 1, 1);
 
 DELETE FROM appointments;
-INSERT INTO appointments(id, doctor_id, location_id, apmnt_time, is_canceled) VALUES (0,0,0,12,0);
-INSERT INTO appointments(id, doctor_id, location_id, apmnt_time, is_canceled) VALUES (1,1,1,1558655106,0);
+INSERT INTO appointments(id, day_stamp, doctor_id, location_id, apmnt_time, is_canceled) VALUES (0,0,0,0,12,0);
+INSERT INTO appointments(id, day_stamp, doctor_id, location_id, apmnt_time, is_canceled) VALUES (1,1558569600,1,1,1558655106,0);
 
 DELETE FROM doctor_hours;
-INSERT INTO doctor_hours(id, doctor_id, shift_start, shift_end) VALUES (0,0,1560277403,1560320004);
-INSERT INTO doctor_hours(id, doctor_id, shift_start, shift_end) VALUES (1,1,1557100801,1557104801);
\ No newline at end of file
+INSERT INTO doctor_hours(id, day_stamp, doctor_id, shift_start, shift_end) VALUES (0,1560225600,0,1560277403,1560320004);
+INSERT INTO doctor_hours(id, day_stamp, doctor_id, shift_start, shift_end) VALUES (1,1557014400,1,1557100801,1557104801);
\ No newline at end of file
@@ -1,6 +1,8 @@
 import time
 import json
 
+from in_database.db import get_db
+
 def test_get_all_doctor_appointments(client):
     # Test getting all doctor appointment by doctor ID
     rv = client.get('/doctors/appointment/0')
@@ -12,6 +14,30 @@ def test_get_all_doctor_appointments(client):
     for field in ['address', 'apmnt_time', 'first_name', 'last_name']:
         assert field in data[0]
 
+
+def test_doctor_appointments_pagination(app, client):
+    # Keyset pagination on (apmnt_time, id), including ties on apmnt_time
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO appointments (day_stamp, doctor_id, location_id, apmnt_time, is_canceled) '
+            'VALUES (0, 1, 1, ?, 0)',
+            [(t, ) for t in (1558656106, 1558656106, 1558658106, 1558600000, 1558659106)]
+        )
+        db.commit()
+
+    seen = []
+    url = '/doctors/appointment/1?limit=3'
+    while url:
+        rv = client.get(url)
+        assert rv.status_code == 200
+        seen.extend(row['apmnt_time'] for row in json.loads(rv.data))
+        cursor = rv.headers.get('X-Next-Cursor')
+        url = cursor and '/doctors/appointment/1?limit=3&after=' + cursor
+
+    assert seen == sorted(seen)
+    assert len(seen) == 6
+
 def test_add_work_hours(client):
     # Test adding doctor work hours, successfully
 
@@ -0,0 +1,52 @@
+import asyncio
+import json
+
+from in_database.asgi import WSGIBridge
+
+
+def call(bridge, method, path, body=b'', query_string=b'', headers=()):
+    # Drive the ASGI app the way a server would and collect what it sends
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': method,
+        'path': path,
+        'query_string': query_string,
+        'headers': [(b'host', b'localhost')] + list(headers),
+    }
+    asyncio.run(bridge(scope, receive, send))
+
+    return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+
+def test_asgi_get(app):
+    bridge = WSGIBridge(app, max_workers=2)
+
+    status, headers, body = call(bridge, 'GET', '/doctors', query_string=b'limit=1')
+    assert status == 200
+    assert headers[b'content-type'] == b'application/json'
+    assert [d['id'] for d in json.loads(body)] == [0]
+    assert b'x-next-cursor' in headers
+
+
+def test_asgi_post(app):
+    bridge = WSGIBridge(app, max_workers=2)
+
+    status, headers, body = call(
+        bridge, 'POST', '/doctors',
+        body=json.dumps(dict(first_name='Elmer', last_name='Hartman')).encode('utf8'),
+        headers=[(b'content-type', b'application/json')])
+    assert status == 200
+    assert 'id' in json.loads(body)
+
+    status, headers, body = call(bridge, 'GET', '/doctors/404')
+    assert status == 404
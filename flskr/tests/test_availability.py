@@ -0,0 +1,135 @@
+import json
+
+import pytest
+
+from in_database import availability
+
+
+def test_free_slots_python():
+    # Slots start every 15 minutes from the shift start and skip
+    # anything within 899 seconds of an appointment
+    shifts = [(0, 3600), (1800, 5400)]
+    times = [1000]
+
+    slots = availability._free_slots_python(shifts, times, 0, 10000)
+    assert slots == [0, 2700, 3600, 4500]
+
+    # The range is inclusive and clips the shifts
+    assert availability._free_slots_python(shifts, times, 2000, 3600) == [2700, 3600]
+
+
+def test_free_slots_backends_agree():
+    pytest.importorskip('numpy')
+
+    shifts = [(0, 36000), (40000, 50000), (100, 200)]
+    times = [500, 3600, 3700, 44000]
+    for start, end in ((0, 60000), (1234, 45678), (50000, 60000)):
+        assert availability._free_slots_numpy(shifts, times, start, end) == \
+            availability._free_slots_python(shifts, times, start, end)
+
+
+def test_doctor_free_slots(client):
+    # Doctor 0 works 1560277403 - 1560320004 with no appointments then
+    rv = client.get('/doctors/0/free_slots?start=1560277403&end=1560281003')
+    assert rv.status_code == 200
+
+    data = json.loads(rv.data)
+    assert data['slots'] == [1560277403, 1560278303, 1560279203, 1560280103, 1560281003]
+
+    client.post('/doctors/make_appointment/',
+        data=json.dumps(dict(doctor_id='0', location_id='0', apmnt_time='1560278303')),
+        content_type='application/json')
+
+    data = json.loads(client.get('/doctors/0/free_slots?start=1560277403&end=1560281003').data)
+    # exactly 15 minutes either side is still bookable
+    assert data['slots'] == [1560277403, 1560279203, 1560280103, 1560281003]
+
+    # Cancelling frees the slot again
+    client.post('/doctors/appointment/cancel',
+        data=json.dumps(dict(appointment_id=4)),
+        content_type='application/json')
+
+    data = json.loads(client.get('/doctors/0/free_slots?start=1560277403&end=1560281003').data)
+    assert data['slots'] == [1560277403, 1560278303, 1560279203, 1560280103, 1560281003]
+
+
+def test_location_free_slots(client):
+    rv = client.get('/locations/1/free_slots?start=1557100801&end=1557104801')
+    assert rv.status_code == 200
+
+    data = json.loads(rv.data)
+    assert [d['doctor_id'] for d in data] == [0, 1]
+    assert data[0]['slots'] == []
+    assert data[1]['slots'] == [1557100801, 1557101701, 1557102601, 1557103501, 1557104401]
+
+
+def test_free_slots_range_limit(client):
+    rv = client.get('/doctors/0/free_slots?start=0&end=99999999')
+    assert rv.status_code == 400
+
+
+def test_iter_free_slots_matches_free_slots():
+    shifts = [(0, 36000), (40000, 50000), (100, 200)]
+    times = [500, 3600, 3700, 44000]
+    for start, end in ((0, 60000), (1234, 45678)):
+        assert list(availability.iter_free_slots(shifts, times, start, end)) == \
+            availability._free_slots_python(shifts, times, start, end)
+
+
+def test_first_available_merges_doctors(app, client):
+    # Both doctors at location 1 get overlapping shifts; the earliest
+    # slots interleave and stop at n
+    from in_database.db import get_db
+    with app.app_context():
+        db = get_db()
+        db.execute('INSERT INTO doctor_hours (day_stamp, doctor_id, shift_start, shift_end) '
+                   'VALUES (0, 0, 1557100000, 1557110000)')
+        db.commit()
+
+    rv = client.get('/locations/1/first_available?start=1557100000&end=1557200000&n=4')
+    assert rv.status_code == 200
+
+    data = json.loads(rv.data)
+    assert [(d['apmnt_time'], d['doctor_id']) for d in data] == [
+        (1557100000, 0), (1557100801, 1), (1557100900, 0), (1557101701, 1)]
+
+    rv = client.get('/locations/1/first_available?n=0')
+    assert rv.status_code == 400
+
+
+def test_first_available_loads_growing_windows(app, monkeypatch):
+    # One shift a day for doctor 0; each window only loads its own days
+    from in_database.db import get_db
+    day = 86400
+    windows = []
+    load_schedules = availability.load_schedules
+
+    def spy(conn, doctor_ids, start, end):
+        windows.append((start, end))
+        return load_schedules(conn, doctor_ids, start, end)
+
+    monkeypatch.setattr(availability, 'load_schedules', spy)
+
+    with app.app_context():
+        db = get_db()
+        db.execute('DELETE FROM doctor_hours')
+        for i in range(10):
+            db.execute('INSERT INTO doctor_hours (day_stamp, doctor_id, shift_start, shift_end) '
+                       'VALUES (?, 0, ?, ?)', (i * day, i * day + 3600, i * day + 5400))
+        db.commit()
+
+        # Day one has enough slots
+        assert availability.first_available(db, [0, 1], 0, 10 * day, 2) == [(3600, 0), (4500, 0)]
+        assert windows == [(0, day - 1)]
+
+        # Five slots take days one to three, in windows of one and two days
+        del windows[:]
+        slots = availability.first_available(db, [0, 1], 0, 10 * day, 5)
+        assert [slot for slot, doctor_id in slots] == [3600, 4500, day + 3600, day + 4500,
+                                                       2 * day + 3600]
+        assert windows == [(0, day - 1), (day, 3 * day - 1)]
+
+        # Too few slots in the whole range stops at its end
+        del windows[:]
+        assert len(availability.first_available(db, [0], 0, 2 * day, 100)) == 4
+        assert windows == [(0, day - 1), (day, 2 * day)]
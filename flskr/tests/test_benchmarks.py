@@ -0,0 +1,77 @@
+from datetime import date
+
+from benchmarks import bench_routes, generate, stress_booking
+from in_database import create_app
+from in_database.db import close_pool, get_db
+
+
+def dump(app):
+    with app.app_context():
+        return get_db().execute(
+            'SELECT doctor_id, location_id, apmnt_time, is_canceled FROM appointments '
+            'ORDER BY id').fetchall()
+
+
+def test_generator_is_deterministic(tmp_path):
+    # Same seed and start date, same rows
+    rows = []
+    for name in ('a.sqlite', 'b.sqlite'):
+        app = create_app({'TESTING': True, 'DATABASE': str(tmp_path / name)})
+        counts = generate.generate(app, doctors=3, locations=2, days=7, appointments=50,
+                                   seed=7, start_date=date(2019, 6, 12))
+        assert counts['appointments'] == 50
+        rows.append([tuple(row) for row in dump(app)])
+        close_pool(app)
+
+    assert rows[0] == rows[1]
+
+
+def test_bench_smoke(tmp_path):
+    app = create_app({'TESTING': True, 'DATABASE': str(tmp_path / 'bench.sqlite')})
+    generate.generate(app, doctors=3, locations=2, days=7, appointments=20)
+
+    results = bench_routes.bench(app, 3, doctors=3, locations=2)
+    assert set(results) >= {'get_doctor_sched', 'schedule_appointment'}
+    assert all(stats['errors'] == 0 for stats in results.values())
+    assert bench_routes.compare(results, results, 0.25) == []
+    close_pool(app)
+
+
+def test_stress_single_process(tmp_path):
+    # One process shares one scheduling index, so nothing may overlap
+    summary = stress_booking.stress(str(tmp_path / 'stress.sqlite'), processes=1, threads=4,
+                                    requests=10, slots=20)
+    assert summary['requests'] == 40
+    assert summary['accepted'] + summary['rejected'] + summary['locked'] == 40
+    assert summary['lock_wait_ms'] > 0
+    assert summary['accepted'] > 0
+    assert summary['double_bookings'] == []
+    assert summary['wrong_rejections'] == []
+
+
+def test_find_double_bookings(tmp_path):
+    database = str(tmp_path / 'stress.sqlite')
+    start = stress_booking.setup(database, doctors=1)
+    app = create_app({'TESTING': True, 'DATABASE': database})
+
+    with app.app_context():
+        db = get_db()
+        for apmnt_time, is_canceled in ((start, 0), (start + 600, 0), (start + 1200, 1)):
+            db.execute('INSERT INTO appointments (day_stamp, doctor_id, location_id, '
+                       'apmnt_time, is_canceled) VALUES (?, 1, 1, ?, ?)',
+                       (start, apmnt_time, is_canceled))
+        db.commit()
+
+        assert len(stress_booking.find_double_bookings(db)) == 1
+
+    close_pool(app)
+
+
+def test_stress_finds_no_wrong_rejections(tmp_path):
+    # Cancellations made by other processes must not leave a stale index
+    # turning free slots down
+    summary = stress_booking.stress(str(tmp_path / 'stress.sqlite'), processes=2, threads=2,
+                                    requests=5, slots=120, cancel_rate=0.5)
+    assert summary['cancelled'] > 0
+    assert summary['double_bookings'] == []
+    assert summary['wrong_rejections'] == []
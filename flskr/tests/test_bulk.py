@@ -0,0 +1,48 @@
+import json
+
+from in_database.db import get_db
+
+
+def test_import_csv(app, runner, tmp_path):
+    # Rows are loaded in chunks and the table's indexes are rebuilt
+    path = tmp_path / 'appointments.csv'
+    path.write_text(
+        'doctor_id,location_id,apmnt_time\n' +
+        ''.join('1,1,{}\n'.format(1560000000 + i * 900) for i in range(25))
+    )
+
+    result = runner.invoke(args=['import', 'appointments', str(path), '--chunk-size', '10'])
+    assert 'Imported 25 appointments.' in result.output
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute(
+            'SELECT COUNT(*) FROM appointments WHERE doctor_id = 1'
+        ).fetchone()[0] == 26
+        assert db.execute(
+            'SELECT COUNT(*) FROM appointments WHERE day_stamp IS NULL OR is_canceled IS NULL'
+        ).fetchone()[0] == 0
+        assert db.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE name = 'idx_appointments_doctor_time'"
+        ).fetchone()[0] == 1
+
+
+def test_import_ndjson(app, runner, tmp_path):
+    path = tmp_path / 'doctors.ndjson'
+    path.write_text('\n'.join(json.dumps(dict(first_name='Doc', last_name=str(i)))
+                              for i in range(3)))
+
+    result = runner.invoke(args=['import', 'doctors', str(path)])
+    assert 'Imported 3 doctors.' in result.output
+
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM doctors').fetchone()[0] == 5
+
+
+def test_import_missing_field(runner, tmp_path):
+    path = tmp_path / 'locations.csv'
+    path.write_text('id,address\n5,\n')
+
+    result = runner.invoke(args=['import', 'locations', str(path)])
+    assert result.exit_code != 0
+    assert 'missing address' in result.output
@@ -0,0 +1,67 @@
+import json
+
+from in_database.cache import MISSING, LRUCache
+
+
+def test_lru_eviction_and_tags():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1, ('x', ))
+    cache.set('b', 2, ('y', ))
+    assert cache.get('a') == 1
+    cache.set('c', 3, ('x', ))
+
+    # b was least recently used
+    assert cache.get('b') is MISSING
+    cache.invalidate('x')
+    assert cache.get('a') is MISSING
+    assert cache.get('c') is MISSING
+    assert cache.stats()['evictions'] == 1
+
+
+def test_stale_load_not_cached():
+    # A value read before an invalidation of its tag must not be stored
+    cache = LRUCache()
+
+    def load():
+        cache.invalidate('x')
+        return 'stale'
+
+    assert cache.get_or_load('a', ('x', ), load) == 'stale'
+    assert cache.get('a') is MISSING
+
+
+def test_doctor_reads_are_cached_and_invalidated(client):
+    client.get('/doctors/0')
+    client.get('/doctors/0')
+    stats = json.loads(client.get('/stats/cache').data)
+    assert stats['hits'] == 1
+
+    client.post('/doctors/update',
+        data=json.dumps(dict(doctor_id='0', first_name='Buggs', last_name='Bunny')),
+        content_type='application/json')
+
+    data = json.loads(client.get('/doctors/0').data)
+    assert data['first_name'] == 'Buggs'
+    data = json.loads(client.get('/doctors').data)
+    assert data[0]['first_name'] == 'Buggs'
+
+
+def test_doctor_locations_invalidated_on_assign(client):
+    assert len(json.loads(client.get('/doctors/1/locations').data)) == 1
+
+    client.post('/doctors/locations/assign',
+        data=json.dumps(dict(location_id='0', doctor_id='1')),
+        content_type='application/json')
+
+    assert len(json.loads(client.get('/doctors/1/locations').data)) == 2
+
+
+def test_new_doctor_not_served_from_negative_cache(client):
+    assert client.get('/doctors/2').status_code == 404
+
+    rv = client.post('/doctors',
+        data=json.dumps(dict(first_name='Elmer', last_name='Hartman')),
+        content_type='application/json')
+    doctor_id = json.loads(rv.data)['id']
+
+    assert client.get('/doctors/{}'.format(doctor_id)).status_code == 200
@@ -0,0 +1,238 @@
+import json
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from in_database.db import (
+    GroupCommitWriter, full_scans, get_db, get_pool, get_slow_log, parameter_shape, run_write
+)
+
+
+def test_connection_reused_across_requests(app):
+    # The same pooled connection should come back on the next app context
+    with app.app_context():
+        db = get_db()
+        assert db is get_db()
+
+    with app.app_context():
+        assert get_db() is db
+
+    stats = get_pool(app).stats()
+    assert stats['created'] == 1
+    assert stats['in_use'] == 0
+
+
+def test_pool_pragmas(app):
+    # Pooled connections are tuned from app.config
+    with app.app_context():
+        db = get_db()
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+        assert db.execute('PRAGMA cache_size').fetchone()[0] == -16000
+
+
+def test_pool_stats(client):
+    # Checkouts are counted and reported per worker
+    client.get('/doctors/appointment/0')
+    client.get('/doctors/appointment/0')
+
+    rv = client.get('/stats/pool')
+    assert rv.status_code == 200
+
+    # GET requests check out of the read-only pool
+    data = json.loads(rv.data)
+    assert data['size'] == 8
+    assert data['readonly']['checkouts'] >= 2
+    assert data['readonly']['in_use'] == 0
+    assert data['in_use'] == 0
+
+
+def test_pool_counts_write_lock_wait(app):
+    # Another connection holds the write lock for 50ms
+    other = sqlite3.connect(app.config['DATABASE'], check_same_thread=False)
+    other.execute('BEGIN IMMEDIATE')
+    threading.Timer(0.05, other.commit).start()
+
+    with app.app_context():
+        run_write(lambda conn: conn.execute('UPDATE doctors SET last_name = last_name'))
+
+    stats = get_pool(app).stats()
+    assert stats['write_locks'] == 1
+    assert stats['write_lock_wait_ms'] >= 40
+    other.close()
+
+
+def test_pool_close_skips_optimize_when_locked(app, caplog):
+    # An indexed query leaves doctor_hours for PRAGMA optimize to analyze
+    with app.app_context():
+        get_db(readonly=False).execute(
+            'SELECT shift_start FROM doctor_hours WHERE doctor_id = 1 AND shift_start > 0'
+        ).fetchall()
+
+    other = sqlite3.connect(app.config['DATABASE'])
+    other.execute('BEGIN IMMEDIATE')
+
+    started = time.perf_counter()
+    get_pool(app).close()
+    assert time.perf_counter() - started < 1
+    assert not [record for record in caplog.records if record.levelname == 'WARNING']
+    other.close()
+
+
+def test_group_commit_isolates_failed_jobs(tmp_path):
+    database = str(tmp_path / 'writer.sqlite')
+    conn = sqlite3.connect(database)
+    conn.execute('CREATE TABLE t (x INTEGER UNIQUE)')
+    conn.commit()
+
+    writer = GroupCommitWriter(lambda: sqlite3.connect(database, check_same_thread=False),
+                               window=0.2)
+    barrier = threading.Barrier(3)
+    outcomes = {}
+
+    def submit(name, x):
+        barrier.wait()
+        try:
+            outcomes[name] = writer.submit(
+                lambda c: c.execute('INSERT INTO t (x) VALUES (?)', (x, )).lastrowid)
+        except sqlite3.IntegrityError as e:
+            outcomes[name] = e
+
+    # The two inserts of 1 share a commit; only the second one fails
+    threads = [threading.Thread(target=submit, args=(name, x))
+               for name, x in (('a', 1), ('b', 1), ('c', 2))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.close()
+
+    assert sorted(type(outcome).__name__ for outcome in outcomes.values()) == \
+        ['IntegrityError', 'int', 'int']
+    stats = writer.stats()
+    assert stats.pop('lock_wait_ms') >= 0
+    assert stats == {'jobs': 3, 'failed': 1, 'commits': 1}
+    assert conn.execute('SELECT x FROM t ORDER BY x').fetchall() == [(1, ), (2, )]
+    conn.close()
+
+
+def test_group_commit_writes(app, client):
+    app.config['DB_GROUP_COMMIT'] = True
+
+    rv = client.post('/doctors', json={'first_name': 'Group', 'last_name': 'Commit'})
+    assert rv.status_code == 200
+    doctor_id = json.loads(rv.data)['id']
+
+    rv = client.post('/doctors/make_appointment/',
+                     json={'doctor_id': 0, 'location_id': 0, 'apmnt_time': 1560298281})
+    assert isinstance(json.loads(rv.data)['Appointment ID: '], int)
+
+    # Committed and visible to the request connections
+    rv = client.get('/doctors/{}'.format(doctor_id))
+    assert json.loads(rv.data)['last_name'] == 'Commit'
+    assert len(json.loads(client.get('/doctors/appointment/0').data)) == 2
+
+    data = json.loads(client.get('/stats/pool').data)
+    assert data['group_commit']['jobs'] == 2
+    assert data['group_commit']['failed'] == 0
+
+
+def test_full_scans():
+    assert full_scans(['SCAN doctors', 'SCAN TABLE appointments',
+                       'SCAN appointments USING COVERING INDEX idx_appointments_doctor_time',
+                       'SEARCH doctors USING INTEGER PRIMARY KEY (rowid=?)',
+                       'SCAN CONSTANT ROW']) == ['doctors', 'appointments']
+    assert full_scans(None) == []
+
+
+def test_parameter_shape():
+    assert parameter_shape((1, 'a', None)) == '(int, str, NoneType)'
+    assert parameter_shape({'b': 1.5, 'a': 1}) == '{a: int, b: float}'
+    assert parameter_shape([(1, 2)], many=True) == 'many x (int, int)'
+    assert parameter_shape(iter([]), many=True) == 'many'
+
+
+def test_slow_query_log(app, client, caplog):
+    # Log everything; the plan is captured once per SQL text
+    with app.app_context():
+        get_slow_log().threshold = 0
+
+    client.get('/doctors/0')
+    client.post('/doctors/update', json={'doctor_id': 0, 'first_name': 'A', 'last_name': 'B'})
+    client.post('/doctors/update', json={'doctor_id': 0, 'first_name': 'C', 'last_name': 'D'})
+
+    rv = client.get('/stats/slow_queries')
+    assert rv.status_code == 200
+
+    entries = {entry['sql']: entry for entry in json.loads(rv.data)}
+    update = entries['UPDATE doctors SET first_name = ?, last_name = ? WHERE id == ?']
+    assert update['count'] == 2
+    assert update['parameters'] == '(str, str, int)'
+    assert update['routes'] == {'doc_update': 2}
+    assert update['plan'] and not update['needs_index']
+
+    scans = [entry for entry in entries.values() if entry['needs_index']]
+    assert all(entry['scans'] for entry in scans)
+    assert any('Slow query' in record.getMessage() for record in caplog.records)
+
+
+def test_slow_query_log_flags_scans(app):
+    with app.app_context():
+        get_slow_log().threshold = 0
+        get_db().execute('SELECT * FROM doctors WHERE last_name = ?', ('Smith', )).fetchall()
+
+        entry = get_slow_log().report()[0]
+        assert entry['sql'] == 'SELECT * FROM doctors WHERE last_name = ?'
+        assert entry['scans'] == ['doctors']
+        assert entry['needs_index']
+
+
+def test_readonly_connections_for_reads(app):
+    with app.test_request_context('/doctors', method='GET'):
+        db = get_db()
+        assert db is get_db(readonly=True)
+        assert db.execute('PRAGMA query_only').fetchone()[0] == 1
+        assert db.execute('SELECT COUNT(*) FROM doctors').fetchone()[0] > 0
+
+        with pytest.raises(sqlite3.OperationalError):
+            db.execute("INSERT INTO locations (address) VALUES ('x')")
+
+        # Handlers that must write ask for the read-write connection
+        assert get_db(readonly=False) is not db
+
+    with app.test_request_context('/doctors', method='POST'):
+        assert get_db() is get_db(readonly=False)
+
+    app.config['DB_READONLY_GETS'] = False
+    with app.test_request_context('/doctors', method='GET'):
+        assert get_db() is get_db(readonly=False)
+
+
+def test_weekly_schedule_builds_on_write_connection(client):
+    # The first read materializes the week, which needs to write
+    rv = client.get('/doctors/weekly_schedule/0')
+    assert rv.status_code == 200
+
+
+def test_slow_query_log_counts_fetch_time(app):
+    # Each row takes 10ms to produce; only the first is stepped by execute
+    with app.app_context():
+        db = get_db()
+        db.create_function('nap', 1, lambda value: time.sleep(0.01) or value)
+        get_slow_log().threshold = 0.005
+
+        sql = 'SELECT nap(value) FROM (SELECT 1 AS value UNION ALL SELECT 2 UNION ALL SELECT 3)'
+        for _ in db.execute(sql):
+            pass
+        db.execute(sql).fetchall()
+        cursor = db.execute(sql)
+        cursor.fetchone()
+        cursor.fetchone()
+        cursor.close()
+
+        entry = [entry for entry in get_slow_log().report() if entry['sql'] == sql][0]
+        assert entry['count'] == 3
+        assert entry['max_ms'] >= 30
+        assert entry['total_ms'] >= 80
@@ -117,6 +117,17 @@ def test_invalid_doctor_update(client):
     #assert data['error_detail'] == "SyntaxError: invalid syntax"
 
 
+def test_unknown_doctor_update(client):
+    # Test updating a doctor that does not exist
+    rv = client.post('/doctors/update',
+        data=json.dumps(dict(doctor_id=99, first_name='Guy', last_name='Fuierri')),
+        content_type='application/json')
+    assert rv.status_code == 404
+
+    data = json.loads(rv.data)
+    assert data['error_detail'] == 'Doctor not found'
+
+
 def test_doctor_delete(client):
     # Test deleting an existing doctor, successfully
 
@@ -148,3 +159,44 @@ def test_invalid_doctor_delete(client):
 
     #data = json.loads(rv.data)
     #assert data['error_detail'] == "SyntaxError: invalid syntax"
+
+
+def test_doctors_pagination(client):
+    # Page through the doctors one at a time with the next-page cursor
+    rv = client.get('/doctors?limit=1')
+    assert rv.status_code == 200
+
+    data = json.loads(rv.data)
+    assert [d['id'] for d in data] == [0]
+    cursor = rv.headers['X-Next-Cursor']
+    assert 'rel="next"' in rv.headers['Link']
+
+    rv = client.get('/doctors?limit=1&after=' + cursor)
+    data = json.loads(rv.data)
+    assert [d['id'] for d in data] == [1]
+    assert 'X-Next-Cursor' not in rv.headers
+
+    rv = client.get('/doctors?after=not-a-cursor')
+    assert rv.status_code == 400
+
+
+def test_doctors_by_ids(app, client):
+    # One query, in the order asked for, unknown IDs left out
+    rv = client.get('/doctors?ids=1,5,0,1')
+    assert rv.status_code == 200
+    assert [d['id'] for d in json.loads(rv.data)] == [1, 0]
+
+    # A doctor created later fills in its ID
+    rv = client.post('/doctors', data=json.dumps(dict(first_name='Ann', last_name='Lee')),
+                     content_type='application/json')
+    new_id = json.loads(rv.data)['id']
+
+    rv = client.get('/doctors?ids={},0'.format(new_id))
+    assert [(d['id'], d['first_name']) for d in json.loads(rv.data)][0] == (new_id, 'Ann')
+    assert [d['id'] for d in json.loads(rv.data)] == [new_id, 0]
+
+    assert client.get('/doctors?ids=1,x').status_code == 400
+    assert client.get('/doctors?ids=').status_code == 400
+
+    app.config['BATCH_MAX_IDS'] = 2
+    assert client.get('/doctors?ids=0,1,2').status_code == 400
@@ -0,0 +1,95 @@
+import json
+import time
+
+from in_database.metrics import get_metrics
+from in_database.scheduling import get_day
+
+
+def add_hours(client):
+    """Give doctor 0 a shift tomorrow and doctor 1 a shift rule for every
+    day from today; returns tomorrow's midnight.
+    """
+    tomorrow = get_day(get_day(time.time()) + 86400 + 3600)
+
+    client.post('/doctor/hours/bulk', data=json.dumps(dict(shifts=[
+        dict(doctor_id=0, shift_start=tomorrow + 3600, shift_end=tomorrow + 7200)])),
+        content_type='application/json')
+    client.post('/doctor/hours/rules', data=json.dumps(dict(
+        doctor_id=1, weekdays=list(range(7)), start_time=3600, end_time=7200,
+        start_day=int(time.time()))),
+        content_type='application/json')
+
+    return tomorrow
+
+
+def test_include_locations_and_hours(client):
+    tomorrow = add_hours(client)
+
+    rv = client.get('/doctors?include=locations,hours')
+    assert rv.status_code == 200
+
+    doctors = json.loads(rv.data)
+    assert [d['id'] for d in doctors] == [0, 1]
+    assert all(set(d) == {'id', 'first_name', 'last_name', 'locations', 'hours'} for d in doctors)
+
+    assert doctors[0]['locations'] == json.loads(client.get('/doctors/0/locations').data)
+    assert doctors[0]['hours'] == [
+        {'day_stamp': tomorrow, 'shift_start': tomorrow + 3600, 'shift_end': tomorrow + 7200}]
+
+    # The rule expands into the days of the coming week, in order
+    starts = [hour['shift_start'] for hour in doctors[1]['hours']]
+    assert len(starts) >= 7 and starts == sorted(starts)
+    assert all(hour['shift_end'] - hour['shift_start'] == 3600 for hour in doctors[1]['hours'])
+
+
+def test_include_on_detail_and_ids(client):
+    add_hours(client)
+    listed = json.loads(client.get('/doctors?include=hours,locations').data)
+
+    rv = client.get('/doctors/1?include=locations,hours')
+    assert json.loads(rv.data) == listed[1]
+
+    rv = client.get('/doctors?ids=1,0&include=hours')
+    assert [d['hours'] for d in json.loads(rv.data)] == [listed[1]['hours'], listed[0]['hours']]
+    assert 'locations' not in json.loads(rv.data)[0]
+
+    # Without include the rows are unchanged
+    assert set(json.loads(client.get('/doctors/1').data)) == {'id', 'first_name', 'last_name'}
+
+
+def test_include_constant_queries(app, client):
+    def queries(url):
+        before = get_metrics(app).queries['list_doctors']
+        assert client.get(url).status_code == 200
+        return get_metrics(app).queries['list_doctors'] - before
+
+    # the first request also pays for opening the connection
+    queries('/doctors?limit=1&include=locations,hours')
+    client.post('/doctors', data=json.dumps(dict(first_name='Doc', last_name='Zero')),
+                content_type='application/json')
+    few = queries('/doctors?limit=1&include=locations,hours')
+
+    for i in range(20):
+        client.post('/doctors', data=json.dumps(dict(first_name='Doc', last_name=str(i))),
+                    content_type='application/json')
+
+    assert queries('/doctors?include=locations,hours') == few
+
+
+def test_include_etag(client):
+    rv = client.get('/doctors/0?include=locations')
+    etag = rv.headers['ETag']
+    assert client.get('/doctors/0?include=locations',
+                      headers={'If-None-Match': etag}).status_code == 304
+
+    # A new shift changes the embedded hours, so the ETag must change too
+    add_hours(client)
+    rv = client.get('/doctors?include=hours', headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+    assert client.get('/doctors/0?include=hours',
+                      headers={'If-None-Match': rv.headers['ETag']}).status_code == 200
+
+
+def test_include_unknown(client):
+    assert client.get('/doctors?include=appointments').status_code == 400
+    assert client.get('/doctors/0?include=locations,nope').status_code == 400
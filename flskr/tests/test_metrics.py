@@ -0,0 +1,71 @@
+from in_database import create_app
+from in_database.db import close_pool, get_db
+from in_database.metrics import Histogram
+
+
+def test_histogram_buckets():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+
+    assert list(histogram.cumulative()) == [(0.1, 2), (1.0, 3), (float('inf'), 4)]
+    assert histogram.sum == 3.65
+
+
+def test_metrics_endpoint(client):
+    client.get('/doctors/0')
+    client.get('/doctors/0/locations')
+    client.get('/doctors/0/locations')
+    client.post('/doctors', json={})
+
+    rv = client.get('/metrics')
+    assert rv.status_code == 200
+    assert rv.mimetype == 'text/plain'
+
+    lines = rv.get_data(as_text=True).splitlines()
+    assert 'in_database_requests_total{route="list_doctor_locations"} 2' in lines
+    assert 'in_database_request_errors_total{route="add_doctor"} 1' in lines
+    assert 'in_database_request_duration_seconds_count{route="list_doctor"} 1' in lines
+    assert any(line.startswith('in_database_request_duration_seconds_bucket'
+                               '{route="list_doctor",le="+Inf"} 1') for line in lines)
+
+    # The second locations lookup is cached, so only one query ran for it
+    sql = dict(line.rsplit(' ', 1) for line in lines if not line.startswith('#'))
+    assert int(sql['in_database_sql_queries_total{route="list_doctor_locations"}']) == 1
+    assert int(sql['in_database_sql_rows_total{route="list_doctor_locations"}']) >= 1
+    assert float(sql['in_database_sql_seconds_total{route="list_doctor"}']) > 0
+
+
+def test_metrics_disabled(app):
+    other = create_app({'TESTING': True, 'DATABASE': app.config['DATABASE'],
+                        'METRICS_ENABLED': False, 'DB_SLOW_QUERY_MS': None})
+    with other.app_context():
+        assert type(get_db()).__name__ == 'Connection'
+    close_pool(other)
+
+
+def test_iterated_rows_reported_once(app, monkeypatch):
+    calls = []
+
+    with app.app_context():
+        db = get_db()
+        observe_sql = db.metrics.observe_sql
+        monkeypatch.setattr(db.metrics, 'observe_sql',
+                            lambda *args: calls.append(args) or observe_sql(*args))
+        before = db.metrics.rows['none']
+
+        sql = 'WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 100) ' \
+              'SELECT x FROM n'
+        assert sum(1 for _ in db.execute(sql)) == 100
+
+        # one call for the execute, one for the rows once they run out
+        assert len(calls) == 2
+        assert db.metrics.rows['none'] - before == 100
+
+        # an iteration cut short is reported by the next statement
+        cursor = db.cursor()
+        for x, in cursor.execute(sql):
+            if x == 10:
+                break
+        cursor.execute('SELECT 1')
+        assert db.metrics.rows['none'] - before == 110
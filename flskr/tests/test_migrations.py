@@ -0,0 +1,64 @@
+from in_database.db import get_db, get_schema_version, list_migrations, migrate_db
+
+
+def test_init_db_applies_migrations(app):
+    # A fresh database should already be at the latest schema version
+    with app.app_context():
+        latest = list_migrations()[-1][0]
+        assert get_schema_version(get_db()) == latest
+
+        indexes = [row[0] for row in get_db().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        ).fetchall()]
+        assert 'idx_appointments_doctor_time' in indexes
+        assert 'idx_doctor_locations_doctor_location' in indexes
+
+
+def test_migrate_keeps_data(app, runner):
+    # Re-running migrations from scratch must not drop any rows
+    with app.app_context():
+        db = get_db()
+        db.execute('DELETE FROM schema_version')
+        db.execute('DROP INDEX idx_appointments_doctor_time')
+        db.commit()
+
+    result = runner.invoke(args=['migrate'])
+    assert 'Applied migration 0001' in result.output
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute('SELECT COUNT(*) FROM doctors').fetchone()[0] == 2
+        assert db.execute('SELECT COUNT(*) FROM appointments').fetchone()[0] == 2
+        assert migrate_db() == []
+
+        plan = db.execute(
+            'EXPLAIN QUERY PLAN SELECT id FROM appointments '
+            'WHERE doctor_id == ? AND apmnt_time BETWEEN ? AND ?',
+            (0, 0, 100)
+        ).fetchall()
+        assert 'idx_appointments_doctor_time' in ' '.join(row[3] for row in plan)
+
+
+def test_active_appointment_queries_use_partial_index(app):
+    with app.app_context():
+        plan = get_db().execute(
+            'EXPLAIN QUERY PLAN SELECT 1 FROM appointments '
+            'WHERE doctor_id = ? AND apmnt_time BETWEEN ? AND ? AND is_canceled = 0',
+            (0, 0, 100)
+        ).fetchall()
+        assert 'idx_appointments_active_doctor_time' in ' '.join(row[3] for row in plan)
+
+
+def test_no_sample_statistics(app):
+    # Statistics gathered over the sample rows would outlive them and
+    # steer the planner away from the indexes once real data arrives
+    with app.app_context():
+        db = get_db()
+        assert db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None
+
+        plan = db.execute(
+            'EXPLAIN QUERY PLAN SELECT shift_start, shift_end FROM doctor_hours '
+            'WHERE doctor_id = ?', (0, )
+        ).fetchall()
+        assert 'SCAN doctor_hours' not in ' '.join(row[3] for row in plan)
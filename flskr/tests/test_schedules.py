@@ -0,0 +1,88 @@
+import json
+import time
+
+from in_database import schedules
+from in_database.db import get_db
+from in_database.scheduling import get_day
+
+
+def add_shift_today(app, doctor_id):
+    # Give the doctor a shift today so there is something to book into
+    today = get_day(time.time())
+
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            'INSERT INTO doctor_hours (day_stamp, doctor_id, shift_start, shift_end) '
+            'VALUES (?, ?, ?, ?)',
+            (today, doctor_id, today + 1, today + 86399)
+        )
+        db.commit()
+
+    return today
+
+
+def test_weekly_schedule_materialized(app, client):
+    today = add_shift_today(app, 1)
+
+    rv = client.get('/doctors/weekly_schedule/1')
+    assert rv.status_code == 200
+    data = json.loads(rv.data)
+    assert len(data) == 1
+    assert data[0]['shift_start'] == today + 1
+
+    with app.app_context():
+        count = get_db().execute(
+            'SELECT COUNT(*) FROM schedule_days WHERE doctor_id = 1').fetchone()[0]
+        assert count == 8
+
+    # Booking updates the materialized day in place
+    for apmnt_time in (today + 3600, today + 7200):
+        rv = client.post('/doctors/make_appointment/',
+            data=json.dumps(dict(doctor_id=1, location_id=1, apmnt_time=apmnt_time)),
+            content_type='application/json')
+
+    data = json.loads(client.get('/doctors/weekly_schedule/1').data)
+    assert len(data) == 3
+    assert data[1]['apmnt_time'] == today + 3600
+    assert data[1]['address'] == '2 University Ave'
+
+    # and so does cancelling, which takes the appointment off the schedule
+    client.post('/doctors/appointment/cancel',
+        data=json.dumps(dict(appointment_id=json.loads(rv.data)['Appointment ID: '])),
+        content_type='application/json')
+
+    data = json.loads(client.get('/doctors/weekly_schedule/1').data)
+    assert len(data) == 2
+
+    # A rename drops the doctor's rows; the next read rebuilds them
+    client.post('/doctors/update',
+        data=json.dumps(dict(doctor_id=1, first_name='Nick', last_name='Riviera')),
+        content_type='application/json')
+
+    data = json.loads(client.get('/doctors/weekly_schedule/1').data)
+    assert [row['first_name'] for row in data] == ['Nick', 'Nick']
+
+
+def test_week_days():
+    today = get_day(time.time())
+    days = schedules.week_days(today)
+    assert days[0] == today
+    assert len(days) == 8
+    assert abs(days[-1] - (today + schedules.ONE_WEEK)) <= 3600
+
+
+def test_past_days_pruned(app):
+    today = get_day(time.time())
+
+    with app.app_context():
+        db = get_db()
+        schedules.get_week(db, 0, today - 3 * 86400)
+        assert db.execute('SELECT COUNT(*) FROM schedule_days WHERE doctor_id = 0 '
+                          'AND day_stamp < ?', (today, )).fetchone()[0] == 3
+
+        # Once the week moves on, only its own days are kept
+        schedules.get_week(db, 0, today)
+        assert [row[0] for row in db.execute(
+            'SELECT day_stamp FROM schedule_days WHERE doctor_id = 0 ORDER BY day_stamp'
+        ).fetchall()] == schedules.week_days(today)
@@ -0,0 +1,346 @@
+import json
+import sqlite3
+import threading
+
+from in_database import create_app, versions
+from in_database.db import close_pool, get_db
+from in_database.scheduling import (
+    DoctorSchedule, ScheduleIndex, get_day, get_index, is_available
+)
+
+
+def test_doctor_schedule_conflicts():
+    # Appointments block +/- 899 seconds around them
+    schedule = DoctorSchedule([(0, 1000, 0), (1, 5000, 0)], [])
+    assert schedule.has_conflict(1899)
+    assert not schedule.has_conflict(1900)
+    assert schedule.has_conflict(101)
+    assert not schedule.has_conflict(3000)
+
+    schedule.add_appointment(2, 3000)
+    assert schedule.has_conflict(3000)
+
+
+def test_doctor_schedule_cancel_frees_slot():
+    # Cancelled appointments never block, whether loaded or cancelled later
+    schedule = DoctorSchedule([(0, 1000, 1), (1, 5000, 0), (2, 5000, 0)], [])
+    assert not schedule.has_conflict(1000)
+
+    schedule.cancel_appointment(1)
+    assert schedule.has_conflict(5000)
+    schedule.cancel_appointment(2)
+    schedule.cancel_appointment(2)
+    assert not schedule.has_conflict(5000)
+    assert schedule.times == []
+
+
+def test_doctor_schedule_shifts():
+    # Overlapping and out of order shifts are all honoured
+    schedule = DoctorSchedule([], [(500, 900), (100, 1000), (2000, 3000)])
+    assert schedule.in_shift(100)
+    assert schedule.in_shift(950)
+    assert not schedule.in_shift(1000)
+    assert not schedule.in_shift(1500)
+    assert not schedule.in_shift(50)
+
+    schedule.add_shift(1000, 2500)
+    assert schedule.in_shift(1500)
+
+
+def test_schedule_appointment_uses_index(client):
+    # Book inside doctor 0's shift, then try a conflicting time
+    rv = client.post('/doctors/make_appointment/',
+        data=json.dumps(dict(doctor_id='0', location_id='0', apmnt_time='1560298281')),
+        content_type='application/json')
+    assert rv.status_code == 200
+    assert isinstance(json.loads(rv.data)['Appointment ID: '], int)
+
+    rv = client.post('/doctors/make_appointment/',
+        data=json.dumps(dict(doctor_id='0', location_id='0', apmnt_time='1560298881')),
+        content_type='application/json')
+    assert rv.status_code == 200
+    assert json.loads(rv.data)['Appointment ID: '] == \
+        'Doctor Unavailable; please select a different time.'
+
+    # Outside of working hours
+    rv = client.post('/doctors/make_appointment/',
+        data=json.dumps(dict(doctor_id='0', location_id='0', apmnt_time='1560400000')),
+        content_type='application/json')
+    assert json.loads(rv.data)['Appointment ID: '] == \
+        'Doctor Unavailable; please select a different time.'
+
+
+def test_schedule_appointments_batch(client):
+    # Conflicts are checked against the database and within the batch
+    rv = client.post('/doctors/make_appointment/batch',
+        data=json.dumps(dict(appointments=[
+            dict(doctor_id='0', location_id='0', apmnt_time='1560298281'),
+            dict(doctor_id='0', location_id='0', apmnt_time='1560298581'),
+            dict(doctor_id='0', location_id='1', apmnt_time='1560300000'),
+            dict(doctor_id='0', location_id='1', apmnt_time='1560400000'),
+            dict(doctor_id='0'),
+        ])),
+        content_type='application/json')
+    assert rv.status_code == 200
+
+    data = json.loads(rv.data)
+    assert data['accepted'] == 2
+    assert [r['index'] for r in data['results']] == [0, 1, 2, 3, 4]
+    assert 'appointment_id' in data['results'][0]
+    assert 'error_detail' in data['results'][1]
+    assert 'appointment_id' in data['results'][2]
+    assert 'error_detail' in data['results'][3]
+    assert data['results'][4]['error_detail'] == 'Missing required field'
+
+    rv = client.get('/doctors/appointment/0')
+    assert len(json.loads(rv.data)) == 3
+
+
+def test_schedule_appointments_batch_limit(app, client):
+    app.config['BATCH_MAX_APPOINTMENTS'] = 1
+    rv = client.post('/doctors/make_appointment/batch',
+        data=json.dumps(dict(appointments=[{}, {}])),
+        content_type='application/json')
+    assert rv.status_code == 400
+
+
+def test_doctor_locks_are_striped():
+    index = ScheduleIndex(stripes=4)
+    assert index.doctor_lock(1) is index.doctor_lock(5)
+    assert index.doctor_lock(1) is not index.doctor_lock(2)
+
+    # Another doctor's stripe stays free while a batch holds its doctors
+    taken = []
+    with index.doctor_locks([3, 1, 7]):
+        thread = threading.Thread(target=lambda: taken.append(index.doctor_lock(2).acquire(False)))
+        thread.start()
+        thread.join()
+    assert taken == [True]
+
+
+def test_is_available(app):
+    with app.app_context():
+        db = get_db()
+        assert is_available(db, 0, 1560298281)
+        assert not is_available(db, 0, 1560400000)
+
+        db.execute('INSERT INTO appointments (day_stamp, doctor_id, location_id, apmnt_time, '
+                   'is_canceled) VALUES (0, 0, 0, 1560298281, 0)')
+        assert not is_available(db, 0, 1560298281 + 899)
+        assert is_available(db, 0, 1560298281 + 900)
+        db.rollback()
+
+
+def test_schedule_appointment_rechecks_database(app, client):
+    # Load doctor 0 into this process's index
+    client.post('/doctors/make_appointment/',
+        data=json.dumps(dict(doctor_id='0', location_id='0', apmnt_time='1560298281')),
+        content_type='application/json')
+
+    # Another worker process books 1560300281 behind the index's back
+    conn = sqlite3.connect(app.config['DATABASE'])
+    conn.execute('INSERT INTO appointments (day_stamp, doctor_id, location_id, apmnt_time, '
+                 'is_canceled) VALUES (0, 0, 0, 1560300281, 0)')
+    conn.commit()
+    conn.close()
+
+    rv = client.post('/doctors/make_appointment/',
+        data=json.dumps(dict(doctor_id='0', location_id='0', apmnt_time='1560300581')),
+        content_type='application/json')
+    assert json.loads(rv.data)['Appointment ID: '] == \
+        'Doctor Unavailable; please select a different time.'
+
+    # The stale schedule was dropped and now sees the other booking
+    with app.app_context():
+        assert get_index().get(get_db(), 0, 1560300581).has_conflict(1560300581)
+
+    rv = client.post('/doctors/make_appointment/batch',
+        data=json.dumps(dict(appointments=[
+            dict(doctor_id='0', location_id='0', apmnt_time='1560302281')])),
+        content_type='application/json')
+    assert json.loads(rv.data)['accepted'] == 1
+
+
+def test_cancelled_appointment_can_be_rebooked(app, client):
+    def book():
+        rv = client.post('/doctors/make_appointment/',
+            data=json.dumps(dict(doctor_id='0', location_id='0', apmnt_time='1560298281')),
+            content_type='application/json')
+        return json.loads(rv.data)['Appointment ID: ']
+
+    appointment_id = book()
+    assert book() == 'Doctor Unavailable; please select a different time.'
+
+    client.post('/doctors/appointment/cancel',
+        data=json.dumps(dict(appointment_id=appointment_id)),
+        content_type='application/json')
+
+    # Freed both in this process's index and in the database check
+    assert isinstance(book(), int)
+    with app.app_context():
+        get_index().clear()
+        db = get_db()
+        db.execute('UPDATE appointments SET is_canceled = 1')
+        db.commit()
+    assert isinstance(book(), int)
+
+
+def test_index_sees_other_processes_writes(app, client):
+    # A second app on the same database stands in for another worker
+    other_app = create_app({'TESTING': True, 'DATABASE': app.config['DATABASE']})
+    other = other_app.test_client()
+    unavailable = 'Doctor Unavailable; please select a different time.'
+
+    def book(doctor_id, apmnt_time):
+        rv = client.post('/doctors/make_appointment/',
+            data=json.dumps(dict(doctor_id=doctor_id, location_id=0, apmnt_time=apmnt_time)),
+            content_type='application/json')
+        return json.loads(rv.data)['Appointment ID: ']
+
+    appointment_id = book(0, 1560298281)
+    assert book(0, 1560298281) == unavailable
+
+    # A cancellation made elsewhere frees the slot here too
+    other.post('/doctors/appointment/cancel',
+        data=json.dumps(dict(appointment_id=appointment_id)),
+        content_type='application/json')
+    assert isinstance(book(0, 1560298281), int)
+
+    # So do hours added elsewhere
+    assert book(0, 1562000000) == unavailable
+    other.post('/doctor/hours/set',
+        data=json.dumps(dict(doctor_id=0, shift_start=1562000000, shift_end=1562003600)),
+        content_type='application/json')
+    assert isinstance(book(0, 1562000000), int)
+
+    close_pool(other_app)
+
+
+def test_index_refresh_only_reloads_when_stale(app):
+    with app.app_context():
+        index = get_index()
+        schedule = index.get(get_db(), 0)
+        assert index.refresh(get_db(), 0) is schedule
+
+        versions.bump(get_db(), versions.doctor_scope(0))
+        get_db().commit()
+        assert index.refresh(get_db(), 0) is not schedule
+
+
+def test_index_evicts_least_recently_used(app):
+    with app.app_context():
+        index = ScheduleIndex(maxsize=2)
+        schedule = index.get(get_db(), 0)
+        index.get(get_db(), 1)
+        assert index.get(get_db(), 0) is schedule
+
+        # doctor 1 was used least recently, so it makes room for doctor 2
+        index.get(get_db(), 2)
+        assert len(index) == 2
+        assert index.get(get_db(), 0) is schedule
+        assert index._loaded(1) is None
+
+
+def test_index_loads_around_booking_time(app):
+    with app.app_context():
+        db = get_db()
+        for apmnt_time in (1560298281, 1560298281 + 10 * 86400):
+            db.execute('INSERT INTO appointments (day_stamp, doctor_id, location_id, '
+                       'apmnt_time, is_canceled) VALUES (?, 0, 0, ?, 0)',
+                       (get_day(apmnt_time), apmnt_time))
+        db.commit()
+
+        index = ScheduleIndex(horizon=86400)
+        schedule = index.get(db, 0, 1560298281)
+        assert schedule.has_conflict(1560298281) and schedule.in_shift(1560298281)
+        assert not schedule.covers(1560298281 + 10 * 86400)
+        assert len(schedule.times) == 1
+
+        # a booking outside the loaded range reloads around its own time
+        later = index.get(db, 0, 1560298281 + 10 * 86400)
+        assert later is not schedule
+        assert later.times == [1560298281 + 10 * 86400]
+        assert index.get(db, 0, 1560298281 + 10 * 86400 + 3600) is later
+
+
+def test_doctor_schedule_overlaps_shift():
+    schedule = DoctorSchedule([], [(100, 1000), (2000, 3000)])
+    assert schedule.overlaps_shift(900, 1100)
+    assert schedule.overlaps_shift(0, 5000)
+    assert not schedule.overlaps_shift(1000, 2000)
+    assert not schedule.overlaps_shift(0, 100)
+
+
+def post_shifts(client, shifts):
+    return client.post('/doctor/hours/bulk', data=json.dumps(dict(shifts=shifts)),
+                       content_type='application/json')
+
+
+def test_set_hours_bulk(app, client):
+    day = 1562000000
+    shifts = [dict(doctor_id=0, shift_start=day + i * 86400, shift_end=day + i * 86400 + 3600)
+              for i in range(5)]
+    shifts.append(dict(doctor_id=1, shift_start=day, shift_end=day + 3600))
+
+    rv = post_shifts(client, shifts)
+    assert rv.status_code == 200
+    ids = rv.get_json()['doctor_hours_ids']
+    assert len(ids) == 6
+
+    with app.app_context():
+        rows = get_db().execute(
+            'SELECT id, day_stamp, doctor_id, shift_start FROM doctor_hours WHERE id >= ? '
+            'ORDER BY id', (ids[0], )).fetchall()
+    assert [tuple(row) for row in rows] == [
+        (hours_id, get_day(shift['shift_start']), shift['doctor_id'], shift['shift_start'])
+        for hours_id, shift in zip(ids, shifts)]
+
+    # The new hours are bookable straight away
+    rv = client.post('/doctors/make_appointment/',
+        data=json.dumps(dict(doctor_id=0, location_id=0, apmnt_time=day + 4 * 86400)),
+        content_type='application/json')
+    assert isinstance(rv.get_json()['Appointment ID: '], int)
+
+
+def test_set_hours_bulk_overlaps(app, client):
+    # Within the request
+    rv = post_shifts(client, [dict(doctor_id=0, shift_start=100, shift_end=1000),
+                              dict(doctor_id=1, shift_start=100, shift_end=1000),
+                              dict(doctor_id=0, shift_start=900, shift_end=2000)])
+    assert rv.status_code == 400
+    assert rv.get_json()['conflicts'] == [2]
+
+    # With doctor 0's existing shift; nothing is entered
+    with app.app_context():
+        count = get_db().execute('SELECT COUNT(*) FROM doctor_hours').fetchone()[0]
+
+    rv = post_shifts(client, [dict(doctor_id=1, shift_start=100, shift_end=1000),
+                              dict(doctor_id=0, shift_start=1560277000, shift_end=1560278000)])
+    assert rv.status_code == 400
+    assert rv.get_json()['conflicts'] == [1]
+
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM doctor_hours').fetchone()[0] == count
+
+
+def test_set_hours_bulk_validate(app, client):
+    assert post_shifts(client, []).status_code == 400
+    assert post_shifts(client, [dict(doctor_id=0, shift_start=100)]).status_code == 400
+    assert post_shifts(client, [dict(doctor_id=0, shift_start=100, shift_end=100)]).status_code == 400
+
+    app.config['BULK_MAX_SHIFTS'] = 1
+    assert post_shifts(client, [dict(doctor_id=0, shift_start=100, shift_end=200),
+                                dict(doctor_id=0, shift_start=300, shift_end=400)]).status_code == 400
+
+
+def test_set_hours_sets_day_stamp(app, client):
+    rv = client.post('/doctor/hours/set',
+        data=json.dumps(dict(doctor_id=0, shift_start=1562000000, shift_end=1562003600)),
+        content_type='application/json')
+    assert rv.status_code == 200
+    hours_id = rv.get_json()['shift start / end ID: ']
+
+    with app.app_context():
+        row = get_db().execute('SELECT day_stamp FROM doctor_hours WHERE id = ?',
+                               (hours_id, )).fetchone()
+    assert row['day_stamp'] == get_day(1562000000)
@@ -0,0 +1,42 @@
+import json
+import sqlite3
+
+import pytest
+
+from in_database import serialize
+
+
+@pytest.fixture
+def rows():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    yield conn.execute("SELECT 1 AS id, 'Zoë' AS name UNION ALL SELECT 2, 'Ann'").fetchall()
+    conn.close()
+
+
+def test_to_dicts(rows):
+    assert serialize.to_dicts(rows) == [{'id': 1, 'name': 'Zoë'}, {'id': 2, 'name': 'Ann'}]
+    assert serialize.to_dicts([]) == []
+    assert serialize.to_dict(rows[1]) == {'id': 2, 'name': 'Ann'}
+    assert serialize.to_dict(None) is None
+
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_dumps(monkeypatch, rows, use_orjson):
+    # Both encoders give compact JSON with sorted keys
+    if not use_orjson:
+        monkeypatch.setattr(serialize, 'orjson', None)
+    elif serialize.orjson is None:
+        pytest.skip('orjson is not installed')
+
+    body = serialize.dumps([{'b': 1, 'a': [1, 2]}] + serialize.to_dicts(rows))
+    assert isinstance(body, bytes)
+    assert body.startswith(b'[{"a":[1,2],"b":1},{"id":1,')
+    assert json.loads(body)[1]['name'] == 'Zoë'
+
+
+def test_json_response(app):
+    with app.app_context():
+        rv = serialize.json_response({'id': 1})
+        assert rv.mimetype == 'application/json'
+        assert rv.get_data() == b'{"id":1}'
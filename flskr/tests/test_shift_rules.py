@@ -0,0 +1,180 @@
+import json
+from datetime import date
+
+from in_database import create_app, schedules, shift_rules
+from in_database.db import close_pool, get_db
+
+
+# 2030-01-07 is a Monday
+MONDAY = shift_rules.midnight(date(2030, 1, 7))
+DAY = 86400
+
+
+def make_rule(weekdays=(0, 2), start_time=9 * 3600, end_time=17 * 3600, end_day=None,
+              exceptions=()):
+    return shift_rules.ShiftRule(1, 1, shift_rules.weekday_mask(weekdays), start_time, end_time,
+                                 MONDAY, end_day, frozenset(exceptions))
+
+
+def test_expand():
+    rule = make_rule()
+
+    # Monday and Wednesday of the first week
+    assert shift_rules.expand([rule], MONDAY, MONDAY + 6 * DAY) == [
+        (MONDAY + 9 * 3600, MONDAY + 17 * 3600),
+        (MONDAY + 2 * DAY + 9 * 3600, MONDAY + 2 * DAY + 17 * 3600)]
+
+    # Nothing before the rule starts, nothing on days it is off
+    assert shift_rules.expand([rule], MONDAY - 7 * DAY, MONDAY - 1) == []
+    assert shift_rules.expand([rule], MONDAY + DAY, MONDAY + 2 * DAY - 1) == []
+
+    # A window starting mid shift still sees it
+    assert shift_rules.expand([rule], MONDAY + 12 * 3600, MONDAY + 13 * 3600) == [
+        (MONDAY + 9 * 3600, MONDAY + 17 * 3600)]
+
+
+def test_expand_end_day_and_exceptions():
+    rule = make_rule(weekdays=[0], end_day=MONDAY + 14 * DAY, exceptions=[MONDAY + 7 * DAY])
+
+    assert [start - 9 * 3600 for start, end in
+            shift_rules.expand([rule], MONDAY, MONDAY + 30 * DAY)] == [MONDAY, MONDAY + 14 * DAY]
+
+
+def test_covers():
+    rule = make_rule()
+
+    assert shift_rules.covers([rule], MONDAY + 9 * 3600)
+    assert shift_rules.covers([rule], MONDAY + 17 * 3600 - 1)
+    assert not shift_rules.covers([rule], MONDAY + 17 * 3600)
+    assert not shift_rules.covers([rule], MONDAY + DAY + 10 * 3600)
+    assert not shift_rules.covers([], MONDAY + 10 * 3600)
+
+
+def test_weekday_mask():
+    assert shift_rules.weekday_mask([0, 6]) == 0b1000001
+
+    try:
+        shift_rules.weekday_mask([7])
+    except ValueError:
+        pass
+    else:
+        assert False, 'weekday 7 accepted'
+
+
+def add_rule(client, **fields):
+    data = dict(doctor_id=1, weekdays=[0], start_time=9 * 3600, end_time=10 * 3600,
+                start_day=MONDAY)
+    data.update(fields)
+
+    return client.post('/doctor/hours/rules', data=json.dumps(data),
+                       content_type='application/json')
+
+
+def test_add_shift_rule(client, app):
+    rv = add_rule(client, exceptions=[MONDAY + 7 * DAY + 3600])
+    assert rv.status_code == 200
+    rule_id = rv.get_json()['rule_id']
+
+    with app.app_context():
+        rules = shift_rules.load_rules(get_db(), [1])[1]
+
+    assert [(rule.id, rule.start_day, rule.end_day, rule.exceptions) for rule in rules] == [
+        (rule_id, MONDAY, None, frozenset([MONDAY + 7 * DAY]))]
+
+    # Only the rule window is loaded
+    with app.app_context():
+        assert shift_rules.load_rules(get_db(), [1], end=MONDAY - 1) == {1: []}
+
+
+def test_add_shift_rule_validate(client):
+    assert add_rule(client, start_time=10 * 3600, end_time=9 * 3600).status_code == 400
+    assert add_rule(client, end_time=DAY + 1).status_code == 400
+    assert add_rule(client, weekdays=[]).status_code == 400
+    assert add_rule(client, weekdays=[8]).status_code == 400
+    assert add_rule(client, end_day=MONDAY - DAY).status_code == 400
+
+    rv = client.post('/doctor/hours/rules', data=json.dumps(dict(doctor_id=1)),
+                     content_type='application/json')
+    assert rv.status_code == 400
+
+
+def test_shift_rule_slots_and_booking(client):
+    start, end = MONDAY + 9 * 3600, MONDAY + 10 * 3600
+
+    # No shift yet, so nothing to book
+    rv = client.get('/doctors/1/free_slots?start={}&end={}'.format(start, end))
+    assert rv.get_json()['slots'] == []
+
+    rule_id = add_rule(client).get_json()['rule_id']
+
+    # Every Monday from the rule's start
+    for week in (0, 52):
+        rv = client.get('/doctors/1/free_slots?start={}&end={}'.format(
+            start + week * 7 * DAY, end + week * 7 * DAY))
+        assert rv.get_json()['slots'] == [start + week * 7 * DAY + slot * 900 for slot in range(4)]
+
+    rv = client.post('/doctors/make_appointment/',
+                     data=json.dumps(dict(doctor_id=1, location_id=1, apmnt_time=start)),
+                     content_type='application/json')
+    assert isinstance(rv.get_json()['Appointment ID: '], int)
+
+    # Skipping the next Monday takes its slots away
+    rv = client.post('/doctor/hours/rules/exceptions',
+                     data=json.dumps(dict(rule_id=rule_id, day=start + 7 * DAY)),
+                     content_type='application/json')
+    assert rv.status_code == 200
+    assert rv.get_json()['day'] == MONDAY + 7 * DAY
+
+    rv = client.get('/doctors/1/free_slots?start={}&end={}'.format(
+        start + 7 * DAY, end + 7 * DAY))
+    assert rv.get_json()['slots'] == []
+
+    rv = client.post('/doctors/make_appointment/',
+                     data=json.dumps(dict(doctor_id=1, location_id=1, apmnt_time=start + 7 * DAY)),
+                     content_type='application/json')
+    assert rv.get_json()['Appointment ID: '] == \
+        'Doctor Unavailable; please select a different time.'
+
+
+def test_shift_rule_exception_unknown_rule(client):
+    rv = client.post('/doctor/hours/rules/exceptions',
+                     data=json.dumps(dict(rule_id=12345, day=MONDAY)),
+                     content_type='application/json')
+    assert rv.status_code == 404
+
+
+def test_shift_rule_in_schedule(client, app):
+    add_rule(client)
+
+    with app.app_context():
+        hours, appointments = schedules.build_day(get_db(), 1, MONDAY + 3600)
+
+    hours = json.loads(hours)
+    assert [(hour['day_stamp'], hour['shift_start'], hour['shift_end']) for hour in hours] == [
+        (MONDAY, MONDAY + 9 * 3600, MONDAY + 10 * 3600)]
+    assert hours[0]['first_name'] and hours[0]['last_name']
+
+
+def test_shift_rule_added_by_another_process(app, client):
+    # The booking index of this app holds doctor 1's schedule from before
+    # the rule was added through another app on the same database
+    other_app = create_app({'TESTING': True, 'DATABASE': app.config['DATABASE']})
+
+    def book(apmnt_time):
+        rv = client.post('/doctors/make_appointment/',
+                         data=json.dumps(dict(doctor_id=1, location_id=1, apmnt_time=apmnt_time)),
+                         content_type='application/json')
+        return rv.get_json()['Appointment ID: ']
+
+    assert not isinstance(book(MONDAY + 9 * 3600), int)
+
+    rule_id = add_rule(other_app.test_client()).get_json()['rule_id']
+    assert isinstance(book(MONDAY + 9 * 3600), int)
+
+    # and so are its exceptions
+    other_app.test_client().post('/doctor/hours/rules/exceptions',
+                                 data=json.dumps(dict(rule_id=rule_id, day=MONDAY + 7 * DAY)),
+                                 content_type='application/json')
+    assert not isinstance(book(MONDAY + 7 * DAY + 9 * 3600), int)
+
+    close_pool(other_app)
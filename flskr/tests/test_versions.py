@@ -0,0 +1,75 @@
+import json
+
+from in_database import create_app
+from in_database.db import close_pool
+
+
+def test_weekly_schedule_not_modified(client):
+    rv = client.get('/doctors/weekly_schedule/0')
+    assert rv.status_code == 200
+    etag = rv.headers['ETag']
+
+    rv = client.get('/doctors/weekly_schedule/0', headers={'If-None-Match': etag})
+    assert rv.status_code == 304
+    assert rv.data == b''
+
+    # A write for another doctor leaves the ETag alone
+    client.post('/doctors/locations/assign',
+        data=json.dumps(dict(location_id='0', doctor_id='1')),
+        content_type='application/json')
+    rv = client.get('/doctors/weekly_schedule/0', headers={'If-None-Match': etag})
+    assert rv.status_code == 304
+
+    # ...but one for this doctor changes it
+    client.post('/doctors/locations/assign',
+        data=json.dumps(dict(location_id='1', doctor_id='0')),
+        content_type='application/json')
+    rv = client.get('/doctors/weekly_schedule/0', headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+    assert rv.headers['ETag'] != etag
+
+
+def test_appointments_etag_changes_on_booking(client):
+    rv = client.get('/doctors/appointment/0')
+    etag = rv.headers['ETag']
+
+    client.post('/doctors/make_appointment/',
+        data=json.dumps(dict(doctor_id='0', location_id='0', apmnt_time='1560298281')),
+        content_type='application/json')
+
+    rv = client.get('/doctors/appointment/0', headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+    assert len(json.loads(rv.data)) == 2
+
+
+def test_doctor_list_etag(client):
+    etag = client.get('/doctors').headers['ETag']
+    assert client.get('/doctors', headers={'If-None-Match': etag}).status_code == 304
+
+    client.post('/doctors',
+        data=json.dumps(dict(first_name='Elmer', last_name='Hartman')),
+        content_type='application/json')
+    assert client.get('/doctors', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_cached_body_matches_etag_across_processes(app, client):
+    # Another app on the same database stands in for another worker; its
+    # write does not reach this app's read cache
+    other_app = create_app({'TESTING': True, 'DATABASE': app.config['DATABASE']})
+
+    for url in ('/doctors/0', '/doctors', '/doctors?ids=0,1'):
+        client.get(url)
+
+    other_app.test_client().post('/doctors/update',
+        data=json.dumps(dict(doctor_id=0, first_name='Buggs', last_name='Bunny')),
+        content_type='application/json')
+
+    for url in ('/doctors/0', '/doctors', '/doctors?ids=0,1'):
+        rv = client.get(url)
+        body = json.loads(rv.data)
+        assert (body if isinstance(body, dict) else body[0])['first_name'] == 'Buggs'
+
+        # the ETag sent with the new body is the one later checks match
+        assert client.get(url, headers={'If-None-Match': rv.headers['ETag']}).status_code == 304
+
+    close_pool(other_app)